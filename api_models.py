@@ -0,0 +1,134 @@
+"""
+Typed SMS-Activate replies
+Replies are parsed once in SMSActivateAPI; handlers dispatch on ApiError values instead of scanning strings
+"""
+
+import json
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Optional
+
+# Plain-text codes (with their :<suffix>) are short; longer replies are JSON payloads
+MAX_CODE_LENGTH = 64
+
+
+class ApiError(str, Enum):
+    """Plain-text codes SMS-Activate answers with instead of JSON"""
+    NO_NUMBERS = 'NO_NUMBERS'
+    NO_BALANCE = 'NO_BALANCE'
+    NO_ACTIVATION = 'NO_ACTIVATION'
+    STATUS_CANCEL = 'STATUS_CANCEL'  # not a failure: the activation was cancelled or expired
+    EARLY_CANCEL_DENIED = 'EARLY_CANCEL_DENIED'
+    BAD_SERVICE = 'BAD_SERVICE'
+    BAD_STATUS = 'BAD_STATUS'
+    BAD_KEY = 'BAD_KEY'
+    BAD_ACTION = 'BAD_ACTION'
+    ERROR_SQL = 'ERROR_SQL'
+    WRONG_ACTIVATION_ID = 'WRONG_ACTIVATION_ID'
+    WRONG_MAX_PRICE = 'WRONG_MAX_PRICE'
+    WRONG_EXCEPTION_PHONE = 'WRONG_EXCEPTION_PHONE'
+    ORDER_ALREADY_EXISTS = 'ORDER_ALREADY_EXISTS'
+    CHANNELS_LIMIT = 'CHANNELS_LIMIT'
+    BANNED = 'BANNED'
+    UNKNOWN = 'UNKNOWN'  # any other reply that is not the expected JSON
+
+    @classmethod
+    def parse(cls, reply: str) -> 'ApiError':
+        """Code of a plain-text reply (WRONG_MAX_PRICE:<min> and BANNED:<date> carry a suffix)"""
+        if len(reply) > MAX_CODE_LENGTH or reply.startswith(('{', '[')):
+            return cls.UNKNOWN  # Not a code: skip copying and splitting a catalog-sized body
+        try:
+            return cls(reply.strip().split(':', 1)[0])
+        except ValueError:
+            return cls.UNKNOWN
+
+
+def _json_reply(reply: str) -> Optional[Dict]:
+    """The reply as a JSON object, or None if it is a plain-text code"""
+    try:
+        data = json.loads(reply)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@dataclass(slots=True)
+class NumberResult:
+    """Reply to getNumberV2"""
+    activation_id: Optional[str] = None
+    phone_number: Optional[str] = None
+    cost: float = 0  # what the provider charges, in its currency
+    country_code: Optional[str] = None
+    error: Optional[ApiError] = None
+    reply: str = ''  # raw reply text, for error messages
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @classmethod
+    def from_reply(cls, reply: str) -> 'NumberResult':
+        """Parse a getNumberV2 reply"""
+        data = _json_reply(reply)
+        if data is None or 'activationId' not in data:
+            return cls(error=ApiError.parse(reply), reply=reply)
+        return cls(
+            activation_id=str(data['activationId']),
+            phone_number=data.get('phoneNumber'),
+            cost=data.get('activationCost', 0),
+            country_code=data.get('countryCode'),
+            reply=reply
+        )
+
+    def activation_data(self, service: str) -> Dict:
+        """Fields Database.add_activation stores"""
+        return {
+            'activationId': self.activation_id,
+            'phoneNumber': self.phone_number,
+            'countryCode': self.country_code,
+            'service': service
+        }
+
+
+@dataclass(slots=True)
+class StatusResult:
+    """Reply to getStatusV2; code is set once an SMS with a code has arrived"""
+    verification_type: int = 0  # 0 - SMS, 1 - call number, 2 - voice call
+    code: Optional[str] = None
+    text: Optional[str] = None
+    date_time: Optional[str] = None
+    error: Optional[ApiError] = None
+    reply: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @classmethod
+    def from_reply(cls, reply: str) -> 'StatusResult':
+        """Parse a getStatusV2 reply"""
+        data = _json_reply(reply)
+        if data is None:
+            return cls(error=ApiError.parse(reply), reply=reply)
+        result = cls(verification_type=data.get('verificationType', 0), reply=reply)
+        sms = data.get('sms') or {}
+        if result.verification_type == 0 and sms.get('code'):
+            result.code = sms.get('code')
+            result.text = sms.get('text', 'N/A')
+            result.date_time = sms.get('dateTime', 'N/A')
+        return result
+
+
+@dataclass(slots=True)
+class CancelResult:
+    """Reply to setStatus with the cancel status"""
+    cancelled: bool = False
+    error: Optional[ApiError] = None
+    reply: str = ''
+
+    @classmethod
+    def from_reply(cls, reply: str) -> 'CancelResult':
+        """Parse a setStatus(8) reply"""
+        if reply.strip().startswith('ACCESS_CANCEL'):
+            return cls(cancelled=True, reply=reply)
+        return cls(error=ApiError.parse(reply), reply=reply)
@@ -0,0 +1,198 @@
+"""
+Cold archive for old transaction and activation history
+Each closed month is sealed into an immutable gzip JSONL segment per record kind
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Field holding the ISO timestamp of each record kind
+TIME_KEYS = {
+    'transactions': 'timestamp',
+    'activations': 'created_at'
+}
+
+SEGMENT_PATTERN = re.compile(r'^(transactions|activations)-(\d{4}-\d{2})\.jsonl\.gz$')
+
+
+class HistoryArchive:
+    """Sealed monthly segments, loaded lazily and kept in a small LRU cache"""
+
+    def __init__(self, directory: str, cache_size: int = 4,
+                 normalize: Optional[Callable[[Dict], Dict]] = None):
+        self.directory = directory
+        self.normalize = normalize  # Applied to records read from older segments
+        self.manifest_file = os.path.join(directory, 'manifest.json')
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _segment_path(self, kind: str, month: str) -> str:
+        """Path of the segment file for one kind and month"""
+        return os.path.join(self.directory, f"{kind}-{month}.jsonl.gz")
+
+    def _load_manifest(self) -> Dict:
+        """Load the manifest and reconcile it with the segment files on disk"""
+        manifest = {kind: {} for kind in TIME_KEYS}
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    manifest.update(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading archive manifest, rebuilding it: {e}")
+
+        # The segment files are the source of truth, the manifest is a summary of them
+        on_disk = set()
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                on_disk.add((match.group(1), match.group(2)))
+
+        changed = False
+        for kind in TIME_KEYS:
+            for month in list(manifest[kind]):
+                if (kind, month) not in on_disk:
+                    del manifest[kind][month]
+                    changed = True
+        for kind, month in on_disk:
+            if month not in manifest[kind]:
+                manifest[kind][month] = self._summarize(self._read_segment(kind, month))
+                changed = True
+
+        if changed:
+            self._write_manifest(manifest)
+        return manifest
+
+    def _write_manifest(self, manifest: Dict):
+        """Atomically replace the manifest"""
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_file, self.manifest_file)
+
+    def _summarize(self, records: List[Dict]) -> Dict:
+        """Record count and per-user counts of one segment"""
+        users: Dict[str, int] = {}
+        for record in records:
+            key = str(record['user_id'])
+            users[key] = users.get(key, 0) + 1
+        return {'count': len(records), 'users': users}
+
+    def _read_segment(self, kind: str, month: str) -> List[Dict]:
+        """Read a segment from disk"""
+        with gzip.open(self._segment_path(kind, month), 'rt', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if self.normalize:
+            records = [self.normalize(record) for record in records]
+        return records
+
+    def has_segment(self, kind: str, month: str) -> bool:
+        """Check if a month is already sealed"""
+        return month in self.manifest[kind]
+
+    def seal(self, kind: str, month: str, records: List[Dict]):
+        """Write an immutable segment for one month"""
+        records = sorted(records, key=lambda x: x[TIME_KEYS[kind]])
+        path = self._segment_path(kind, month)
+        tmp_file = path + '.tmp'
+        with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        with open(tmp_file, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+        with self._lock:
+            self.manifest[kind][month] = self._summarize(records)
+            self._write_manifest(self.manifest)
+        logger.info(f"Sealed {len(records)} {kind} from {month} into {path}")
+
+    def append(self, kind: str, month: str, records: List[Dict]):
+        """Seal records into a month, merging with its segment if there is one already"""
+        if self.has_segment(kind, month):
+            # A record already in the segment (a previous run that stopped before
+            # the snapshot was saved) is not added a second time
+            existing = self._read_segment(kind, month)
+            sealed = Counter(_record_key(record) for record in existing)
+            added = []
+            for record in records:
+                key = _record_key(record)
+                if sealed[key]:
+                    sealed[key] -= 1
+                else:
+                    added.append(record)
+            if not added:
+                return
+            records = existing + added
+        self.seal(kind, month, records)
+        with self._lock:
+            self._cache.pop((kind, month), None)
+
+    def load(self, kind: str, month: str) -> List[Dict]:
+        """Load a segment (sorted oldest first), using the LRU cache"""
+        key = (kind, month)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        records = self._read_segment(kind, month)
+        with self._lock:
+            self._cache[key] = records
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return records
+
+    def months(self, kind: str) -> List[str]:
+        """Sealed months, oldest first"""
+        return sorted(self.manifest[kind])
+
+    def count(self, kind: str) -> int:
+        """Total number of archived records of a kind"""
+        return sum(summary['count'] for summary in self.manifest[kind].values())
+
+    def iter_range(self, kind: str, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict]:
+        """Archived records with start <= time < end (ISO), oldest first, streamed line by line past the cache"""
+        time_key = TIME_KEYS[kind]
+        for month in self.months(kind):
+            if start and month < start[:7]:
+                continue
+            if end and month > end[:7]:
+                return
+            with gzip.open(self._segment_path(kind, month), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if self.normalize:
+                        record = self.normalize(record)
+                    if start and record[time_key] < start:
+                        continue
+                    if end and record[time_key] >= end:
+                        return  # Segments are sorted, and later months are later still
+                    yield record
+
+    def iter_newest(self, kind: str, user_id: int = None) -> Iterator[Dict]:
+        """Archived records newest first, loading only the segments that are reached"""
+        for month in reversed(self.months(kind)):
+            if user_id is not None and str(user_id) not in self.manifest[kind][month]['users']:
+                continue
+            for record in reversed(self.load(kind, month)):
+                if user_id is None or record['user_id'] == user_id:
+                    yield record
+
+
+def _record_key(record: Dict) -> str:
+    """Identity of a record for merging segments"""
+    return json.dumps(record, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,171 @@
+"""
+Asyncio client for the SMS-Activate API
+Same methods as SMSActivateAPI in bot.py, awaited; for jobs that fan out many requests at once.
+Pass the bot's api.limiter and api.breaker to share its request budget and circuit; without them
+the client is standalone. Failed calls are not retried: batch callers get the error per call.
+"""
+
+import asyncio
+import json
+from typing import Dict, Iterable, Optional
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # Only needed by the async client; the bot itself runs on requests
+    aiohttp = None
+
+from api_models import ApiError, CancelResult, NumberResult, StatusResult
+from circuit_breaker import CircuitBreaker
+from rate_limiter import Lane, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Requests in flight at once (also the number of pooled connections)
+ASYNC_API_MAX_CONCURRENCY = 20
+
+
+class AsyncSMSActivateAPI:
+    """Asyncio wrapper for SMS-Activate API"""
+
+    BASE_URL = "https://api.sms-activate.ae/stubs/handler_api.php"
+
+    def __init__(self, api_key: str, timeout: float = 10, connect_timeout: float = 5,
+                 max_concurrency: int = ASYNC_API_MAX_CONCURRENCY, base_url: Optional[str] = None,
+                 limiter: Optional[RateLimiter] = None, breaker: Optional[CircuitBreaker] = None):
+        if aiohttp is None:
+            raise ImportError("AsyncSMSActivateAPI needs aiohttp: pip install -r requirements-async.txt")
+        self.api_key = api_key
+        self.base_url = base_url or self.BASE_URL
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional['aiohttp.ClientSession'] = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """The shared session, opened on first use inside the running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        """Close the pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> 'AsyncSMSActivateAPI':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _make_request(self, action: str, **params) -> str:
+        """Make a request to SMS-Activate API"""
+        params['api_key'] = self.api_key
+        params['action'] = action
+        params = {key: str(value) for key, value in params.items()}
+
+        if self.breaker:
+            self.breaker.check()
+        async with self._semaphore:
+            if self.limiter:
+                await self._take_token()
+            try:
+                async with self._get_session().get(self.base_url, params=params) as response:
+                    response.raise_for_status()
+                    result = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"API request failed: {e}")
+                if self.breaker and _is_transient(e):
+                    self.breaker.record_failure(f"{action} failed: {type(e).__name__}")
+                raise
+        if self.breaker:
+            self.breaker.record_success()
+        return result
+
+    async def _take_token(self):
+        """Wait for a limiter token without blocking the loop; bulk jobs go behind the bot's own calls"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waited = 0.0
+        while True:
+            wait = self.limiter.try_acquire(Lane.BACKGROUND, waited)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+            waited = loop.time() - started
+
+    async def _request_json(self, action: str, **params) -> Dict:
+        """Make a request and parse the JSON answer ({"error": text} if it is not JSON)"""
+        result = await self._make_request(action, **params)
+        try:
+            return json.loads(result)
+        except json.JSONDecodeError:
+            return {"error": result}
+
+    async def get_balance(self) -> str:
+        """Get account balance"""
+        return await self._make_request('getBalance')
+
+    async def get_services_list(self, country: Optional[str] = None, lang: str = 'en') -> Dict:
+        """Get list of available services"""
+        params = {'lang': lang}
+        if country:
+            params['country'] = country
+        return await self._request_json('getServicesList', **params)
+
+    async def get_countries(self) -> Dict:
+        """Get list of all countries"""
+        return await self._request_json('getCountries')
+
+    async def get_prices(self, service: Optional[str] = None, country: Optional[str] = None) -> Dict:
+        """Get current prices by country"""
+        params = {}
+        if service:
+            params['service'] = service
+        if country:
+            params['country'] = country
+        return await self._request_json('getPrices', **params)
+
+    async def get_number_v2(self, service: str, country: str, **kwargs) -> NumberResult:
+        """Request a virtual number (v2 with more details)"""
+        params = {
+            'service': service,
+            'country': country
+        }
+        params.update(kwargs)
+        return NumberResult.from_reply(await self._make_request('getNumberV2', **params))
+
+    async def get_status_v2(self, activation_id: str) -> StatusResult:
+        """Get activation status v2 (with more details)"""
+        return StatusResult.from_reply(await self._make_request('getStatusV2', id=activation_id))
+
+    async def set_status(self, activation_id: str, status: int) -> str:
+        """Change activation status"""
+        return await self._make_request('setStatus', id=activation_id, status=status)
+
+    async def cancel_activation(self, activation_id: str) -> CancelResult:
+        """Cancel an activation (setStatus 8)"""
+        return CancelResult.from_reply(await self.set_status(activation_id, 8))
+
+    async def get_statuses_v2(self, activation_ids: Iterable[str]) -> Dict[str, StatusResult]:
+        """Status of many activations at once, at most max_concurrency requests in flight"""
+        activation_ids = list(activation_ids)
+        results = await asyncio.gather(*(self.get_status_v2(activation_id) for activation_id in activation_ids),
+                                       return_exceptions=True)
+        return {
+            activation_id: StatusResult(error=ApiError.UNKNOWN, reply=str(result) or type(result).__name__)
+            if isinstance(result, Exception) else result
+            for activation_id, result in zip(activation_ids, results)
+        }
+
+
+def _is_transient(error: Exception) -> bool:
+    """Network errors, timeouts, 429 and 5xx: the failures that count against the circuit"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
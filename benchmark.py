@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Storage backend benchmark
+Replays a synthetic bot workload against each backend and reports ops/s and latency
+
+Usage:
+    python benchmark.py                                   # 10k, 100k and 1M users
+    python benchmark.py --sizes 10000 --ops 5000 --backends json sqlite
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from database import open_database
+
+# Operation mix of a busy bot: mostly lookups, some purchases
+WORKLOAD = (
+    ('get_or_create_user', 40),
+    ('get_user_transactions', 30),
+    ('deduct_balance', 20),
+    ('add_activation', 10)
+)
+
+# name -> open_database() arguments
+BACKEND_OPTIONS = {
+    'json': {'backend': 'json'},
+    'json-journal': {'backend': 'json', 'journal': True},
+    'sqlite': {'backend': 'sqlite'},
+    'dbm': {'backend': 'dbm'}
+}
+
+DB_FILES = {'json': 'users.json', 'sqlite': 'users.db', 'dbm': 'users.dbm'}
+
+
+def make_dataset(path: str, size: int, seed: int):
+    """Write a users.json with `size` users and `size` transactions over the last 30 days"""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=30)
+    created_at = start.isoformat()
+    users = {
+        str(user_id): {
+            'user_id': user_id,
+            'username': f'user{user_id}',
+            'first_name': 'Bench',
+            'balance_cents': rng.randint(0, 50000),
+            'language': rng.choice(('en', 'ru', 'uz')),
+            'created_at': created_at,
+            'total_spent_cents': 0,
+            'total_activations': 0
+        }
+        for user_id in range(1, size + 1)
+    }
+    step = timedelta(days=30) / size
+    transactions = [
+        {
+            'user_id': rng.randint(1, size),
+            'amount_cents': rng.randint(10, 5000),
+            'type': rng.choice(('add', 'deduct')),
+            'description': 'Synthetic',
+            'timestamp': (start + step * i).isoformat()
+        }
+        for i in range(size)
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'schema_version': 2, 'users': users, 'transactions': transactions, 'activations': []}, f)
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    """Latency at a fraction of the sorted list"""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def run_workload(db, size: int, ops: int, seed: int) -> Dict[str, List[float]]:
+    """Run the operation mix and collect latencies (seconds) per operation"""
+    rng = random.Random(seed)
+    names = [name for name, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+
+    for i, name in enumerate(rng.choices(names, weights, k=ops)):
+        # ~10% of lookups hit users that don't exist yet
+        user_id = rng.randint(1, size + size // 10)
+        started = time.perf_counter()
+        if name == 'get_or_create_user':
+            db.get_or_create_user(user_id, f'user{user_id}', 'Bench')
+        elif name == 'get_user_transactions':
+            db.get_user_transactions(user_id, limit=10)
+        elif name == 'deduct_balance':
+            db.deduct_balance(user_id, rng.randint(10, 500), 'Benchmark purchase')
+        else:
+            db.add_activation(user_id, {
+                'activationId': f'bench{i}',
+                'phoneNumber': f'7900{rng.randint(1000000, 9999999)}',
+                'service': rng.choice(('tg', 'wa', 'vk', 'go')),
+                'countryCode': rng.randint(0, 200)
+            }, rng.randint(10, 500))
+        latencies[name].append(time.perf_counter() - started)
+    return latencies
+
+
+def benchmark(backend: str, dataset: str, size: int, ops: int, seed: int) -> Dict:
+    """Open one backend on a copy of the dataset, run the workload, close it"""
+    options = BACKEND_OPTIONS[backend]
+    workdir = tempfile.mkdtemp(prefix=f'bench-{backend}-')
+    cwd = os.getcwd()
+    try:
+        # Every backend imports (or loads) users.json from its working directory
+        shutil.copy(dataset, os.path.join(workdir, 'users.json'))
+        os.chdir(workdir)
+
+        started = time.perf_counter()
+        db = open_database(db_file=DB_FILES[options['backend']], **options)
+        load_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = run_workload(db, size, ops, seed)
+        run_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        db.close()
+        close_time = time.perf_counter() - started
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    everything = sorted(latency for values in latencies.values() for latency in values)
+    return {
+        'backend': backend,
+        'size': size,
+        'load': load_time,
+        'close': close_time,
+        'ops_per_sec': ops / run_time if run_time else 0.0,
+        'p99': percentile(everything, 0.99),
+        'per_op': {name: (len(values), percentile(sorted(values), 0.5), percentile(sorted(values), 0.99))
+                   for name, values in latencies.items()}
+    }
+
+
+def print_result(result: Dict):
+    """Print one backend/size result"""
+    print(f"{result['backend']:<13} {result['size']:>9,} users | load {result['load']:7.2f}s | "
+          f"{result['ops_per_sec']:>9,.0f} ops/s | p99 {result['p99'] * 1000:8.3f} ms | "
+          f"close {result['close']:6.2f}s")
+    for name, (count, p50, p99) in result['per_op'].items():
+        print(f"    {name:<22} {count:>7} ops  p50 {p50 * 1000:8.3f} ms  p99 {p99 * 1000:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends with a synthetic workload")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="users (and seed transactions) per run")
+    parser.add_argument('--ops', type=int, default=20000, help="operations per run")
+    parser.add_argument('--backends', nargs='+', default=list(BACKEND_OPTIONS),
+                        choices=list(BACKEND_OPTIONS))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    workload = ', '.join(f"{name} {weight}%" for name, weight in WORKLOAD)
+    print(f"Workload: {workload}; {args.ops} ops per run\n")
+
+    for size in args.sizes:
+        datadir = tempfile.mkdtemp(prefix='bench-data-')
+        try:
+            dataset = os.path.join(datadir, 'users.json')
+            started = time.perf_counter()
+            make_dataset(dataset, size, args.seed)
+            print(f"Dataset: {size:,} users / {size:,} transactions "
+                  f"({os.path.getsize(dataset) / 1e6:.1f} MB, built in {time.perf_counter() - started:.1f}s)")
+            for backend in args.backends:
+                print_result(benchmark(backend, dataset, size, args.ops, args.seed))
+            print()
+        finally:
+            shutil.rmtree(datadir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
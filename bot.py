@@ -7,15 +7,27 @@ A bot to interact with SMS-Activate API with user balance management
 import os
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import threading
-from datetime import datetime
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, Dict, Any, List
 import telebot
 from telebot import types
 import json
 
-from database import Database
+from database import Database, open_database
+from export import EXPORT_FORMATS, export_to_file
+from file_lock import FileLockTimeout
+from money import apply_multipliers, format_money, to_cents
+from rate_limiter import Lane, RateLimiter
+from api_models import ApiError, CancelResult, NumberResult, StatusResult
+from circuit_breaker import CLOSED, OPEN, CircuitOpenError, CircuitBreaker
+from retry_policy import RetryCounters, backoff_delay, is_connect_failure, is_transient
+from single_flight import SingleFlight
+from user_context import UserContext, UserContextMiddleware
 from languages import LANGUAGES, get_text, get_language_keyboard
 from keyboards import (
     get_main_keyboard, 
@@ -28,7 +40,8 @@ from keyboards import (
     get_countries_keyboard,
     get_services_keyboard,
     get_confirmation_keyboard,
-    get_order_action_keyboard
+    get_order_action_keyboard,
+    get_history_keyboard
 )
 
 # Configure logging
@@ -63,13 +76,36 @@ FAILED_ORDERS_CLEANUP_INTERVAL = 180  # seconds (3 minutes)
 
 # ANTI-ABUSE SYSTEM
 # Block users who accumulate $20+ in failed purchases for 20 minutes
-FAILED_PURCHASE_THRESHOLD = 20.0  # USD
+FAILED_PURCHASE_THRESHOLD = 2000  # cents ($20)
 FAILED_PURCHASE_BLOCK_TIME = 1200  # seconds (20 minutes)
-SAFETY_BALANCE_MULTIPLIER = 2.0  # User needs 2x price to bypass block
+SAFETY_BALANCE_MULTIPLIER = 2  # User needs 2x price to bypass block
 
 # AUTO-REFUND SYSTEM
 # Check for expired orders and automatically refund users
 AUTO_REFUND_CHECK_INTERVAL = 300  # seconds (5 minutes)
+
+# API CONNECTIONS
+# Kept-alive connections to the SMS-Activate API: one per worker thread,
+# plus one each for the cleanup and auto-refund threads
+API_BACKGROUND_THREADS = 2
+# Calls per second to the SMS-Activate API across the whole process, and the burst allowed on top.
+# When the budget is spent, purchases go first, then order checks, catalog refreshes and background jobs
+API_RATE_LIMIT = 10  # requests per second
+API_RATE_BURST = 20
+# Retries of failed API calls, with exponential backoff and jitter between attempts
+API_RETRY_ATTEMPTS = 3  # retries after the first attempt
+API_RETRY_BASE_DELAY = 0.5  # seconds
+API_RETRY_MAX_DELAY = 4  # seconds
+# Circuit breaker: after this many failed calls in a row (timeouts, 5xx) API calls fail at once,
+# and after a NO_BALANCE number purchases do (status checks and cancels keep working);
+# the provider is probed again every API_BREAKER_RESET_TIMEOUT seconds
+API_BREAKER_FAILURES = 5
+API_BREAKER_RESET_TIMEOUT = 60  # seconds
+
+# HISTORY PAGES
+# Transactions per page of /history and /allhistory (Next/Previous buttons page through the rest)
+HISTORY_PAGE_SIZE = 10
+ALL_HISTORY_PAGE_SIZE = 20
 # ================================
 
 
@@ -78,21 +114,126 @@ class SMSActivateAPI:
     
     BASE_URL = "https://api.sms-activate.ae/stubs/handler_api.php"
     
-    def __init__(self, api_key: str):
+    # Rate-limiter lane of each action when the calling thread has not chosen one
+    ACTION_LANES = {
+        'getNumberV2': Lane.PURCHASE,
+        'setStatus': Lane.PURCHASE,
+        'getStatusV2': Lane.STATUS,
+        'getBalance': Lane.STATUS,
+        'getCountries': Lane.CATALOG,
+        'getServicesList': Lane.CATALOG,
+        'getPrices': Lane.CATALOG
+    }
+    
+    # Actions safe to repeat after any transient failure; the rest (getNumberV2 would buy a
+    # second number) are retried only when the request never left this machine
+    IDEMPOTENT_ACTIONS = {'getStatusV2', 'getPrices', 'getCountries', 'getServicesList', 'getBalance'}
+    CANCEL_STATUS = 8  # setStatus to cancel is idempotent too
+    
+    # Catalog downloads: concurrent identical calls are coalesced into one request
+    COALESCED_ACTIONS = {'getPrices', 'getCountries', 'getServicesList'}
+    
+    def __init__(self, api_key: str, timeout: float = 10, connect_timeout: float = 5, pool_size: int = 10,
+                 rate_limit: float = API_RATE_LIMIT, rate_burst: int = API_RATE_BURST,
+                 retry_attempts: int = API_RETRY_ATTEMPTS):
         self.api_key = api_key
+        self.timeout = (connect_timeout, timeout)
+        self.limiter = RateLimiter(rate_limit, rate_burst)
+        self.retry_attempts = retry_attempts
+        self.retries = RetryCounters()
+        self.breaker = CircuitBreaker(API_BREAKER_FAILURES, API_BREAKER_RESET_TIMEOUT, self._probe)
+        # Purchases only: closes again once the account has money
+        self.purchase_gate = CircuitBreaker(1, API_BREAKER_RESET_TIMEOUT, self._probe_balance)
+        self.flights = SingleFlight()
+        self._thread_lane = threading.local()
+        # One session for every call: connections (and their TLS handshakes) are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def close(self):
+        """Close the pooled connections"""
+        self.breaker.close()
+        self.purchase_gate.close()
+        self.session.close()
+    
+    @contextmanager
+    def lane(self, lane: Lane):
+        """Send this thread's calls through `lane` (e.g. Lane.BACKGROUND for housekeeping threads)"""
+        previous = getattr(self._thread_lane, 'lane', None)
+        self._thread_lane.lane = lane
+        try:
+            yield
+        finally:
+            self._thread_lane.lane = previous
         
     def _make_request(self, action: str, **params) -> str:
         """Make a request to SMS-Activate API"""
-        params['api_key'] = self.api_key
-        params['action'] = action
+        if action in self.COALESCED_ACTIONS:
+            # Users hitting a cold catalog at once share one download
+            key = (action, tuple(sorted(params.items())))
+            return self.flights.do(key, lambda: self._call(action, **params))
+        return self._call(action, **params)
+    
+    def _call(self, action: str, **params) -> str:
+        """Make one call through the circuit breaker"""
+        self.breaker.check()
+        if action == 'getNumberV2':
+            self.purchase_gate.check()
+        lane = getattr(self._thread_lane, 'lane', None)
+        if lane is None:
+            lane = self.ACTION_LANES.get(action, Lane.BACKGROUND)
         
         try:
-            response = requests.get(self.BASE_URL, params=params, timeout=10)
-            response.raise_for_status()
-            return response.text
+            result = self._send(action, lane, **params)
         except requests.exceptions.RequestException as e:
-            logger.error(f"API request failed: {e}")
+            if is_transient(e):
+                self.breaker.record_failure(f"{action} failed: {type(e).__name__}")
             raise
+        self.breaker.record_success()
+        if action == 'getNumberV2' and ApiError.parse(result) == ApiError.NO_BALANCE:
+            # Every purchase fails until the account is topped up
+            self.purchase_gate.record_failure("NO_BALANCE: the SMS-Activate account is empty", fatal=True)
+        return result
+    
+    def _send(self, action: str, lane: Lane, **params) -> str:
+        """Send one call, retrying what the action's policy allows"""
+        params['api_key'] = self.api_key
+        params['action'] = action
+        idempotent = action in self.IDEMPOTENT_ACTIONS or (
+            action == 'setStatus' and str(params.get('status')) == str(self.CANCEL_STATUS))
+        
+        attempt = 0
+        while True:
+            self.limiter.acquire(lane)
+            try:
+                response = self.session.get(self.BASE_URL, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                if attempt:
+                    self.retries.record(action, 'recovered')
+                return response.text
+            except requests.exceptions.RequestException as e:
+                retryable = is_transient(e) if idempotent else is_connect_failure(e)
+                if not retryable or attempt >= self.retry_attempts:
+                    if attempt:
+                        self.retries.record(action, 'gave_up')
+                    logger.error(f"API request failed: {e}")
+                    raise
+                delay = backoff_delay(attempt, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY)
+                attempt += 1
+                self.retries.record(action, 'retries')
+                logger.warning(f"API {action} failed ({e}), retry {attempt}/{self.retry_attempts} in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def _probe(self, reason: str) -> bool:
+        """Circuit breaker probe: is the provider answering?"""
+        return self._send('getBalance', Lane.BACKGROUND).startswith('ACCESS_BALANCE')
+    
+    def _probe_balance(self, reason: str) -> bool:
+        """Purchase gate probe: is there money on the account again?"""
+        result = self._send('getBalance', Lane.BACKGROUND)
+        return result.startswith('ACCESS_BALANCE') and float(result.split(':', 1)[1]) > 0
     
     def get_balance(self) -> str:
         """Get account balance"""
@@ -132,7 +273,7 @@ class SMSActivateAPI:
         except json.JSONDecodeError:
             return {"error": result}
     
-    def get_number_v2(self, service: str, country: str, **kwargs) -> Dict:
+    def get_number_v2(self, service: str, country: str, **kwargs) -> NumberResult:
         """Request a virtual number (v2 with more details)"""
         params = {
             'service': service,
@@ -140,33 +281,35 @@ class SMSActivateAPI:
         }
         params.update(kwargs)
         
-        result = self._make_request('getNumberV2', **params)
-        try:
-            return json.loads(result)
-        except json.JSONDecodeError:
-            return {"error": result}
+        return NumberResult.from_reply(self._make_request('getNumberV2', **params))
     
-    def get_status_v2(self, activation_id: str) -> Dict:
+    def get_status_v2(self, activation_id: str) -> StatusResult:
         """Get activation status v2 (with more details)"""
-        result = self._make_request('getStatusV2', id=activation_id)
-        try:
-            return json.loads(result)
-        except json.JSONDecodeError:
-            return {"error": result}
+        return StatusResult.from_reply(self._make_request('getStatusV2', id=activation_id))
     
     def set_status(self, activation_id: str, status: int) -> str:
         """Change activation status"""
         return self._make_request('setStatus', id=activation_id, status=status)
+    
+    def cancel_activation(self, activation_id: str) -> CancelResult:
+        """Cancel an activation (setStatus 8)"""
+        return CancelResult.from_reply(self.set_status(activation_id, self.CANCEL_STATUS))
 
 
 class SMSActivateBot:
     """Telegram bot for SMS-Activate with user management"""
     
-    def __init__(self, bot_token: str, api_key: str, superuser_id: int):
-        self.bot = telebot.TeleBot(bot_token)
-        self.api = SMSActivateAPI(api_key)
-        self.db = Database()
+    def __init__(self, bot_token: str, api_key: str, superuser_id: int, db=None,
+                 worker_threads: int = 2, api_timeout: float = 10, api_connect_timeout: float = 5):
+        self.bot = telebot.TeleBot(bot_token, use_class_middlewares=True, num_threads=worker_threads)
+        self.api = SMSActivateAPI(api_key, timeout=api_timeout, connect_timeout=api_connect_timeout,
+                                  pool_size=worker_threads + API_BACKGROUND_THREADS)
+        self.db = db or Database()
+        # Handlers get the sender's user, language, balance and role resolved once per update
+        self.bot.setup_middleware(UserContextMiddleware(self.db, superuser_id))
         self.superuser_id = superuser_id
+        self.api.breaker.on_transition = partial(self._alert_api_circuit, "SMS-Activate API")
+        self.api.purchase_gate.on_transition = partial(self._alert_api_circuit, "Number purchases")
         self.superuser_username = None  # Will be fetched
         self.user_states = {}  # Store user conversation states
         self.cached_countries = None  # Cache countries data
@@ -192,201 +335,205 @@ class SMSActivateBot:
         """Register all command and message handlers"""
         
         @self.bot.message_handler(commands=['start', 'help'])
-        def send_welcome(message):
-            self.handle_start(message)
+        def send_welcome(message, ctx):
+            self.handle_start(message, ctx)
         
         @self.bot.message_handler(commands=['language'])
-        def change_language(message):
-            self.handle_language(message)
+        def change_language(message, ctx):
+            self.handle_language(message, ctx)
         
         @self.bot.message_handler(commands=['balance'])
-        def send_balance(message):
-            self.handle_balance(message)
+        def send_balance(message, ctx):
+            self.handle_balance(message, ctx)
         
         @self.bot.message_handler(commands=['deposit'])
-        def request_deposit(message):
-            self.handle_deposit(message)
+        def request_deposit(message, ctx):
+            self.handle_deposit(message, ctx)
         
         @self.bot.message_handler(commands=['services'])
-        def send_services(message):
-            self.handle_services(message)
+        def send_services(message, ctx):
+            self.handle_services(message, ctx)
         
         @self.bot.message_handler(commands=['countries'])
-        def send_countries(message):
-            self.handle_countries(message)
+        def send_countries(message, ctx):
+            self.handle_countries(message, ctx)
         
         @self.bot.message_handler(commands=['prices'])
-        def send_prices(message):
-            self.handle_prices(message)
+        def send_prices(message, ctx):
+            self.handle_prices(message, ctx)
         
         @self.bot.message_handler(commands=['buy'])
-        def buy_number(message):
-            self.handle_buy(message)
+        def buy_number(message, ctx):
+            self.handle_buy(message, ctx)
         
         @self.bot.message_handler(commands=['myorders'])
-        def my_orders(message):
-            self.handle_myorders(message)
+        def my_orders(message, ctx):
+            self.handle_myorders(message, ctx)
         
         @self.bot.message_handler(commands=['check'])
-        def check_status(message):
-            self.handle_check(message)
+        def check_status(message, ctx):
+            self.handle_check(message, ctx)
         
         @self.bot.message_handler(commands=['cancel'])
-        def cancel_order(message):
-            self.handle_cancel(message)
+        def cancel_order(message, ctx):
+            self.handle_cancel(message, ctx)
         
         @self.bot.message_handler(commands=['history'])
-        def transaction_history(message):
-            self.handle_history(message)
+        def transaction_history(message, ctx):
+            self.handle_history(message, ctx)
         
         # Superuser commands
         @self.bot.message_handler(commands=['stats'])
-        def show_stats(message):
-            self.handle_stats(message)
+        def show_stats(message, ctx):
+            self.handle_stats(message, ctx)
         
         @self.bot.message_handler(commands=['users'])
-        def list_users(message):
-            self.handle_users(message)
+        def list_users(message, ctx):
+            self.handle_users(message, ctx)
         
         @self.bot.message_handler(commands=['addbalance'])
-        def add_balance(message):
-            self.handle_addbalance(message)
+        def add_balance(message, ctx):
+            self.handle_addbalance(message, ctx)
         
         @self.bot.message_handler(commands=['deductbalance'])
-        def deduct_balance(message):
-            self.handle_deductbalance(message)
+        def deduct_balance(message, ctx):
+            self.handle_deductbalance(message, ctx)
         
         @self.bot.message_handler(commands=['mainbalance'])
-        def main_balance(message):
-            self.handle_mainbalance(message)
+        def main_balance(message, ctx):
+            self.handle_mainbalance(message, ctx)
         
         @self.bot.message_handler(commands=['allhistory'])
-        def all_history(message):
-            self.handle_allhistory(message)
+        def all_history(message, ctx):
+            self.handle_allhistory(message, ctx)
+        
+        @self.bot.message_handler(commands=['export'])
+        def export(message, ctx):
+            self.handle_export(message, ctx)
         
         @self.bot.callback_query_handler(func=lambda call: True)
-        def callback_handler(call):
-            self.handle_callback(call)
+        def callback_handler(call, ctx):
+            self.handle_callback(call, ctx)
         
         # Main menu button handlers
         @self.bot.message_handler(func=lambda message: message.text in [
             "🛒 Purchase", "🛒 Покупка", "🛒 Sotib olish"
         ])
-        def button_purchase_menu(message):
-            self.handle_purchase_menu(message)
+        def button_purchase_menu(message, ctx):
+            self.handle_purchase_menu(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "💰 Balance", "💰 Баланс", "💰 Balans"
         ])
-        def button_balance_menu(message):
-            self.handle_balance_menu(message)
+        def button_balance_menu(message, ctx):
+            self.handle_balance_menu(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "⚙️ Settings", "⚙️ Настройки", "⚙️ Sozlamalar"
         ])
-        def button_settings_menu(message):
-            self.handle_settings_menu(message)
+        def button_settings_menu(message, ctx):
+            self.handle_settings_menu(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "🔐 Superuser", "🔐 Суперпользователь", "🔐 Supermenejer"
         ])
-        def button_superuser_menu(message):
-            self.handle_superuser_menu(message)
+        def button_superuser_menu(message, ctx):
+            self.handle_superuser_menu(message, ctx)
         
         # Back to main menu button
         @self.bot.message_handler(func=lambda message: message.text in [
             "🔙 Back to Main Menu", "🔙 Главное меню", "🔙 Назад в главное меню", "🔙 Asosiy menyu"
         ])
-        def button_back_main(message):
-            self.handle_back_to_main(message)
+        def button_back_main(message, ctx):
+            self.handle_back_to_main(message, ctx)
         
         # Purchase submenu handlers
         @self.bot.message_handler(func=lambda message: message.text in [
             "🛍️ Buy Number", "🛍️ Купить номер", "🛍️ Raqam sotib olish"
         ])
-        def button_buy(message):
-            self.handle_buy_button(message)
+        def button_buy(message, ctx):
+            self.handle_buy_button(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "📊 My Orders", "📊 Мои заказы", "📊 Buyurtmalarim"
         ])
-        def button_myorders(message):
-            self.handle_myorders(message)
+        def button_myorders(message, ctx):
+            self.handle_myorders(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "📋 Services", "📋 Сервисы", "📋 Xizmatlar"
         ])
-        def button_services(message):
-            self.handle_services(message)
+        def button_services(message, ctx):
+            self.handle_services(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "🌍 Countries", "🌍 Страны", "🌍 Davlatlar"
         ])
-        def button_countries(message):
-            self.handle_countries(message)
+        def button_countries(message, ctx):
+            self.handle_countries(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "💵 Prices", "💵 Цены", "💵 Narxlar"
         ])
-        def button_prices(message):
-            self.handle_prices(message)
+        def button_prices(message, ctx):
+            self.handle_prices(message, ctx)
         
         # Balance submenu handlers
         @self.bot.message_handler(func=lambda message: message.text in [
             "💳 Check Balance", "💳 Проверить баланс", "💳 Balansni tekshirish"
         ])
-        def button_check_balance(message):
-            self.handle_balance(message)
+        def button_check_balance(message, ctx):
+            self.handle_balance(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "➕ Deposit", "➕ Пополнить", "➕ To'ldirish"
         ])
-        def button_deposit(message):
-            self.handle_deposit(message)
+        def button_deposit(message, ctx):
+            self.handle_deposit(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "📜 Transaction History", "📜 История транзакций", "📜 Tranzaksiyalar tarixi"
         ])
-        def button_history(message):
-            self.handle_history(message)
+        def button_history(message, ctx):
+            self.handle_history(message, ctx)
         
         # Settings submenu handlers
         @self.bot.message_handler(func=lambda message: message.text in [
             "🌐 Change Language", "🌐 Изменить язык", "🌐 Tilni o'zgartirish"
         ])
-        def button_language(message):
-            self.handle_language(message)
+        def button_language(message, ctx):
+            self.handle_language(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "❓ Help", "❓ Помощь", "❓ Yordam"
         ])
-        def button_help(message):
-            self.handle_start(message)
+        def button_help(message, ctx):
+            self.handle_start(message, ctx)
         
         # Superuser submenu handlers
         @self.bot.message_handler(func=lambda message: message.text in [
             "📊 Statistics", "📊 Статистика", "📊 Statistika"
         ])
-        def button_stats(message):
-            self.handle_stats(message)
+        def button_stats(message, ctx):
+            self.handle_stats(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "👥 Users List", "👥 Список пользователей", "👥 Foydalanuvchilar ro'yxati"
         ])
-        def button_users(message):
-            self.handle_users(message)
+        def button_users(message, ctx):
+            self.handle_users(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "💎 API Balance", "💎 Баланс API", "💎 API balansi"
         ])
-        def button_mainbalance(message):
-            self.handle_mainbalance(message)
+        def button_mainbalance(message, ctx):
+            self.handle_mainbalance(message, ctx)
         
         @self.bot.message_handler(func=lambda message: message.text in [
             "📈 All Transactions", "📈 Все транзакции", "📈 Barcha tranzaksiyalar"
         ])
-        def button_allhistory(message):
-            self.handle_allhistory(message)
+        def button_allhistory(message, ctx):
+            self.handle_allhistory(message, ctx)
     
     def _fetch_superuser_info(self):
         """Fetch superuser username from Telegram"""
@@ -407,6 +554,19 @@ class SMSActivateBot:
         """Get admin contact info"""
         return self.superuser_username or f"User ID: {self.superuser_id}"
     
+    def _alert_api_circuit(self, what: str, old_state: str, new_state: str, reason: str):
+        """Tell the superuser when the SMS-Activate API (or buying numbers) goes down or comes back"""
+        # Probes flip open <-> half_open every reset timeout; only outages and recoveries are news
+        if old_state == CLOSED and new_state == OPEN:
+            text = (f"⚠️ {what} unavailable\n\n{reason}\n\n"
+                    f"Users are told the service is temporarily unavailable. "
+                    f"Checking again every {API_BREAKER_RESET_TIMEOUT}s.")
+        elif new_state == CLOSED:
+            text = f"✅ {what} available again"
+        else:
+            return
+        self.bot.send_message(self.superuser_id, text)
+    
     def log_to_channel(self, message: str, user_id: int = None, username: str = None):
         """Send log message to LOG_CHANNEL"""
         try:
@@ -434,7 +594,8 @@ class SMSActivateBot:
             while True:
                 try:
                     time.sleep(FAILED_ORDERS_CLEANUP_INTERVAL)
-                    self._cancel_failed_orders()
+                    with self.api.lane(Lane.BACKGROUND):
+                        self._cancel_failed_orders()
                 except Exception as e:
                     logger.error(f"Error in cleanup thread: {e}")
         
@@ -459,8 +620,8 @@ class SMSActivateBot:
                 
                 # Try to cancel
                 try:
-                    result = self.api.set_status(activation_id, 8)
-                    if 'ACCESS_CANCEL' in str(result):
+                    result = self.api.cancel_activation(activation_id)
+                    if result.cancelled:
                         cancelled_count += 1
                         logger.info(f"Successfully cancelled failed order {activation_id}")
                     else:
@@ -497,19 +658,19 @@ class SMSActivateBot:
                 if not self.failed_purchases_tracker[user_id]:
                     del self.failed_purchases_tracker[user_id]
     
-    def track_failed_purchase(self, user_id: int, amount: float):
-        """Track a failed purchase attempt"""
+    def track_failed_purchase(self, user_id: int, amount: int):
+        """Track a failed purchase attempt (amount in cents)"""
         with self.failed_purchases_lock:
             if user_id not in self.failed_purchases_tracker:
                 self.failed_purchases_tracker[user_id] = []
             self.failed_purchases_tracker[user_id].append((amount, time.time()))
-            logger.info(f"Tracked failed purchase for user {user_id}: ${amount:.2f}")
+            logger.info(f"Tracked failed purchase for user {user_id}: ${format_money(amount)}")
     
-    def get_failed_purchases_total(self, user_id: int) -> float:
-        """Get total failed purchase amount for user in last 20 minutes"""
+    def get_failed_purchases_total(self, user_id: int) -> int:
+        """Get total failed purchase amount (in cents) for user in last 20 minutes"""
         with self.failed_purchases_lock:
             if user_id not in self.failed_purchases_tracker:
-                return 0.0
+                return 0
             
             current_time = time.time()
             total = sum(
@@ -518,10 +679,10 @@ class SMSActivateBot:
             )
             return total
     
-    def is_user_blocked(self, user_id: int, required_amount: float, user_balance: float) -> tuple:
+    def is_user_blocked(self, user_id: int, required_amount: int, user_balance: int) -> tuple:
         """
-        Check if user is blocked from purchasing
-        Returns: (is_blocked: bool, reason: str, failed_total: float)
+        Check if user is blocked from purchasing (amounts in cents)
+        Returns: (is_blocked: bool, reason: str, failed_total: int)
         """
         failed_total = self.get_failed_purchases_total(user_id)
         
@@ -535,7 +696,7 @@ class SMSActivateBot:
             return (False, "", failed_total)
         
         # User is blocked
-        return (True, f"Too many failed purchases (${failed_total:.2f}). Need ${safety_amount:.2f} to proceed.", failed_total)
+        return (True, f"Too many failed purchases (${format_money(failed_total)}). Need ${format_money(safety_amount)} to proceed.", failed_total)
     
     def _start_autorefund_thread(self):
         """Start background thread to check for expired orders and auto-refund"""
@@ -543,7 +704,8 @@ class SMSActivateBot:
             while True:
                 try:
                     time.sleep(AUTO_REFUND_CHECK_INTERVAL)
-                    self._check_expired_orders()
+                    with self.api.lane(Lane.BACKGROUND):
+                        self._check_expired_orders()
                 except Exception as e:
                     logger.error(f"Error in auto-refund thread: {e}")
         
@@ -569,12 +731,12 @@ class SMSActivateBot:
                         
                         try:
                             # Check status from API
-                            status_result = self.api.get_status(activation_id)
+                            status_result = self.api.get_status_v2(activation_id)
                             
                             # If order is cancelled/expired by API
-                            if 'STATUS_CANCEL' in str(status_result):
+                            if status_result.error == ApiError.STATUS_CANCEL:
                                 # Refund user
-                                user_paid = float(activation.get('cost', 0))
+                                user_paid = activation.get('cost_cents') or 0
                                 phone_number = activation.get('phone_number', 'N/A')
                                 service = activation.get('service', 'N/A')
                                 
@@ -582,7 +744,7 @@ class SMSActivateBot:
                                 self.db.update_activation(activation_id, status='cancelled')
                                 
                                 refund_count += 1
-                                logger.info(f"Auto-refunded ${user_paid:.2f} to user {user_id} for expired order {activation_id}")
+                                logger.info(f"Auto-refunded ${format_money(user_paid)} to user {user_id} for expired order {activation_id}")
                                 
                                 # Log to channel
                                 self.log_to_channel(
@@ -590,7 +752,7 @@ class SMSActivateBot:
                                     f"🆔 **Order ID:** `{activation_id}`\n"
                                     f"📞 **Phone:** +{phone_number}\n"
                                     f"🔷 **Service:** {service}\n"
-                                    f"💰 **Refunded:** ${user_paid:.2f}\n"
+                                    f"💰 **Refunded:** ${format_money(user_paid)}\n"
                                     f"📝 **Reason:** Order expired (20 min timeout)",
                                     user_id=user_id,
                                     username=None
@@ -600,11 +762,11 @@ class SMSActivateBot:
                                 try:
                                     lang = self.get_user_lang(user_id)
                                     if lang == 'en':
-                                        notify_text = f"🔄 **Auto-Refund**\n\nOrder `{activation_id}` expired after 20 minutes.\n\n💰 Refunded: ${user_paid:.2f}"
+                                        notify_text = f"🔄 **Auto-Refund**\n\nOrder `{activation_id}` expired after 20 minutes.\n\n💰 Refunded: ${format_money(user_paid)}"
                                     elif lang == 'ru':
-                                        notify_text = f"🔄 **Авто-возврат**\n\nЗаказ `{activation_id}` истёк через 20 минут.\n\n💰 Возвращено: ${user_paid:.2f}"
+                                        notify_text = f"🔄 **Авто-возврат**\n\nЗаказ `{activation_id}` истёк через 20 минут.\n\n💰 Возвращено: ${format_money(user_paid)}"
                                     else:
-                                        notify_text = f"🔄 **Avto-qaytarish**\n\nBuyurtma `{activation_id}` 20 daqiqadan keyin tugadi.\n\n💰 Qaytarildi: ${user_paid:.2f}"
+                                        notify_text = f"🔄 **Avto-qaytarish**\n\nBuyurtma `{activation_id}` 20 daqiqadan keyin tugadi.\n\n💰 Qaytarildi: ${format_money(user_paid)}"
                                     
                                     self.bot.send_message(user_id, notify_text, parse_mode='Markdown')
                                 except Exception as e:
@@ -622,17 +784,22 @@ class SMSActivateBot:
     
     def get_prices_data(self):
         """Fetch and cache prices"""
-        if not self.cached_prices:
+        if self.cached_prices is None:
             try:
-                self.cached_prices = self.api.get_prices()
+                prices = self.api.get_prices()
+                if 'error' in prices:
+                    logger.error(f"Error fetching prices: {prices['error']}")
+                    return {}
+                self.cached_prices = prices
                 logger.info("Prices cached successfully")
             except Exception as e:
+                # Not cached: the next caller tries again
                 logger.error(f"Error fetching prices: {e}")
-                self.cached_prices = {}
+                return {}
         return self.cached_prices
     
-    def get_service_min_price(self, service_code: str) -> float:
-        """Get minimum price for a service across all countries"""
+    def get_service_min_price(self, service_code: str) -> int:
+        """Get minimum price (in cents) for a service across all countries"""
         prices = self.get_prices_data()
         min_price = float('inf')
         
@@ -653,10 +820,10 @@ class SMSActivateBot:
             return 0
         
         # Apply currency conversion and 2x markup (prices are estimates)
-        return min_price * CURRENCY_MULTIPLIER * PRICE_MULTIPLIER
+        return apply_multipliers(min_price, CURRENCY_MULTIPLIER, PRICE_MULTIPLIER)
     
-    def get_exact_price(self, service_code: str, country_id: str) -> float:
-        """Get exact price for service in specific country"""
+    def get_exact_price(self, service_code: str, country_id: str) -> int:
+        """Get exact price (in cents) for service in specific country"""
         prices = self.get_prices_data()
         
         if str(country_id) in prices:
@@ -669,9 +836,9 @@ class SMSActivateBot:
                     try:
                         cost_float = float(cost)
                         # Calculate display price (estimate only)
-                        final_price = cost_float * CURRENCY_MULTIPLIER * PRICE_MULTIPLIER
+                        final_price = apply_multipliers(cost, CURRENCY_MULTIPLIER, PRICE_MULTIPLIER)
                         # Log for debugging
-                        logger.info(f"Price for {service_code} in country {country_id}: getPrices={cost_float}, Display=${final_price:.2f} (ESTIMATE)")
+                        logger.info(f"Price for {service_code} in country {country_id}: getPrices={cost_float}, Display=${format_money(final_price)} (ESTIMATE)")
                         # Apply currency conversion and 2x markup
                         return final_price
                     except:
@@ -679,18 +846,13 @@ class SMSActivateBot:
         
         return 0
     
-    def is_superuser(self, user_id: int) -> bool:
-        """Check if user is superuser"""
-        return user_id == self.superuser_id
-    
     def get_user_lang(self, user_id: int) -> str:
         """Get user language"""
         return self.db.get_language(user_id)
     
-    def handle_purchase_menu(self, message):
+    def handle_purchase_menu(self, message, ctx: UserContext):
         """Handle Purchase main menu button"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = "🛒 " + ("Purchase Menu" if lang == 'en' else "Меню покупки" if lang == 'ru' else "Sotib olish menyusi")
         text += "\n\n" + ("Choose an option:" if lang == 'en' else "Выберите опцию:" if lang == 'ru' else "Tanlang:")
@@ -698,10 +860,9 @@ class SMSActivateBot:
         keyboard = get_purchase_submenu(lang)
         self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
     
-    def handle_balance_menu(self, message):
+    def handle_balance_menu(self, message, ctx: UserContext):
         """Handle Balance main menu button"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = "💰 " + ("Balance Menu" if lang == 'en' else "Меню баланса" if lang == 'ru' else "Balans menyusi")
         text += "\n\n" + ("Choose an option:" if lang == 'en' else "Выберите опцию:" if lang == 'ru' else "Tanlang:")
@@ -709,10 +870,9 @@ class SMSActivateBot:
         keyboard = get_balance_submenu(lang)
         self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
     
-    def handle_settings_menu(self, message):
+    def handle_settings_menu(self, message, ctx: UserContext):
         """Handle Settings main menu button"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = "⚙️ " + ("Settings Menu" if lang == 'en' else "Меню настроек" if lang == 'ru' else "Sozlamalar menyusi")
         text += "\n\n" + ("Choose an option:" if lang == 'en' else "Выберите опцию:" if lang == 'ru' else "Tanlang:")
@@ -720,12 +880,11 @@ class SMSActivateBot:
         keyboard = get_settings_submenu(lang)
         self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
     
-    def handle_superuser_menu(self, message):
+    def handle_superuser_menu(self, message, ctx: UserContext):
         """Handle Superuser main menu button"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -736,25 +895,26 @@ class SMSActivateBot:
         keyboard = get_superuser_submenu(lang)
         self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
     
-    def handle_back_to_main(self, message):
+    def handle_back_to_main(self, message, ctx: UserContext):
         """Handle Back to Main Menu button"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = "🏠 " + ("Main Menu" if lang == 'en' else "Главное меню" if lang == 'ru' else "Asosiy menyu")
         
-        keyboard = get_admin_keyboard(lang) if self.is_superuser(user_id) else get_main_keyboard(lang)
+        keyboard = get_admin_keyboard(lang) if ctx.is_superuser else get_main_keyboard(lang)
         self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
     
-    def handle_start(self, message):
+    def handle_start(self, message, ctx: UserContext):
         """Handle /start and /help commands"""
         user_id = message.from_user.id
         username = message.from_user.username
         first_name = message.from_user.first_name
         
         # Create or get user
-        user = self.db.get_or_create_user(user_id, username, first_name)
-        lang = self.get_user_lang(user_id)
+        if ctx.user is None:
+            ctx.user = self.db.get_or_create_user(user_id, username, first_name)
+        user = ctx.user
+        lang = ctx.lang
         
         # If new user, show language selection first
         if user.get('language') == 'en' and 'created_at' in user:
@@ -786,7 +946,7 @@ class SMSActivateBot:
             welcome_text += f"Iltimos, xizmatdan foydalanishdan oldin diqqat bilan o'qing."
         
         # Get appropriate keyboard
-        if self.is_superuser(user_id):
+        if ctx.is_superuser:
             keyboard = get_admin_keyboard(lang)
             welcome_text += "\n\n🔐 *Superuser Commands:*\n"
             welcome_text += "/addbalance <user_id> <amount>\n"
@@ -801,9 +961,9 @@ class SMSActivateBot:
             reply_markup=keyboard
         )
     
-    def handle_language(self, message):
+    def handle_language(self, message, ctx: UserContext):
         """Handle /language command"""
-        lang = self.get_user_lang(message.from_user.id)
+        lang = ctx.lang
         text = get_text(lang, 'language_select')
         
         self.bot.send_message(
@@ -812,29 +972,27 @@ class SMSActivateBot:
             reply_markup=get_language_keyboard()
         )
     
-    def handle_balance(self, message):
+    def handle_balance(self, message, ctx: UserContext):
         """Handle /balance command"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        balance = self.db.get_balance(user_id)
-        text = get_text(lang, 'balance', balance=balance)
+        balance = ctx.balance
+        text = get_text(lang, 'balance', balance=format_money(balance))
         
-        keyboard = get_admin_keyboard(lang) if self.is_superuser(user_id) else get_main_keyboard(lang)
+        keyboard = get_admin_keyboard(lang) if ctx.is_superuser else get_main_keyboard(lang)
         self.bot.send_message(message.chat.id, text, parse_mode='Markdown', reply_markup=keyboard)
     
-    def handle_deposit(self, message):
+    def handle_deposit(self, message, ctx: UserContext):
         """Handle /deposit command"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = get_text(lang, 'deposit_request', user_id=user_id, admin=self.get_admin_contact())
         self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
     
-    def handle_services(self, message):
+    def handle_services(self, message, ctx: UserContext):
         """Handle /services command"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         try:
             loading = "🔄 Loading..." if lang == 'en' else "🔄 Загрузка..." if lang == 'ru' else "🔄 Yuklanmoqda..."
@@ -865,10 +1023,9 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_countries(self, message):
+    def handle_countries(self, message, ctx: UserContext):
         """Handle /countries command"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         try:
             loading = "🔄 Loading..." if lang == 'en' else "🔄 Загрузка..." if lang == 'ru' else "🔄 Yuklanmoqda..."
@@ -900,10 +1057,9 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_prices(self, message):
+    def handle_prices(self, message, ctx: UserContext):
         """Handle /prices command"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         parts = message.text.split()
         service = parts[1] if len(parts) > 1 else None
@@ -939,8 +1095,8 @@ class SMSActivateBot:
                             api_cost = details.get('cost', 0)
                             # Show user price (2x markup)
                             try:
-                                user_price = float(api_cost) * PRICE_MULTIPLIER
-                                cost_display = f"{user_price:.2f}"
+                                user_price = apply_multipliers(api_cost, PRICE_MULTIPLIER)
+                                cost_display = format_money(user_price)
                             except:
                                 cost_display = 'N/A'
                             quantity = details.get('count', 'N/A')
@@ -958,10 +1114,9 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_buy_button(self, message):
+    def handle_buy_button(self, message, ctx: UserContext):
         """Handle buy button press"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         text = "🛒 " + ("Choose how to buy:" if lang == 'en' else "Выберите способ покупки:" if lang == 'ru' else "Sotib olish usulini tanlang:")
         
@@ -971,10 +1126,10 @@ class SMSActivateBot:
             reply_markup=get_buy_method_keyboard(lang)
         )
     
-    def handle_buy(self, message):
+    def handle_buy(self, message, ctx: UserContext):
         """Handle /buy command (legacy support)"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         parts = message.text.split()
         
@@ -987,7 +1142,7 @@ class SMSActivateBot:
         country = parts[2]
         
         # Check user balance first
-        user_balance = self.db.get_balance(user_id)
+        user_balance = ctx.balance
         
         try:
             text = get_text(lang, 'buy_processing')
@@ -995,41 +1150,28 @@ class SMSActivateBot:
             
             result = self.api.get_number_v2(service, country)
             
-            if 'error' in result:
-                error_msg = result['error']
-                
-                if 'NO_NUMBERS' in error_msg:
+            if not result.ok:
+                if result.error == ApiError.NO_NUMBERS:
                     error_text = get_text(lang, 'buy_no_numbers')
-                elif 'NO_BALANCE' in error_msg:
+                elif result.error == ApiError.NO_BALANCE:
                     # This means SMS-Activate API account is empty (admin's problem)
-                    if lang == 'en':
-                        error_text = "❌ Service temporarily unavailable\n\nPlease try again later or contact admin."
-                    elif lang == 'ru':
-                        error_text = "❌ Сервис временно недоступен\n\nПопробуйте позже или свяжитесь с админом."
-                    else:
-                        error_text = "❌ Xizmat vaqtincha mavjud emas\n\nKeyinroq urinib ko'ring yoki admin bilan bog'laning."
-                    
-                    # Notify superuser
-                    try:
-                        admin_msg = f"⚠️ SMS-Activate API NO_BALANCE ERROR!\n\nUser {user_id} tried to buy {service} but your SMS-Activate account has insufficient balance.\n\nPlease top up your SMS-Activate account!"
-                        self.bot.send_message(self.superuser_id, admin_msg)
-                    except:
-                        pass
-                elif 'BAD_SERVICE' in error_msg:
+                    error_text = get_text(lang, 'service_unavailable')
+                    # The API purchase gate has alerted the superuser
+                elif result.error == ApiError.BAD_SERVICE:
                     error_text = get_text(lang, 'buy_invalid_service')
                 else:
-                    error_text = error_msg
+                    error_text = result.reply
                 
                 text = get_text(lang, 'buy_error', error=error_text)
                 self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
                 return
             
             # Extract data
-            activation_id = result.get('activationId', 'N/A')
-            phone_number = result.get('phoneNumber', 'N/A')
-            api_cost = float(result.get('activationCost', 0))  # What we pay to API
-            user_cost = api_cost * PRICE_MULTIPLIER  # What we charge user (2x profit)
-            country_code = result.get('countryCode', 'N/A')
+            activation_id = result.activation_id
+            phone_number = result.phone_number or 'N/A'
+            api_cost = result.cost  # What we pay to API
+            user_cost = apply_multipliers(api_cost, PRICE_MULTIPLIER)  # What we charge user, in cents (2x profit)
+            country_code = result.country_code or 'N/A'
             
             # Check if user has enough balance (using marked up price)
             if user_balance < user_cost:
@@ -1037,28 +1179,28 @@ class SMSActivateBot:
                 needed = user_cost - user_balance
                 if lang == 'en':
                     text = f"❌ **Insufficient Balance**\n\n"
-                    text += f"💰 **Actual Price:** ${user_cost:.2f}\n"
-                    text += f"💳 **Your Balance:** ${user_balance:.2f}\n"
-                    text += f"📉 **Needed:** ${needed:.2f}\n\n"
+                    text += f"💰 **Actual Price:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Your Balance:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Needed:** ${format_money(needed)}\n\n"
                     text += f"Please top up your balance with /deposit"
                 elif lang == 'ru':
                     text = f"❌ **Недостаточно Средств**\n\n"
-                    text += f"💰 **Фактическая цена:** ${user_cost:.2f}\n"
-                    text += f"💳 **Ваш баланс:** ${user_balance:.2f}\n"
-                    text += f"📉 **Требуется:** ${needed:.2f}\n\n"
+                    text += f"💰 **Фактическая цена:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Ваш баланс:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Требуется:** ${format_money(needed)}\n\n"
                     text += f"Пожалуйста, пополните баланс через /deposit"
                 else:
                     text = f"❌ **Balans Yetarli Emas**\n\n"
-                    text += f"💰 **Haqiqiy narx:** ${user_cost:.2f}\n"
-                    text += f"💳 **Sizning balansingiz:** ${user_balance:.2f}\n"
-                    text += f"📉 **Kerak:** ${needed:.2f}\n\n"
+                    text += f"💰 **Haqiqiy narx:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Sizning balansingiz:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Kerak:** ${format_money(needed)}\n\n"
                     text += f"Iltimos /deposit orqali balansni to'ldiring"
                 
                 self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
                 
                 # Cancel the activation
                 try:
-                    self.api.set_status(activation_id, 8)
+                    self.api.cancel_activation(activation_id)
                 except:
                     pass
                 return
@@ -1076,15 +1218,13 @@ class SMSActivateBot:
                 
                 # Cancel the activation
                 try:
-                    self.api.set_status(activation_id, 8)
+                    self.api.cancel_activation(activation_id)
                 except:
                     pass
                 return
             
             # Save activation (store what user paid, not API cost)
-            result['service'] = service
-            result['activationCost'] = user_cost  # Override with user's price
-            self.db.add_activation(user_id, result)
+            self.db.add_activation(user_id, result.activation_data(service), user_cost)
             
             # Send success message (show user their price, not API cost)
             text = get_text(
@@ -1094,19 +1234,23 @@ class SMSActivateBot:
                 phone=phone_number,
                 service=service,
                 country=country_code,
-                cost=user_cost
+                cost=format_money(user_cost)
             )
             self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
             
+        except CircuitOpenError as e:
+            logger.info(f"Purchase refused while the API circuit is open: {e}")
+            text = get_text(lang, 'buy_error', error=get_text(lang, 'service_unavailable'))
+            self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
         except Exception as e:
             logger.error(f"Error buying number: {e}")
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_myorders(self, message):
+    def handle_myorders(self, message, ctx: UserContext):
         """Handle My Orders - show active orders with inline buttons"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         # Get only active/waiting orders
         activations = self.db.get_user_activations(user_id, limit=20)
@@ -1160,20 +1304,15 @@ class SMSActivateBot:
         
         self.bot.send_message(message.chat.id, text, parse_mode='Markdown', reply_markup=markup)
     
-    def handle_order_view(self, call, activation_id):
+    def handle_order_view(self, call, ctx: UserContext, activation_id):
         """Show order details with check/cancel buttons"""
         user_id = call.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        # Get order from database
-        activations = self.db.get_user_activations(user_id)
-        order = None
-        for activation in activations:
-            if str(activation.get('activation_id')) == str(activation_id):
-                order = activation
-                break
+        # Get order from database (only the user's own orders)
+        order = self.db.get_activation(activation_id)
         
-        if not order:
+        if not order or order.get('user_id') != user_id:
             text = "❌ Order not found"
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id)
             return
@@ -1182,7 +1321,7 @@ class SMSActivateBot:
         order_id = order.get('activation_id', 'N/A')
         service = order.get('service', 'N/A')
         phone = order.get('phone_number', 'N/A')
-        cost = order.get('cost', 0)
+        cost = order.get('cost_cents') or 0
         status = order.get('status', 'active')
         
         # Get service name
@@ -1199,7 +1338,7 @@ class SMSActivateBot:
             text += f"**Order ID:** `{order_id}`\n"
             text += f"**Service:** {service_display}\n"
             text += f"**Phone:** `{phone}`\n"
-            text += f"**Cost:** ${cost:.2f}\n"
+            text += f"**Cost:** ${format_money(cost)}\n"
             text += f"**Status:** {status}\n\n"
             text += "⏳ Waiting for SMS..."
         elif lang == 'ru':
@@ -1207,7 +1346,7 @@ class SMSActivateBot:
             text += f"**ID Заказа:** `{order_id}`\n"
             text += f"**Сервис:** {service_display}\n"
             text += f"**Телефон:** `{phone}`\n"
-            text += f"**Цена:** ${cost:.2f}\n"
+            text += f"**Цена:** ${format_money(cost)}\n"
             text += f"**Статус:** {status}\n\n"
             text += "⏳ Ожидание SMS..."
         else:
@@ -1215,7 +1354,7 @@ class SMSActivateBot:
             text += f"**Buyurtma ID:** `{order_id}`\n"
             text += f"**Xizmat:** {service_display}\n"
             text += f"**Telefon:** `{phone}`\n"
-            text += f"**Narx:** ${cost:.2f}\n"
+            text += f"**Narx:** ${format_money(cost)}\n"
             text += f"**Holat:** {status}\n\n"
             text += "⏳ SMS kutilmoqda..."
         
@@ -1230,10 +1369,9 @@ class SMSActivateBot:
             reply_markup=keyboard
         )
     
-    def handle_check(self, message):
+    def handle_check(self, message, ctx: UserContext):
         """Handle /check command"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         parts = message.text.split()
         
@@ -1250,28 +1388,23 @@ class SMSActivateBot:
             
             status_result = self.api.get_status_v2(activation_id)
             
-            if 'error' in status_result:
-                error_msg = status_result['error']
-                
-                if 'STATUS_CANCEL' in error_msg:
+            if not status_result.ok:
+                if status_result.error == ApiError.STATUS_CANCEL:
                     text = get_text(lang, 'check_cancelled')
-                elif 'NO_ACTIVATION' in error_msg:
+                elif status_result.error == ApiError.NO_ACTIVATION:
                     text = get_text(lang, 'check_not_found')
                 else:
-                    text = f"⚠️ {error_msg}"
+                    text = f"⚠️ {status_result.reply}"
                 
                 self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
                 return
             
             # Parse status
-            verification_type = status_result.get('verificationType', 0)
-            
-            if verification_type == 0:
-                sms_data = status_result.get('sms', {})
-                if sms_data and sms_data.get('code'):
-                    code = sms_data.get('code', 'N/A')
-                    text = sms_data.get('text', 'N/A')
-                    date_time = sms_data.get('dateTime', 'N/A')
+            if status_result.verification_type == 0:
+                if status_result.code:
+                    code = status_result.code
+                    text = status_result.text
+                    date_time = status_result.date_time
                     
                     response = get_text(
                         lang,
@@ -1293,10 +1426,10 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_cancel(self, message):
+    def handle_cancel(self, message, ctx: UserContext):
         """Handle /cancel command"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         parts = message.text.split()
         
@@ -1311,24 +1444,23 @@ class SMSActivateBot:
             text = get_text(lang, 'cancel_processing')
             self.bot.send_message(message.chat.id, text)
             
-            result = self.api.set_status(activation_id, 8)
+            result = self.api.cancel_activation(activation_id)
             
-            if 'ACCESS_CANCEL' in result:
+            if result.cancelled:
                 # Find the activation and refund (refund what user paid)
-                for activation in self.db.get_user_activations(user_id):
-                    if str(activation.get('activation_id')) == str(activation_id):
-                        user_paid = float(activation.get('cost', 0))
-                        self.db.add_balance(user_id, user_paid, f"Refund for order {activation_id}")
-                        self.db.update_activation(activation_id, status='cancelled')
-                        break
+                activation = self.db.get_activation(activation_id)
+                if activation and activation.get('user_id') == user_id:
+                    user_paid = activation.get('cost_cents') or 0
+                    self.db.add_balance(user_id, user_paid, f"Refund for order {activation_id}")
+                    self.db.update_activation(activation_id, status='cancelled')
                 
                 text = get_text(lang, 'cancel_success')
-            elif 'EARLY_CANCEL_DENIED' in result:
+            elif result.error == ApiError.EARLY_CANCEL_DENIED:
                 text = get_text(lang, 'cancel_early')
-            elif 'NO_ACTIVATION' in result:
+            elif result.error == ApiError.NO_ACTIVATION:
                 text = get_text(lang, 'check_not_found')
             else:
-                text = get_text(lang, 'cancel_failed', error=result)
+                text = get_text(lang, 'cancel_failed', error=result.reply)
             
             self.bot.send_message(message.chat.id, text, parse_mode='Markdown')
             
@@ -1337,24 +1469,33 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.send_message(message.chat.id, text)
     
-    def handle_history(self, message):
+    def handle_history(self, message, ctx: UserContext):
         """Handle /history command"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        transactions = self.db.get_user_transactions(user_id, limit=10)
+        page = self.db.get_transactions_page(user_id, limit=HISTORY_PAGE_SIZE)
         
-        if not transactions:
+        if not page['items']:
             text = get_text(lang, 'history_empty')
             self.bot.send_message(message.chat.id, text)
             return
         
+        self.bot.send_message(
+            message.chat.id,
+            self._format_history(lang, page['items']),
+            parse_mode='Markdown',
+            reply_markup=get_history_keyboard('hist', page['older'], page['newer'])
+        )
+    
+    def _format_history(self, lang: str, transactions: List[Dict]) -> str:
+        """Text of one /history page"""
         response = get_text(lang, 'history_title')
         
         for trans in transactions:
             date = trans.get('timestamp', '')[:10]
             trans_type = "➕" if trans.get('type') == 'add' else "➖"
-            amount = trans.get('amount', 0)
+            amount = trans.get('amount_cents', 0)
             description = trans.get('description', '')
             
             response += get_text(
@@ -1362,20 +1503,19 @@ class SMSActivateBot:
                 'history_item',
                 date=date,
                 type=trans_type,
-                amount=amount,
+                amount=format_money(amount),
                 description=description
             )
         
-        self.bot.send_message(message.chat.id, response, parse_mode='Markdown')
+        return response
     
     # ========== SUPERUSER COMMANDS ==========
     
-    def handle_stats(self, message):
+    def handle_stats(self, message, ctx: UserContext):
         """Handle /stats command (superuser only)"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -1384,21 +1524,49 @@ class SMSActivateBot:
         
         response = get_text(lang, 'stats_title')
         response += f"👥 Total Users: {stats['total_users']}\n"
-        response += f"💰 Total Balance (Users): ${stats['total_balance']:.2f} USD\n"
-        response += f"💸 Total Spent: ${stats['total_spent']:.2f} USD\n"
+        response += f"💰 Total Balance (Users): ${format_money(stats['total_balance_cents'])} USD\n"
+        response += f"💸 Total Spent: ${format_money(stats['total_spent_cents'])} USD\n"
         response += f"📱 Total Activations: {stats['total_activations']}\n\n"
         response += f"📊 Today:\n"
         response += f"  • Transactions: {stats['today_transactions']}\n"
         response += f"  • Activations: {stats['today_activations']}\n"
         
+        analytics = self.db.get_analytics(days=7)
+        if analytics is not None:
+            response += "\n💵 Spent by users (last 7 days):\n"
+            for day, cents in analytics['revenue_by_day'].items():
+                response += f"  • {day}: ${format_money(cents)}\n"
+            if analytics['top_spenders']:
+                response += "\n🏆 Top spenders (last 7 days):\n"
+                for uid, cents in analytics['top_spenders']:
+                    response += f"  • `{uid}`: ${format_money(cents)}\n"
+            if analytics['service_volume']:
+                response += "\n🔷 Services (last 7 days):\n"
+                services = sorted(analytics['service_volume'].items(), key=lambda x: x[1][0], reverse=True)
+                for service, (count, cents) in services[:5]:
+                    response += f"  • {service or 'N/A'}: {count} orders, ${format_money(cents)}\n"
+        
+        response += "\n⏱ API queue (waited / calls, avg, max):\n"
+        for lane, lane_stats in self.api.limiter.stats().items():
+            response += (f"  • {lane}: {lane_stats['waited']}/{lane_stats['calls']}, "
+                         f"{lane_stats['avg_wait']:.2f}s, {lane_stats['max_wait']:.2f}s\n")
+        for name, breaker in (("API circuit", self.api.breaker), ("Purchases", self.api.purchase_gate)):
+            if breaker.state != CLOSED:
+                response += (f"\n🔌 {name} {breaker.state} for {time.monotonic() - breaker.opened_at:.0f}s: "
+                             f"{breaker.reason}\n")
+        retries = self.api.retries.stats()
+        if retries:
+            response += "\n🔁 API retries (retries / recovered / gave up):\n"
+            for action, counts in retries.items():
+                response += f"  • {action}: {counts['retries']}/{counts['recovered']}/{counts['gave_up']}\n"
+        
         self.bot.send_message(message.chat.id, response, parse_mode='Markdown')
     
-    def handle_users(self, message):
+    def handle_users(self, message, ctx: UserContext):
         """Handle /users command (superuser only)"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -1410,23 +1578,23 @@ class SMSActivateBot:
         for user in users[:20]:
             uid = user.get('user_id')
             username = user.get('username', 'N/A')
-            balance = user.get('balance', 0)
+            balance = user.get('balance_cents', 0)
             total_activations = user.get('total_activations', 0)
             
             response += f"• ID: `{uid}` @{username}\n"
-            response += f"  Balance: ${balance:.2f} USD | Orders: {total_activations}\n\n"
+            response += f"  Balance: ${format_money(balance)} USD | Orders: {total_activations}\n\n"
         
         if len(users) > 20:
             response += f"_...and {len(users) - 20} more users_"
         
         self.bot.send_message(message.chat.id, response, parse_mode='Markdown')
     
-    def handle_addbalance(self, message):
+    def handle_addbalance(self, message, ctx: UserContext):
         """Handle /addbalance command (superuser only)"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -1443,20 +1611,20 @@ class SMSActivateBot:
         
         try:
             target_user_id = int(parts[1])
-            amount = float(parts[2])
+            amount = to_cents(parts[2])
             
             self.db.add_balance(target_user_id, amount, f"Added by admin {user_id}")
             
             self.bot.send_message(
                 message.chat.id,
-                f"✅ Added ${amount:.2f} USD to user `{target_user_id}`",
+                f"✅ Added ${format_money(amount)} USD to user `{target_user_id}`",
                 parse_mode='Markdown'
             )
             
             # Log to channel
             self.log_to_channel(
                 f"➕ **Admin Added Balance**\n\n"
-                f"💰 **Amount:** +${amount:.2f} USD\n"
+                f"💰 **Amount:** +${format_money(amount)} USD\n"
                 f"👤 **Target User ID:** `{target_user_id}`",
                 user_id=user_id,
                 username=message.from_user.username
@@ -1465,11 +1633,11 @@ class SMSActivateBot:
             # Notify user
             try:
                 target_lang = self.get_user_lang(target_user_id)
-                notify_text = f"✅ Your balance has been updated!\n\n+${amount:.2f} USD added by administrator"
+                notify_text = f"✅ Your balance has been updated!\n\n+${format_money(amount)} USD added by administrator"
                 if target_lang == 'ru':
-                    notify_text = f"✅ Ваш баланс обновлён!\n\n+${amount:.2f} USD добавлено администратором"
+                    notify_text = f"✅ Ваш баланс обновлён!\n\n+${format_money(amount)} USD добавлено администратором"
                 elif target_lang == 'uz':
-                    notify_text = f"✅ Balansingiz yangilandi!\n\n+${amount:.2f} USD administrator tomonidan qo'shildi"
+                    notify_text = f"✅ Balansingiz yangilandi!\n\n+${format_money(amount)} USD administrator tomonidan qo'shildi"
                 
                 self.bot.send_message(target_user_id, notify_text)
             except:
@@ -1481,12 +1649,12 @@ class SMSActivateBot:
             logger.error(f"Error adding balance: {e}")
             self.bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
     
-    def handle_deductbalance(self, message):
+    def handle_deductbalance(self, message, ctx: UserContext):
         """Handle /deductbalance command (superuser only)"""
         user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -1503,21 +1671,21 @@ class SMSActivateBot:
         
         try:
             target_user_id = int(parts[1])
-            amount = float(parts[2])
+            amount = to_cents(parts[2])
             
             success = self.db.deduct_balance(target_user_id, amount, f"Deducted by admin {user_id}")
             
             if success:
                 self.bot.send_message(
                     message.chat.id,
-                    f"✅ Deducted ${amount:.2f} USD from user `{target_user_id}`",
+                    f"✅ Deducted ${format_money(amount)} USD from user `{target_user_id}`",
                     parse_mode='Markdown'
                 )
                 
                 # Log to channel
                 self.log_to_channel(
                     f"➖ **Admin Deducted Balance**\n\n"
-                    f"💰 **Amount:** -${amount:.2f} USD\n"
+                    f"💰 **Amount:** -${format_money(amount)} USD\n"
                     f"👤 **Target User ID:** `{target_user_id}`",
                     user_id=user_id,
                     username=message.from_user.username
@@ -1531,12 +1699,11 @@ class SMSActivateBot:
             logger.error(f"Error deducting balance: {e}")
             self.bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
     
-    def handle_mainbalance(self, message):
+    def handle_mainbalance(self, message, ctx: UserContext):
         """Handle /mainbalance command (superuser only)"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
@@ -1555,40 +1722,135 @@ class SMSActivateBot:
             logger.error(f"Error fetching balance: {e}")
             self.bot.send_message(message.chat.id, "❌ Failed to fetch main balance")
     
-    def handle_allhistory(self, message):
+    def handle_allhistory(self, message, ctx: UserContext):
         """Handle /allhistory command (superuser only)"""
-        user_id = message.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
-        if not self.is_superuser(user_id):
+        if not ctx.is_superuser:
             text = get_text(lang, 'admin_only')
             self.bot.send_message(message.chat.id, text)
             return
         
-        transactions = self.db.get_all_transactions(limit=20)
+        page = self.db.get_transactions_page(limit=ALL_HISTORY_PAGE_SIZE)
         
-        if not transactions:
+        if not page['items']:
             self.bot.send_message(message.chat.id, "📭 No transactions yet.")
             return
         
+        self.bot.send_message(
+            message.chat.id,
+            self._format_allhistory(page['items']),
+            parse_mode='Markdown',
+            reply_markup=get_history_keyboard('allhist', page['older'], page['newer'])
+        )
+    
+    def _format_allhistory(self, transactions: List[Dict]) -> str:
+        """Text of one /allhistory page"""
         response = "📜 *All Transactions*\n\n"
         
         for trans in transactions:
             uid = trans.get('user_id')
             date = trans.get('timestamp', '')[:10]
             trans_type = "➕" if trans.get('type') == 'add' else "➖"
-            amount = trans.get('amount', 0)
+            amount = trans.get('amount_cents', 0)
             description = trans.get('description', '')
             
-            response += f"• User `{uid}`: {trans_type} ${amount:.2f} USD\n"
+            response += f"• User `{uid}`: {trans_type} ${format_money(amount)} USD\n"
             response += f"  {date} - {description}\n\n"
         
-        self.bot.send_message(message.chat.id, response, parse_mode='Markdown')
+        return response
+    
+    def handle_history_page(self, call, ctx: UserContext, prefix: str, direction: str, cursor: str):
+        """Show the next (older) or previous (newer) page of /history or /allhistory in place"""
+        lang = ctx.lang
+        
+        if prefix == 'allhist' and not ctx.is_superuser:
+            self.bot.answer_callback_query(call.id, get_text(lang, 'admin_only'))
+            return
+        
+        # One page per click, walking the time index from the cursor on the button
+        user_id = None if prefix == 'allhist' else call.from_user.id
+        limit = ALL_HISTORY_PAGE_SIZE if prefix == 'allhist' else HISTORY_PAGE_SIZE
+        if direction == 'older':
+            page = self.db.get_transactions_page(user_id, limit, before=cursor)
+        else:
+            page = self.db.get_transactions_page(user_id, limit, after=cursor)
+        self.bot.answer_callback_query(call.id)
+        
+        if not page['items']:
+            return
+        text = self._format_allhistory(page['items']) if prefix == 'allhist' else \
+            self._format_history(lang, page['items'])
+        self.bot.edit_message_text(
+            text,
+            call.message.chat.id,
+            call.message.message_id,
+            parse_mode='Markdown',
+            reply_markup=get_history_keyboard(prefix, page['older'], page['newer'])
+        )
     
-    def handle_callback(self, call):
+    def handle_export(self, message, ctx: UserContext):
+        """Handle /export command (superuser only)"""
+        lang = ctx.lang
+        
+        if not ctx.is_superuser:
+            text = get_text(lang, 'admin_only')
+            self.bot.send_message(message.chat.id, text)
+            return
+        
+        parts = message.text.split()
+        # The format is optional: `/export transactions 2025-01-01` is a date range in CSV
+        args = parts[2:]
+        fmt = args.pop(0) if args and args[0] in EXPORT_FORMATS else 'csv'
+        
+        if len(parts) < 2 or parts[1] not in ('transactions', 'activations') or len(args) > 2:
+            self.bot.send_message(
+                message.chat.id,
+                "⚠️ *Usage:* `/export <transactions|activations> [csv|jsonl] [from YYYY-MM-DD] [to YYYY-MM-DD]`\n\n"
+                "*Example:* `/export transactions csv 2025-01-01 2025-01-31`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        kind = parts[1]
+        try:
+            start = datetime.strptime(args[0], '%Y-%m-%d') if len(args) > 0 else None
+            # The end date is inclusive: export up to the start of the next day
+            end = datetime.strptime(args[1], '%Y-%m-%d') + timedelta(days=1) if len(args) > 1 else None
+        except ValueError:
+            self.bot.send_message(message.chat.id, "❌ Dates must look like 2025-01-31")
+            return
+        
+        self.bot.send_message(message.chat.id, f"⏳ Exporting {kind}...")
+        # A large export takes a while: stream it on its own thread so this worker keeps serving updates
+        export_thread = threading.Thread(target=self._send_export, args=(message.chat.id, kind, fmt, start, end),
+                                         daemon=True)
+        export_thread.start()
+    
+    def _send_export(self, chat_id: int, kind: str, fmt: str, start: Optional[datetime], end: Optional[datetime]):
+        """Write an export file and upload it to the chat (runs on its own thread)"""
+        try:
+            path = export_to_file(self.db, kind, fmt, start, end)
+        except Exception as e:
+            logger.error(f"Error exporting {kind}: {e}")
+            self.bot.send_message(chat_id, "❌ Export failed")
+            return
+        
+        try:
+            # Telegram bots can upload files up to 50 MB; bigger exports stay on the server
+            if os.path.getsize(path) <= 50 * 1024 * 1024:
+                with open(path, 'rb') as f:
+                    self.bot.send_document(chat_id, f, caption=f"📤 {os.path.basename(path)}")
+            else:
+                self.bot.send_message(chat_id, f"📤 Export is too large for Telegram, saved on the server: `{path}`",
+                                      parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error sending export {path}: {e}")
+    
+    def handle_callback(self, call, ctx: UserContext):
         """Handle callback queries"""
         user_id = call.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         try:
             # Language selection
@@ -1632,7 +1894,7 @@ class SMSActivateBot:
                         welcome_text += f"Ushbu botdan foydalanishni davom ettirish orqali siz bizning [Maxfiylik Siyosati va Foydalanish Shartlarimizga]({privacy_link}) rozilik bildirasiz.\n\n"
                         welcome_text += f"Iltimos, xizmatdan foydalanishdan oldin diqqat bilan o'qing."
                     
-                    keyboard = get_admin_keyboard(lang_code) if self.is_superuser(user_id) else get_main_keyboard(lang_code)
+                    keyboard = get_admin_keyboard(lang_code) if ctx.is_superuser else get_main_keyboard(lang_code)
                     
                     self.bot.send_message(
                         call.message.chat.id,
@@ -1644,11 +1906,17 @@ class SMSActivateBot:
             # Buy method selection
             elif call.data == 'buy_country_first':
                 self.bot.answer_callback_query(call.id)
-                self.handle_buy_country_first(call)
+                self.handle_buy_country_first(call, ctx)
             
             elif call.data == 'buy_service_first':
                 self.bot.answer_callback_query(call.id)
-                self.handle_buy_service_first(call)
+                self.handle_buy_service_first(call, ctx)
+            
+            # History pages
+            elif call.data.startswith('hist_') or call.data.startswith('allhist_'):
+                # Format: {hist|allhist}_{older|newer}_{cursor}
+                prefix, direction, cursor = call.data.split('_', 2)
+                self.handle_history_page(call, ctx, prefix, direction, cursor)
             
             # Country selection
             elif call.data.startswith('country_'):
@@ -1656,12 +1924,12 @@ class SMSActivateBot:
                     # Pagination
                     page = int(call.data.split('_')[-1])
                     self.bot.answer_callback_query(call.id)
-                    self.handle_buy_country_first(call, page)
+                    self.handle_buy_country_first(call, ctx, page)
                 else:
                     # Country selected
                     country_id = call.data.split('_')[1]
                     self.bot.answer_callback_query(call.id)
-                    self.handle_country_selected(call, country_id)
+                    self.handle_country_selected(call, ctx, country_id)
             
             # Service pagination (after country)
             elif call.data.startswith('service_page_') and call.data.count('_') == 3:
@@ -1670,7 +1938,7 @@ class SMSActivateBot:
                 country_id = parts[2]
                 page = int(parts[3])
                 self.bot.answer_callback_query(call.id)
-                self.handle_country_selected_with_page(call, country_id, page)
+                self.handle_country_selected_with_page(call, ctx, country_id, page)
             
             # Purchase confirmation
             elif call.data.startswith('confirm_purchase_'):
@@ -1678,7 +1946,7 @@ class SMSActivateBot:
                 service_code = parts[2]
                 country_id = parts[3]
                 self.bot.answer_callback_query(call.id)
-                self.handle_purchase(call, service_code, country_id, confirmed=True)
+                self.handle_purchase(call, ctx, service_code, country_id, confirmed=True)
             
             # Service selection (after country) - show confirmation
             elif call.data.startswith('service_') and '_country_' in call.data:
@@ -1686,7 +1954,7 @@ class SMSActivateBot:
                 service_code = parts[1]
                 country_id = parts[3]
                 self.bot.answer_callback_query(call.id)
-                self.handle_purchase(call, service_code, country_id, confirmed=False)
+                self.handle_purchase(call, ctx, service_code, country_id, confirmed=False)
             
             # Service selection (service first flow)
             elif call.data.startswith('svc_'):
@@ -1694,12 +1962,12 @@ class SMSActivateBot:
                     # Pagination
                     page = int(call.data.split('_')[-1])
                     self.bot.answer_callback_query(call.id)
-                    self.handle_buy_service_first(call, page)
+                    self.handle_buy_service_first(call, ctx, page)
                 else:
                     # Service selected
                     service_code = call.data.split('_')[1]
                     self.bot.answer_callback_query(call.id)
-                    self.handle_service_selected(call, service_code)
+                    self.handle_service_selected(call, ctx, service_code)
             
             # Country pagination (after service)
             elif call.data.startswith('ctry_page_'):
@@ -1708,7 +1976,7 @@ class SMSActivateBot:
                 service_code = parts[2]
                 page = int(parts[3])
                 self.bot.answer_callback_query(call.id)
-                self.handle_service_selected(call, service_code, page)
+                self.handle_service_selected(call, ctx, service_code, page)
             
             # Country selection (after service) - show confirmation
             elif call.data.startswith('ctry_') and '_service_' in call.data:
@@ -1716,25 +1984,25 @@ class SMSActivateBot:
                 country_id = parts[1]
                 service_code = parts[3]
                 self.bot.answer_callback_query(call.id)
-                self.handle_purchase(call, service_code, country_id, confirmed=False)
+                self.handle_purchase(call, ctx, service_code, country_id, confirmed=False)
             
             # View order details from My Orders
             elif call.data.startswith('order_view_'):
                 activation_id = call.data.split('_')[2]
                 self.bot.answer_callback_query(call.id)
-                self.handle_order_view(call, activation_id)
+                self.handle_order_view(call, ctx, activation_id)
             
             # Check order status
             elif call.data.startswith('check_'):
                 activation_id = call.data.split('_')[1]
                 self.bot.answer_callback_query(call.id)
-                self.handle_check_callback(call, activation_id)
+                self.handle_check_callback(call, ctx, activation_id)
             
             # Cancel order
             elif call.data.startswith('cancel_'):
                 activation_id = call.data.split('_')[1]
                 self.bot.answer_callback_query(call.id)
-                self.handle_cancel_callback(call, activation_id)
+                self.handle_cancel_callback(call, ctx, activation_id)
             
             # Back button
             elif call.data == 'buy_back':
@@ -1751,7 +2019,7 @@ class SMSActivateBot:
             elif call.data == 'main_menu':
                 self.bot.answer_callback_query(call.id)
                 self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                keyboard = get_admin_keyboard(lang) if self.is_superuser(user_id) else get_main_keyboard(lang)
+                keyboard = get_admin_keyboard(lang) if ctx.is_superuser else get_main_keyboard(lang)
                 self.bot.send_message(
                     call.message.chat.id,
                     "🏠 " + ("Main Menu" if lang == 'en' else "Главное меню" if lang == 'ru' else "Asosiy menyu"),
@@ -1762,14 +2030,17 @@ class SMSActivateBot:
             logger.error(f"Callback error: {e}")
             self.bot.answer_callback_query(call.id, "Error occurred")
     
-    def handle_buy_country_first(self, call, page=0):
+    def handle_buy_country_first(self, call, ctx: UserContext, page=0):
         """Handle buying by choosing country first"""
-        lang = self.get_user_lang(call.from_user.id)
+        lang = ctx.lang
         
         # Get countries if not cached
-        if not self.cached_countries:
+        if self.cached_countries is None:
             try:
-                self.cached_countries = self.api.get_countries()
+                countries = self.api.get_countries()
+                if 'error' in countries:
+                    raise ValueError(countries['error'])
+                self.cached_countries = countries
             except Exception as e:
                 logger.error(f"Error fetching countries: {e}")
                 self.bot.send_message(call.message.chat.id, "❌ Error loading countries")
@@ -1786,16 +2057,17 @@ class SMSActivateBot:
             reply_markup=keyboard
         )
     
-    def handle_buy_service_first(self, call, page=0):
+    def handle_buy_service_first(self, call, ctx: UserContext, page=0):
         """Handle buying by choosing service first"""
-        lang = self.get_user_lang(call.from_user.id)
+        lang = ctx.lang
         
         # Get services if not cached
-        if not self.cached_services:
+        if self.cached_services is None:
             try:
                 result = self.api.get_services_list(lang=lang)
-                if result.get('status') == 'success':
-                    self.cached_services = result.get('services', [])
+                if result.get('status') != 'success':
+                    raise ValueError(result.get('error', result.get('status')))
+                self.cached_services = result.get('services', [])
             except Exception as e:
                 logger.error(f"Error fetching services: {e}")
                 self.bot.send_message(call.message.chat.id, "❌ Error loading services")
@@ -1820,16 +2092,17 @@ class SMSActivateBot:
             reply_markup=keyboard
         )
     
-    def handle_country_selected(self, call, country_id, page=0):
+    def handle_country_selected(self, call, ctx: UserContext, country_id, page=0):
         """Handle when country is selected (show services for that country)"""
-        lang = self.get_user_lang(call.from_user.id)
+        lang = ctx.lang
         
         # Get services if not cached
-        if not self.cached_services:
+        if self.cached_services is None:
             try:
                 result = self.api.get_services_list(lang=lang)
-                if result.get('status') == 'success':
-                    self.cached_services = result.get('services', [])
+                if result.get('status') != 'success':
+                    raise ValueError(result.get('error', result.get('status')))
+                self.cached_services = result.get('services', [])
             except Exception as e:
                 logger.error(f"Error fetching services: {e}")
                 self.bot.send_message(call.message.chat.id, "❌ Error loading services")
@@ -1862,21 +2135,24 @@ class SMSActivateBot:
             reply_markup=keyboard
         )
     
-    def handle_country_selected_with_page(self, call, country_id, page):
+    def handle_country_selected_with_page(self, call, ctx: UserContext, country_id, page):
         """Handle pagination for services after country selection"""
-        self.handle_country_selected(call, country_id, page)
+        self.handle_country_selected(call, ctx, country_id, page)
     
-    def handle_service_selected(self, call, service_code, page=0):
+    def handle_service_selected(self, call, ctx: UserContext, service_code, page=0):
         """Handle when service is selected (show countries for that service)"""
-        lang = self.get_user_lang(call.from_user.id)
+        lang = ctx.lang
         
         # Store selected service in user state
         self.user_states[call.from_user.id] = {'service': service_code}
         
         # Get countries if not cached
-        if not self.cached_countries:
+        if self.cached_countries is None:
             try:
-                self.cached_countries = self.api.get_countries()
+                countries = self.api.get_countries()
+                if 'error' in countries:
+                    raise ValueError(countries['error'])
+                self.cached_countries = countries
             except Exception as e:
                 logger.error(f"Error fetching countries: {e}")
                 self.bot.send_message(call.message.chat.id, "❌ Error loading countries")
@@ -1921,7 +2197,7 @@ class SMSActivateBot:
             # Add approximate price for this service in this country
             price = self.get_exact_price(service_code, country['id'])
             if price > 0:
-                button_text = f"{button_text} - ~${price:.2f}"
+                button_text = f"{button_text} - ~${format_money(price)}"
             
             callback_data = f"ctry_{country['id']}_service_{service_code}"
             markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
@@ -1946,13 +2222,13 @@ class SMSActivateBot:
             reply_markup=markup
         )
     
-    def handle_purchase(self, call, service_code, country_id, confirmed=False):
+    def handle_purchase(self, call, ctx: UserContext, service_code, country_id, confirmed=False):
         """Handle actual purchase with confirmation"""
         user_id = call.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         # Check user balance first
-        user_balance = self.db.get_balance(user_id)
+        user_balance = ctx.balance
         
         # If not confirmed, show price and ask for confirmation
         if not confirmed:
@@ -1967,8 +2243,8 @@ class SMSActivateBot:
                     if isinstance(services, dict) and service_code in services:
                         service_data = services[service_code]
                         if isinstance(service_data, dict):
-                            api_price = float(service_data.get('retail') or service_data.get('cost', 0))
-                            estimated_cost = api_price * PRICE_MULTIPLIER
+                            api_price = service_data.get('retail') or service_data.get('cost', 0)
+                            estimated_cost = apply_multipliers(api_price, PRICE_MULTIPLIER)
                 
                 # Find service and country names
                 service_name = service_code
@@ -1992,28 +2268,28 @@ class SMSActivateBot:
                     confirm_text = f"📱 **Purchase Confirmation**\n\n"
                     confirm_text += f"**Service:** {service_name}\n"
                     confirm_text += f"**Country:** {country_name}\n"
-                    confirm_text += f"**Price:** ~${estimated_cost:.2f}\n\n"
+                    confirm_text += f"**Price:** ~${format_money(estimated_cost)}\n\n"
                     confirm_text += f"⚠️ **Important:** Exact price determined at purchase\n"
                     confirm_text += f"_Final charge may be ±20% different_\n\n"
-                    confirm_text += f"💰 Your balance: ${user_balance:.2f}\n\n"
+                    confirm_text += f"💰 Your balance: ${format_money(user_balance)}\n\n"
                     confirm_text += "Continue with purchase?"
                 elif lang == 'ru':
                     confirm_text = f"📱 **Подтверждение Покупки**\n\n"
                     confirm_text += f"**Сервис:** {service_name}\n"
                     confirm_text += f"**Страна:** {country_name}\n"
-                    confirm_text += f"**Цена:** ~${estimated_cost:.2f}\n\n"
+                    confirm_text += f"**Цена:** ~${format_money(estimated_cost)}\n\n"
                     confirm_text += f"⚠️ **Важно:** Точная цена определяется при покупке\n"
                     confirm_text += f"_Итоговая сумма может отличаться на ±20%_\n\n"
-                    confirm_text += f"💰 Ваш баланс: ${user_balance:.2f}\n\n"
+                    confirm_text += f"💰 Ваш баланс: ${format_money(user_balance)}\n\n"
                     confirm_text += "Продолжить покупку?"
                 else:
                     confirm_text = f"📱 **Sotib Olishni Tasdiqlash**\n\n"
                     confirm_text += f"**Xizmat:** {service_name}\n"
                     confirm_text += f"**Davlat:** {country_name}\n"
-                    confirm_text += f"**Narx:** ~${estimated_cost:.2f}\n\n"
+                    confirm_text += f"**Narx:** ~${format_money(estimated_cost)}\n\n"
                     confirm_text += f"⚠️ **Muhim:** Aniq narx xarid vaqtida aniqlanadi\n"
                     confirm_text += f"_Yakuniy summa ±20% farq qilishi mumkin_\n\n"
-                    confirm_text += f"💰 Balansingiz: ${user_balance:.2f}\n\n"
+                    confirm_text += f"💰 Balansingiz: ${format_money(user_balance)}\n\n"
                     confirm_text += "Xaridni davom ettirasizmi?"
                 
                 # Create confirmation buttons
@@ -2054,8 +2330,8 @@ class SMSActivateBot:
                 if isinstance(services, dict) and service_code in services:
                     service_data = services[service_code]
                     if isinstance(service_data, dict):
-                        api_price = float(service_data.get('retail') or service_data.get('cost', 0))
-                        estimated_cost = api_price * PRICE_MULTIPLIER
+                        api_price = service_data.get('retail') or service_data.get('cost', 0)
+                        estimated_cost = apply_multipliers(api_price, PRICE_MULTIPLIER)
             
             # ANTI-ABUSE CHECK: Is user blocked?
             is_blocked, block_reason, failed_total = self.is_user_blocked(user_id, estimated_cost, user_balance)
@@ -2067,27 +2343,27 @@ class SMSActivateBot:
                 
                 if lang == 'en':
                     text = f"🚫 **Temporarily Blocked**\n\n"
-                    text += f"You have ${failed_total:.2f} in failed purchases in the last {time_remaining:.0f} minutes.\n\n"
+                    text += f"You have ${format_money(failed_total)} in failed purchases in the last {time_remaining:.0f} minutes.\n\n"
                     text += f"To continue purchasing, you need:\n"
-                    text += f"💰 **${safety_amount:.2f}** (2x the price)\n\n"
-                    text += f"💳 Your current balance: ${user_balance:.2f}\n"
-                    text += f"📉 You need ${safety_amount - user_balance:.2f} more\n\n"
+                    text += f"💰 **${format_money(safety_amount)}** (2x the price)\n\n"
+                    text += f"💳 Your current balance: ${format_money(user_balance)}\n"
+                    text += f"📉 You need ${format_money(safety_amount - user_balance)} more\n\n"
                     text += f"⏰ Block will be lifted automatically in {time_remaining:.0f} minutes."
                 elif lang == 'ru':
                     text = f"🚫 **Временная Блокировка**\n\n"
-                    text += f"У вас ${failed_total:.2f} неудачных покупок за последние {time_remaining:.0f} минут.\n\n"
+                    text += f"У вас ${format_money(failed_total)} неудачных покупок за последние {time_remaining:.0f} минут.\n\n"
                     text += f"Чтобы продолжить, вам нужно:\n"
-                    text += f"💰 **${safety_amount:.2f}** (2x от цены)\n\n"
-                    text += f"💳 Ваш баланс: ${user_balance:.2f}\n"
-                    text += f"📉 Нужно еще ${safety_amount - user_balance:.2f}\n\n"
+                    text += f"💰 **${format_money(safety_amount)}** (2x от цены)\n\n"
+                    text += f"💳 Ваш баланс: ${format_money(user_balance)}\n"
+                    text += f"📉 Нужно еще ${format_money(safety_amount - user_balance)}\n\n"
                     text += f"⏰ Блокировка снимется автоматически через {time_remaining:.0f} минут."
                 else:
                     text = f"🚫 **Vaqtincha Bloklangan**\n\n"
-                    text += f"Sizda oxirgi {time_remaining:.0f} daqiqada ${failed_total:.2f} muvaffaqiyatsiz xaridlar.\n\n"
+                    text += f"Sizda oxirgi {time_remaining:.0f} daqiqada ${format_money(failed_total)} muvaffaqiyatsiz xaridlar.\n\n"
                     text += f"Davom etish uchun kerak:\n"
-                    text += f"💰 **${safety_amount:.2f}** (narxdan 2x)\n\n"
-                    text += f"💳 Sizning balansingiz: ${user_balance:.2f}\n"
-                    text += f"📉 Yana ${safety_amount - user_balance:.2f} kerak\n\n"
+                    text += f"💰 **${format_money(safety_amount)}** (narxdan 2x)\n\n"
+                    text += f"💳 Sizning balansingiz: ${format_money(user_balance)}\n"
+                    text += f"📉 Yana ${format_money(safety_amount - user_balance)} kerak\n\n"
                     text += f"⏰ Blok {time_remaining:.0f} daqiqadan keyin avtomatik ochiladi."
                 
                 self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
@@ -2095,10 +2371,10 @@ class SMSActivateBot:
                 # Log to channel
                 self.log_to_channel(
                     f"🚫 **User Blocked - Anti-Abuse**\n\n"
-                    f"💰 **Failed Total:** ${failed_total:.2f}\n"
+                    f"💰 **Failed Total:** ${format_money(failed_total)}\n"
                     f"🔷 **Attempted Service:** {service_code}\n"
-                    f"💳 **User Balance:** ${user_balance:.2f}\n"
-                    f"📉 **Required:** ${safety_amount:.2f}",
+                    f"💳 **User Balance:** ${format_money(user_balance)}\n"
+                    f"📉 **Required:** ${format_money(safety_amount)}",
                     user_id=user_id,
                     username=call.from_user.username
                 )
@@ -2114,10 +2390,8 @@ class SMSActivateBot:
             # NOW call API (only if user has estimated balance and not blocked)
             result = self.api.get_number_v2(service_code, country_id)
             
-            if 'error' in result:
-                error_msg = result['error']
-                
-                if 'NO_NUMBERS' in error_msg:
+            if not result.ok:
+                if result.error == ApiError.NO_NUMBERS:
                     error_text = get_text(lang, 'buy_no_numbers')
                     
                     # Log to channel
@@ -2130,14 +2404,9 @@ class SMSActivateBot:
                         username=call.from_user.username
                     )
                     
-                elif 'NO_BALANCE' in error_msg:
+                elif result.error == ApiError.NO_BALANCE:
                     # This means SMS-Activate API account is empty (admin's problem)
-                    if lang == 'en':
-                        error_text = "❌ Service temporarily unavailable\n\nPlease try again later or contact admin."
-                    elif lang == 'ru':
-                        error_text = "❌ Сервис временно недоступен\n\nПопробуйте позже или свяжитесь с админом."
-                    else:
-                        error_text = "❌ Xizmat vaqtincha mavjud emas\n\nKeyinroq urinib ko'ring yoki admin bilan bog'laning."
+                    error_text = get_text(lang, 'service_unavailable')
                     
                     # Log to channel
                     self.log_to_channel(
@@ -2148,15 +2417,9 @@ class SMSActivateBot:
                         user_id=user_id,
                         username=call.from_user.username
                     )
-                    
-                    # Notify superuser
-                    try:
-                        admin_msg = f"⚠️ SMS-Activate API NO_BALANCE ERROR!\n\nUser {user_id} tried to buy {service_code} but your SMS-Activate account has insufficient balance.\n\nPlease top up your SMS-Activate account!"
-                        self.bot.send_message(self.superuser_id, admin_msg)
-                    except:
-                        pass
+                    # The API purchase gate has alerted the superuser
                         
-                elif 'BAD_SERVICE' in error_msg:
+                elif result.error == ApiError.BAD_SERVICE:
                     error_text = get_text(lang, 'buy_invalid_service')
                     
                     # Log to channel
@@ -2170,14 +2433,14 @@ class SMSActivateBot:
                     )
                     
                 else:
-                    error_text = error_msg
+                    error_text = result.reply
                     
                     # Log to channel
                     self.log_to_channel(
                         f"❌ **Purchase Failed - API Error**\n\n"
                         f"🔷 **Service:** {service_code}\n"
                         f"🌍 **Country:** {country_id}\n"
-                        f"📝 **Error:** {error_msg}",
+                        f"📝 **Error:** {result.reply}",
                         user_id=user_id,
                         username=call.from_user.username
                     )
@@ -2187,11 +2450,11 @@ class SMSActivateBot:
                 return
             
             # Extract data
-            activation_id = result.get('activationId', 'N/A')
-            phone_number = result.get('phoneNumber', 'N/A')
-            api_cost = float(result.get('activationCost', 0))  # What we pay to API
-            user_cost = api_cost * PRICE_MULTIPLIER  # What we charge user (2x profit)
-            country_code = result.get('countryCode', 'N/A')
+            activation_id = result.activation_id
+            phone_number = result.phone_number or 'N/A'
+            api_cost = result.cost  # What we pay to API
+            user_cost = apply_multipliers(api_cost, PRICE_MULTIPLIER)  # What we charge user, in cents (2x profit)
+            country_code = result.country_code or 'N/A'
             
             # Check if user has enough balance (using marked up price)
             if user_balance < user_cost:
@@ -2199,21 +2462,21 @@ class SMSActivateBot:
                 needed = user_cost - user_balance
                 if lang == 'en':
                     text = f"❌ **Insufficient Balance**\n\n"
-                    text += f"💰 **Actual Price:** ${user_cost:.2f}\n"
-                    text += f"💳 **Your Balance:** ${user_balance:.2f}\n"
-                    text += f"📉 **Needed:** ${needed:.2f}\n\n"
+                    text += f"💰 **Actual Price:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Your Balance:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Needed:** ${format_money(needed)}\n\n"
                     text += f"Please top up your balance with /deposit"
                 elif lang == 'ru':
                     text = f"❌ **Недостаточно Средств**\n\n"
-                    text += f"💰 **Фактическая цена:** ${user_cost:.2f}\n"
-                    text += f"💳 **Ваш баланс:** ${user_balance:.2f}\n"
-                    text += f"📉 **Требуется:** ${needed:.2f}\n\n"
+                    text += f"💰 **Фактическая цена:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Ваш баланс:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Требуется:** ${format_money(needed)}\n\n"
                     text += f"Пожалуйста, пополните баланс через /deposit"
                 else:
                     text = f"❌ **Balans Yetarli Emas**\n\n"
-                    text += f"💰 **Haqiqiy narx:** ${user_cost:.2f}\n"
-                    text += f"💳 **Sizning balansingiz:** ${user_balance:.2f}\n"
-                    text += f"📉 **Kerak:** ${needed:.2f}\n\n"
+                    text += f"💰 **Haqiqiy narx:** ${format_money(user_cost)}\n"
+                    text += f"💳 **Sizning balansingiz:** ${format_money(user_balance)}\n"
+                    text += f"📉 **Kerak:** ${format_money(needed)}\n\n"
                     text += f"Iltimos /deposit orqali balansni to'ldiring"
                 
                 self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
@@ -2229,10 +2492,10 @@ class SMSActivateBot:
                     f"📞 **Phone:** +{phone_number}\n"
                     f"🔷 **Service:** {service_code}\n"
                     f"🌍 **Country:** {country_code}\n"
-                    f"💰 **Required:** ${user_cost:.2f}\n"
-                    f"💳 **User Balance:** ${user_balance:.2f}\n"
-                    f"📉 **Short:** ${needed:.2f}\n"
-                    f"🚨 **Total Failed (20min):** ${failed_total:.2f}",
+                    f"💰 **Required:** ${format_money(user_cost)}\n"
+                    f"💳 **User Balance:** ${format_money(user_balance)}\n"
+                    f"📉 **Short:** ${format_money(needed)}\n"
+                    f"🚨 **Total Failed (20min):** ${format_money(failed_total)}",
                     user_id=user_id,
                     username=call.from_user.username
                 )
@@ -2248,7 +2511,7 @@ class SMSActivateBot:
                 
                 # Try immediate cancel
                 try:
-                    self.api.set_status(activation_id, 8)
+                    self.api.cancel_activation(activation_id)
                 except:
                     pass
                 return
@@ -2275,15 +2538,13 @@ class SMSActivateBot:
                 
                 # Try immediate cancel
                 try:
-                    self.api.set_status(activation_id, 8)
+                    self.api.cancel_activation(activation_id)
                 except:
                     pass
                 return
             
             # Save activation (store what user paid, not API cost)
-            result['service'] = service_code
-            result['activationCost'] = user_cost  # Override with user's price
-            self.db.add_activation(user_id, result)
+            self.db.add_activation(user_id, result.activation_data(service_code), user_cost)
             
             # Send success message (show user their price, not API cost)
             text = get_text(
@@ -2293,7 +2554,7 @@ class SMSActivateBot:
                 phone=phone_number,
                 service=service_code,
                 country=country_code,
-                cost=user_cost
+                cost=format_money(user_cost)
             )
             
             keyboard = get_confirmation_keyboard(lang, activation_id)
@@ -2313,11 +2574,15 @@ class SMSActivateBot:
                 f"🆔 **Order ID:** `{activation_id}`\n"
                 f"🔷 **Service:** {service_code}\n"
                 f"🌍 **Country:** {country_code}\n"
-                f"💰 **Cost:** ${user_cost:.2f} USD",
+                f"💰 **Cost:** ${format_money(user_cost)} USD",
                 user_id=user_id,
                 username=call.from_user.username
             )
             
+        except CircuitOpenError as e:
+            logger.info(f"Purchase refused while the API circuit is open: {e}")
+            text = get_text(lang, 'buy_error', error=get_text(lang, 'service_unavailable'))
+            self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
         except Exception as e:
             logger.error(f"Error buying number: {e}")
             
@@ -2334,10 +2599,10 @@ class SMSActivateBot:
             text = get_text(lang, 'error_occurred')
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id)
     
-    def handle_check_callback(self, call, activation_id):
+    def handle_check_callback(self, call, ctx: UserContext, activation_id):
         """Handle check status callback"""
         user_id = call.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         # Get original message text to preserve order info
         original_text = call.message.text or call.message.caption or ""
@@ -2345,15 +2610,13 @@ class SMSActivateBot:
         try:
             status_result = self.api.get_status_v2(activation_id)
             
-            if 'error' in status_result:
-                error_msg = status_result['error']
-                
-                if 'STATUS_CANCEL' in error_msg:
+            if not status_result.ok:
+                if status_result.error == ApiError.STATUS_CANCEL:
                     text = get_text(lang, 'check_cancelled')
-                elif 'NO_ACTIVATION' in error_msg:
+                elif status_result.error == ApiError.NO_ACTIVATION:
                     text = get_text(lang, 'check_not_found')
                 else:
-                    text = f"⚠️ {error_msg}"
+                    text = f"⚠️ {status_result.reply}"
                 
                 # Keep original order info
                 if "Order ID:" in original_text or "ID Заказа:" in original_text or "Buyurtma ID:" in original_text:
@@ -2363,14 +2626,11 @@ class SMSActivateBot:
                 return
             
             # Parse status
-            verification_type = status_result.get('verificationType', 0)
-            
-            if verification_type == 0:
-                sms_data = status_result.get('sms', {})
-                if sms_data and sms_data.get('code'):
-                    code = sms_data.get('code', 'N/A')
-                    text = sms_data.get('text', 'N/A')
-                    date_time = sms_data.get('dateTime', 'N/A')
+            if status_result.verification_type == 0:
+                if status_result.code:
+                    code = status_result.code
+                    text = status_result.text
+                    date_time = status_result.date_time
                     
                     response = get_text(
                         lang,
@@ -2453,31 +2713,30 @@ class SMSActivateBot:
             else:
                 self.bot.edit_message_text(error_text, call.message.chat.id, call.message.message_id)
     
-    def handle_cancel_callback(self, call, activation_id):
+    def handle_cancel_callback(self, call, ctx: UserContext, activation_id):
         """Handle cancel order callback"""
         user_id = call.from_user.id
-        lang = self.get_user_lang(user_id)
+        lang = ctx.lang
         
         # Get original message text to preserve order info
         original_text = call.message.text or call.message.caption or ""
         
         try:
-            result = self.api.set_status(activation_id, 8)
+            result = self.api.cancel_activation(activation_id)
             
-            if 'ACCESS_CANCEL' in result:
+            if result.cancelled:
                 # Find the activation and refund (refund what user paid)
                 refund_amount = 0
                 phone_number = ""
                 service_code = ""
-                for activation in self.db.get_user_activations(user_id):
-                    if str(activation.get('activation_id')) == str(activation_id):
-                        user_paid = float(activation.get('cost', 0))
-                        refund_amount = user_paid
-                        phone_number = activation.get('phone_number', '')
-                        service_code = activation.get('service', '')
-                        self.db.add_balance(user_id, user_paid, f"Refund for order {activation_id}")
-                        self.db.update_activation(activation_id, status='cancelled')
-                        break
+                activation = self.db.get_activation(activation_id)
+                if activation and activation.get('user_id') == user_id:
+                    user_paid = activation.get('cost_cents') or 0
+                    refund_amount = user_paid
+                    phone_number = activation.get('phone_number', '')
+                    service_code = activation.get('service', '')
+                    self.db.add_balance(user_id, user_paid, f"Refund for order {activation_id}")
+                    self.db.update_activation(activation_id, status='cancelled')
                 
                 text = get_text(lang, 'cancel_success')
                 # Add order info for reference
@@ -2491,12 +2750,12 @@ class SMSActivateBot:
                     f"🆔 **Order ID:** `{activation_id}`\n"
                     f"📞 **Phone:** +{phone_number}\n"
                     f"🔷 **Service:** {service_code}\n"
-                    f"💰 **Refunded:** ${refund_amount:.2f} USD",
+                    f"💰 **Refunded:** ${format_money(refund_amount)} USD",
                     user_id=user_id,
                     username=call.from_user.username
                 )
                 
-            elif 'EARLY_CANCEL_DENIED' in result:
+            elif result.error == ApiError.EARLY_CANCEL_DENIED:
                 # IMPORTANT: Keep order details when early cancel is denied
                 if "Order ID:" in original_text or "ID Заказа:" in original_text or "Buyurtma ID:" in original_text:
                     order_info = original_text.split("⏳")[0]
@@ -2509,10 +2768,10 @@ class SMSActivateBot:
                 else:
                     text = get_text(lang, 'cancel_early')
                     
-            elif 'NO_ACTIVATION' in result:
+            elif result.error == ApiError.NO_ACTIVATION:
                 text = get_text(lang, 'check_not_found')
             else:
-                text = get_text(lang, 'cancel_failed', error=result)
+                text = get_text(lang, 'cancel_failed', error=result.reply)
                 # Keep order info on other errors too
                 if "Order ID:" in original_text or "ID Заказа:" in original_text or "Buyurtma ID:" in original_text:
                     order_info = original_text.split("⏳")[0]
@@ -2543,6 +2802,9 @@ class SMSActivateBot:
             self.bot.infinity_polling()
         except Exception as e:
             logger.error(f"Bot crashed: {e}")
+        finally:
+            self.api.close()
+            self.db.close()
 
 
 def main():
@@ -2553,10 +2815,33 @@ def main():
         config.validate_config()
         BOT_TOKEN = config.TELEGRAM_BOT_TOKEN
         SMS_ACTIVATE_API_KEY = config.SMS_ACTIVATE_API_KEY
+        TIMEOUT = config.TIMEOUT
+        CONNECT_TIMEOUT = config.CONNECT_TIMEOUT
+        BOT_WORKER_THREADS = config.BOT_WORKER_THREADS
+        DATABASE_BACKEND = config.DATABASE_BACKEND
+        DATABASE_FILE = config.DATABASE_FILE
+        DATABASE_JOURNAL = config.DATABASE_JOURNAL
+        DATABASE_HOT_MONTHS = config.DATABASE_HOT_MONTHS
+        DATABASE_COLUMNAR = config.DATABASE_COLUMNAR
+        DATABASE_SHARDS = config.DATABASE_SHARDS
+        DATABASE_SHARD_IDS = config.DATABASE_SHARD_IDS
+        DATABASE_ACTIVATION_RETENTION_DAYS = config.DATABASE_ACTIVATION_RETENTION_DAYS
     except ImportError:
         # Fallback to environment variables
         BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
         SMS_ACTIVATE_API_KEY = os.getenv('SMS_ACTIVATE_API_KEY')
+        TIMEOUT = int(os.getenv('TIMEOUT', '10'))
+        CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '5'))
+        BOT_WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS', '2'))
+        DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'json')
+        DATABASE_FILE = os.getenv('DATABASE_FILE', '')
+        DATABASE_JOURNAL = os.getenv('DATABASE_JOURNAL', 'false').lower() in ('1', 'true', 'yes')
+        DATABASE_HOT_MONTHS = int(os.getenv('DATABASE_HOT_MONTHS', '0'))
+        DATABASE_COLUMNAR = os.getenv('DATABASE_COLUMNAR', 'false').lower() in ('1', 'true', 'yes')
+        DATABASE_SHARDS = int(os.getenv('DATABASE_SHARDS', '1'))
+        DATABASE_SHARD_IDS = [int(shard) for shard in os.getenv('DATABASE_SHARD_IDS', '').split(',')
+                              if shard.strip()]
+        DATABASE_ACTIVATION_RETENTION_DAYS = int(os.getenv('DATABASE_ACTIVATION_RETENTION_DAYS', '0'))
         
         if not BOT_TOKEN or not SMS_ACTIVATE_API_KEY:
             print("\n❌ Error: Missing configuration")
@@ -2577,8 +2862,31 @@ def main():
         print("\nBot will start but superuser commands will not work.")
         print()
     
+    # Telegram polling hands this process every user's updates, so it must own every shard
+    if DATABASE_SHARD_IDS and sorted(set(DATABASE_SHARD_IDS)) != list(range(DATABASE_SHARDS)):
+        message = (f"DATABASE_SHARD_IDS={','.join(map(str, DATABASE_SHARD_IDS))} leaves out shards of "
+                   f"DATABASE_SHARDS={DATABASE_SHARDS}; the bot must own all of them (leave it empty)")
+        logger.error(f"Configuration error: {message}")
+        print(f"\n❌ {message}")
+        return
+    
+    # Open database for the configured backend
+    try:
+        db = open_database(DATABASE_BACKEND, DATABASE_FILE or None,
+                           journal=DATABASE_JOURNAL, hot_months=DATABASE_HOT_MONTHS,
+                           columnar=DATABASE_COLUMNAR, shards=DATABASE_SHARDS,
+                           owned_shards=DATABASE_SHARD_IDS or None,
+                           activation_retention_days=DATABASE_ACTIVATION_RETENTION_DAYS)
+    except (ValueError, FileLockTimeout) as e:
+        logger.error(f"Database error: {e}")
+        print(f"\n❌ {e}")
+        return
+    logger.info(f"Using {DATABASE_BACKEND} database backend")
+    
     # Create and run bot
-    bot = SMSActivateBot(BOT_TOKEN, SMS_ACTIVATE_API_KEY, SUPERUSER_ID)
+    bot = SMSActivateBot(BOT_TOKEN, SMS_ACTIVATE_API_KEY, SUPERUSER_ID, db=db,
+                         worker_threads=BOT_WORKER_THREADS, api_timeout=TIMEOUT,
+                         api_connect_timeout=CONNECT_TIMEOUT)
     bot.run()
 
 
@@ -0,0 +1,108 @@
+"""
+Circuit breaker for the SMS-Activate API
+After repeated failures calls fail at once with the last reason, until a timed probe finds the provider healthy again
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'        # calls go through
+OPEN = 'open'            # calls fail fast
+HALF_OPEN = 'half_open'  # a probe is checking the provider
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The provider is known to be failing; the call was not made"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures (or at once for a fatal one).
+    While open, check() raises CircuitOpenError; every `reset_timeout` seconds `probe`
+    runs on a timer thread and closes the circuit if it returns True.
+    `on_transition(old_state, new_state, reason)` is called once per state change.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, probe: Callable[[str], bool],
+                 on_transition: Optional[Callable[[str, str, str], None]] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.on_transition = on_transition
+        self.state = CLOSED
+        self.reason = ''
+        self.opened_at = 0.0
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def check(self):
+        """Raise CircuitOpenError unless calls may go through"""
+        if self.state != CLOSED:
+            raise CircuitOpenError(f"SMS-Activate API unavailable: {self.reason}")
+
+    def record_success(self):
+        """A call got a healthy answer"""
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, reason: str, fatal: bool = False):
+        """A call failed; open the circuit once failures add up"""
+        with self._lock:
+            self._failures += 1
+            if self.state != CLOSED or (not fatal and self._failures < self.failure_threshold):
+                return
+            self.reason = reason
+            self.opened_at = time.monotonic()
+            self.state = OPEN  # Under the lock: only one failing call opens it and starts the probes
+        self._report(CLOSED, OPEN, reason)
+        self._schedule_probe()
+
+    def _schedule_probe(self):
+        """Probe the provider once `reset_timeout` has passed"""
+        self._timer = threading.Timer(self.reset_timeout, self._run_probe)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run_probe(self):
+        """Half-open: close the circuit if the provider answers well, otherwise stay open"""
+        self._transition(HALF_OPEN, self.reason)
+        try:
+            healthy = self.probe(self.reason)
+        except Exception as e:
+            logger.warning(f"Circuit breaker probe failed: {e}")
+            healthy = False
+        if healthy:
+            with self._lock:
+                self._failures = 0
+            self._transition(CLOSED, 'provider answered the probe')
+        else:
+            self._transition(OPEN, self.reason)
+            self._schedule_probe()
+
+    def _transition(self, state: str, reason: str):
+        """Move to `state` and report the change"""
+        with self._lock:
+            old_state, self.state = self.state, state
+        if old_state != state:
+            self._report(old_state, state, reason)
+
+    def _report(self, old_state: str, state: str, reason: str):
+        """Log a state change and pass it to on_transition"""
+        logger.warning(f"SMS-Activate circuit {old_state} -> {state}: {reason}")
+        if self.on_transition:
+            try:
+                self.on_transition(old_state, state, reason)
+            except Exception as e:
+                logger.error(f"Circuit breaker alert failed: {e}")
+
+    def close(self):
+        """Stop the probe timer"""
+        if self._timer is not None:
+            self._timer.cancel()
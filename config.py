@@ -17,7 +17,32 @@ SMS_ACTIVATE_API_KEY = os.getenv('SMS_ACTIVATE_API_KEY', '')
 
 # Bot Settings
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# SMS-Activate API timeouts: TIMEOUT waits for a response, CONNECT_TIMEOUT for the connection
 TIMEOUT = int(os.getenv('TIMEOUT', '10'))
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '5'))
+# Threads handling Telegram updates; the API connection pool is sized to match
+BOT_WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS', '2'))
+
+# Database Settings
+# 'json' keeps everything in users.json, 'sqlite' uses a WAL-mode SQLite file,
+# 'dbm' uses a stdlib dbm key-value file (see benchmark.py to compare them)
+DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'json')
+DATABASE_FILE = os.getenv('DATABASE_FILE', '')  # Empty = users.json / users.db / users.dbm
+# json backend only: append mutations to users.json.journal instead of rewriting users.json
+DATABASE_JOURNAL = os.getenv('DATABASE_JOURNAL', 'false').lower() in ('1', 'true', 'yes')
+# json backend only: months of history kept in memory (e.g. 2 = current + previous),
+# older months are sealed into users_archive/. 0 (default) keeps everything in users.json
+DATABASE_HOT_MONTHS = int(os.getenv('DATABASE_HOT_MONTHS', '0'))
+# json backend only: keep a column-array projection of the history for /stats analytics (left out without it)
+DATABASE_COLUMNAR = os.getenv('DATABASE_COLUMNAR', 'false').lower() in ('1', 'true', 'yes')
+# json backend only: days cancelled/completed activations stay in memory before
+# they move to the archive (e.g. 90). 0 (default) keeps them in users.json forever
+DATABASE_ACTIVATION_RETENTION_DAYS = int(os.getenv('DATABASE_ACTIVATION_RETENTION_DAYS', '0'))
+# json backend only: split users by user_id into this many files (users.shard00-of-04.json, ...)
+DATABASE_SHARDS = int(os.getenv('DATABASE_SHARDS', '1'))
+# Shards this process owns, e.g. '0,1' (empty = all). Only for scripts working on part of the data:
+# the bot receives every user's updates and refuses to start without all shards
+DATABASE_SHARD_IDS = [int(shard) for shard in os.getenv('DATABASE_SHARD_IDS', '').split(',') if shard.strip()]
 
 # API Settings
 API_BASE_URL = 'https://api.sms-activate.ae/stubs/handler_api.php'
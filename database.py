@@ -1,214 +1,222 @@
 """
 Database module for user management and transactions
+Thin facade over a pluggable storage backend (JSON file, SQLite or dbm)
 """
 
-import json
-import os
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, Iterator, List, Protocol
 import logging
 
+from json_database import JSONDatabase
+
 logger = logging.getLogger(__name__)
 
+BACKENDS = ('json', 'sqlite', 'dbm')
+
+
+class StorageBackend(Protocol):
+    """What a storage engine has to provide. All amounts are integer cents."""
+
+    def get_user(self, user_id: int) -> Optional[Dict]: ...
+
+    def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict: ...
+
+    def update_user(self, user_id: int, **kwargs): ...
+
+    def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict: ...
+
+    def set_language(self, user_id: int, language: str): ...
+
+    def get_language(self, user_id: int) -> str: ...
+
+    def get_balance(self, user_id: int) -> int: ...
+
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str,
+                             description: str = "") -> Optional[int]: ...
+
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""): ...
+
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool: ...
+
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""): ...
+
+    def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]: ...
+
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict: ...
+
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int): ...
+
+    def update_activation(self, activation_id: str, **kwargs): ...
+
+    def get_activation(self, activation_id: str) -> Optional[Dict]: ...
+
+    def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]: ...
+
+    def get_all_users(self) -> List[Dict]: ...
+
+    def get_all_transactions(self, limit: int = 100) -> List[Dict]: ...
+
+    def get_all_activations(self, limit: int = 100) -> List[Dict]: ...
+
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]: ...
+
+    def get_statistics(self) -> Dict: ...
+
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Optional[Dict]: ...
+
+    def close(self): ...
+
 
 class Database:
-    """Simple JSON-based database for user data"""
-    
-    def __init__(self, db_file: str = 'users.json'):
-        self.db_file = db_file
-        self.data = self._load()
-    
-    def _load(self) -> Dict:
-        """Load database from file"""
-        if os.path.exists(self.db_file):
-            try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading database: {e}")
-                return self._default_structure()
-        return self._default_structure()
-    
-    def _default_structure(self) -> Dict:
-        """Default database structure"""
-        return {
-            'users': {},
-            'transactions': [],
-            'activations': []
-        }
-    
-    def _save(self):
-        """Save database to file"""
-        try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Error saving database: {e}")
-    
+    """Storage facade used by the bot; every call goes to the configured backend"""
+
+    def __init__(self, db_file: str = 'users.json', backend: Optional[StorageBackend] = None, **options):
+        # Without an explicit backend this is the JSON database, as before
+        self.backend = backend if backend is not None else JSONDatabase(db_file, **options)
+
+    # ========== USERS ==========
+
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
-        return self.data['users'].get(str(user_id))
-    
+        return self.backend.get_user(user_id)
+
     def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
         """Create a new user"""
-        user_data = {
-            'user_id': user_id,
-            'username': username,
-            'first_name': first_name,
-            'balance': 0.0,
-            'language': 'en',
-            'created_at': datetime.now().isoformat(),
-            'total_spent': 0.0,
-            'total_activations': 0
-        }
-        self.data['users'][str(user_id)] = user_data
-        self._save()
-        logger.info(f"Created new user: {user_id}")
-        return user_data
-    
+        return self.backend.create_user(user_id, username, first_name)
+
     def update_user(self, user_id: int, **kwargs):
         """Update user data"""
-        user_key = str(user_id)
-        if user_key in self.data['users']:
-            self.data['users'][user_key].update(kwargs)
-            self._save()
-    
+        self.backend.update_user(user_id, **kwargs)
+
     def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
         """Get existing user or create new one"""
-        user = self.get_user(user_id)
-        if not user:
-            user = self.create_user(user_id, username, first_name)
-        return user
-    
+        return self.backend.get_or_create_user(user_id, username, first_name)
+
     def set_language(self, user_id: int, language: str):
         """Set user language"""
-        self.update_user(user_id, language=language)
-    
+        self.backend.set_language(user_id, language)
+
     def get_language(self, user_id: int) -> str:
         """Get user language"""
-        user = self.get_user(user_id)
-        return user.get('language', 'en') if user else 'en'
-    
-    def get_balance(self, user_id: int) -> float:
-        """Get user balance"""
-        user = self.get_user(user_id)
-        return user.get('balance', 0.0) if user else 0.0
-    
-    def add_balance(self, user_id: int, amount: float, description: str = ""):
-        """Add balance to user"""
-        user = self.get_user(user_id)
-        if user:
-            new_balance = user.get('balance', 0.0) + amount
-            self.update_user(user_id, balance=new_balance)
-            
-            # Add transaction
-            self.add_transaction(user_id, amount, 'add', description)
-            logger.info(f"Added {amount} to user {user_id}. New balance: {new_balance}")
-    
-    def deduct_balance(self, user_id: int, amount: float, description: str = "") -> bool:
-        """Deduct balance from user. Returns True if successful."""
-        user = self.get_user(user_id)
-        if user:
-            current_balance = user.get('balance', 0.0)
-            if current_balance >= amount:
-                new_balance = current_balance - amount
-                total_spent = user.get('total_spent', 0.0) + amount
-                self.update_user(user_id, balance=new_balance, total_spent=total_spent)
-                
-                # Add transaction
-                self.add_transaction(user_id, amount, 'deduct', description)
-                logger.info(f"Deducted {amount} from user {user_id}. New balance: {new_balance}")
-                return True
-        return False
-    
-    def add_transaction(self, user_id: int, amount: float, type: str, description: str = ""):
+        return self.backend.get_language(user_id)
+
+    # ========== BALANCE ==========
+
+    def get_balance(self, user_id: int) -> int:
+        """Get user balance in cents"""
+        return self.backend.get_balance(user_id)
+
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str, description: str = "") -> Optional[int]:
+        """Atomically change a balance and record the transaction. Returns the new balance or None."""
+        return self.backend.apply_balance_change(user_id, amount_cents, type, description)
+
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""):
+        """Add balance (in cents) to user"""
+        self.backend.add_balance(user_id, amount_cents, description)
+
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool:
+        """Deduct balance (in cents) from user. Returns True if successful."""
+        return self.backend.deduct_balance(user_id, amount_cents, description)
+
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""):
         """Add transaction record"""
-        transaction = {
-            'user_id': user_id,
-            'amount': amount,
-            'type': type,
-            'description': description,
-            'timestamp': datetime.now().isoformat()
-        }
-        self.data['transactions'].append(transaction)
-        self._save()
-    
+        self.backend.add_transaction(user_id, amount_cents, type, description)
+
     def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]:
         """Get user transactions"""
-        transactions = [t for t in self.data['transactions'] if t['user_id'] == user_id]
-        return sorted(transactions, key=lambda x: x['timestamp'], reverse=True)[:limit]
-    
-    def add_activation(self, user_id: int, activation_data: Dict):
-        """Add activation record"""
-        activation = {
-            'user_id': user_id,
-            'activation_id': activation_data.get('activationId'),
-            'phone_number': activation_data.get('phoneNumber'),
-            'service': activation_data.get('service'),
-            'country': activation_data.get('countryCode'),
-            'cost': activation_data.get('activationCost'),
-            'status': 'active',
-            'created_at': datetime.now().isoformat()
-        }
-        self.data['activations'].append(activation)
-        
-        # Update user stats
-        user = self.get_user(user_id)
-        if user:
-            total = user.get('total_activations', 0) + 1
-            self.update_user(user_id, total_activations=total)
-        
-        self._save()
-    
+        return self.backend.get_user_transactions(user_id, limit)
+
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """
+        One page of a user's (user_id=None: everyone's) transactions, newest first.
+        before/after are opaque cursors from a previous page ('older' / 'newer');
+        returns {'items': [...], 'older': cursor or None, 'newer': cursor or None}
+        """
+        return self.backend.get_transactions_page(user_id, limit, before, after)
+
+    # ========== ACTIVATIONS ==========
+
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int):
+        """Add activation record (cost_cents is what the user paid)"""
+        self.backend.add_activation(user_id, activation_data, cost_cents)
+
     def update_activation(self, activation_id: str, **kwargs):
         """Update activation record"""
-        for activation in self.data['activations']:
-            if str(activation.get('activation_id')) == str(activation_id):
-                activation.update(kwargs)
-                self._save()
-                break
-    
+        self.backend.update_activation(activation_id, **kwargs)
+
+    def get_activation(self, activation_id: str) -> Optional[Dict]:
+        """Get activation by ID"""
+        return self.backend.get_activation(activation_id)
+
     def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]:
         """Get user activations"""
-        activations = [a for a in self.data['activations'] if a['user_id'] == user_id]
-        return sorted(activations, key=lambda x: x['created_at'], reverse=True)[:limit]
-    
+        return self.backend.get_user_activations(user_id, limit)
+
+    # ========== ADMIN ==========
+
     def get_all_users(self) -> List[Dict]:
         """Get all users"""
-        return list(self.data['users'].values())
-    
+        return self.backend.get_all_users()
+
     def get_all_transactions(self, limit: int = 100) -> List[Dict]:
         """Get all transactions"""
-        return sorted(self.data['transactions'], key=lambda x: x['timestamp'], reverse=True)[:limit]
-    
+        return self.backend.get_all_transactions(limit)
+
     def get_all_activations(self, limit: int = 100) -> List[Dict]:
         """Get all activations"""
-        return sorted(self.data['activations'], key=lambda x: x['created_at'], reverse=True)[:limit]
-    
+        return self.backend.get_all_activations(limit)
+
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Stream 'transactions' or 'activations' with start <= time < end, oldest first"""
+        return self.backend.export_iter(kind, start, end)
+
     def get_statistics(self) -> Dict:
         """Get overall statistics"""
-        users = self.get_all_users()
-        transactions = self.data['transactions']
-        activations = self.data['activations']
-        
-        total_users = len(users)
-        total_balance = sum(u.get('balance', 0) for u in users)
-        total_spent = sum(u.get('total_spent', 0) for u in users)
-        total_activations = len(activations)
-        
-        # Recent activity
-        today = datetime.now().date()
-        today_transactions = [t for t in transactions 
-                            if datetime.fromisoformat(t['timestamp']).date() == today]
-        today_activations = [a for a in activations 
-                           if datetime.fromisoformat(a['created_at']).date() == today]
-        
-        return {
-            'total_users': total_users,
-            'total_balance': total_balance,
-            'total_spent': total_spent,
-            'total_activations': total_activations,
-            'today_transactions': len(today_transactions),
-            'today_activations': len(today_activations)
-        }
+        return self.backend.get_statistics()
+
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Optional[Dict]:
+        """Revenue per day, top spenders and per-service volume over the last `days` days (None if not kept)"""
+        return self.backend.get_analytics(days, limit)
+
+    def close(self):
+        """Flush everything to disk"""
+        self.backend.close()
+
+
+def open_backend(backend: str = 'json', db_file: Optional[str] = None, journal: bool = False,
+                 hot_months: int = 0, columnar: bool = False, shards: int = 1,
+                 owned_shards: Optional[List[int]] = None,
+                 activation_retention_days: int = 0) -> StorageBackend:
+    """Create the storage engine for a backend name"""
+    if shards > 1 and backend != 'json':
+        raise ValueError(f"Sharding is only supported by the json backend, not {backend}")
+    if backend == 'sqlite':
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(db_file or 'users.db')
+    if backend == 'dbm':
+        from dbm_database import DbmDatabase
+        return DbmDatabase(db_file or 'users.dbm')
+    if backend != 'json':
+        raise ValueError(f"Unknown database backend: {backend} (expected one of: {', '.join(BACKENDS)})")
+    if shards > 1:
+        from sharded_database import ShardedDatabase
+        return ShardedDatabase(db_file or 'users.json', shards, owned_shards,
+                               journal=journal, hot_months=hot_months, columnar=columnar,
+                               activation_retention_days=activation_retention_days)
+    return JSONDatabase(db_file or 'users.json', journal=journal, hot_months=hot_months, columnar=columnar,
+                        activation_retention_days=activation_retention_days)
+
 
+def open_database(backend: str = 'json', db_file: Optional[str] = None, journal: bool = False,
+                  hot_months: int = 0, columnar: bool = False, shards: int = 1,
+                  owned_shards: Optional[List[int]] = None,
+                  activation_retention_days: int = 0) -> Database:
+    """Open the database for the configured storage backend"""
+    return Database(backend=open_backend(backend, db_file, journal=journal,
+                                         hot_months=hot_months, columnar=columnar,
+                                         shards=shards, owned_shards=owned_shards,
+                                         activation_retention_days=activation_retention_days))
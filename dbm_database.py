@@ -0,0 +1,395 @@
+"""
+dbm storage engine for user management and transactions
+Key-value layout on the stdlib dbm module (gdbm/ndbm when available, dbm.dumb otherwise)
+"""
+
+import dbm
+import heapq
+import json
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from operator import itemgetter
+from typing import Optional, Dict, Iterator, List
+import logging
+
+from file_lock import FILE_LOCK_TIMEOUT, FileLock
+from money import format_money, migrate_legacy_fields
+from pagination import paginate
+from records import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Key layout (values are JSON):
+#   user:<user_id>        user record
+#   tx:<user_id>          the user's transactions, oldest first
+#   act:<user_id>         the user's activations, oldest first
+#   aid:<activation_id>   user_id owning the activation (first one wins)
+#   day:<YYYY-MM-DD>      {"transactions": n, "activations": n}
+#   meta:stats            running totals for get_statistics
+STATS_KEY = 'meta:stats'
+
+
+class DbmDatabase:
+    """dbm-based database for user data (one key per user and per user history)"""
+
+    def __init__(self, db_file: str = 'users.dbm', import_from: Optional[str] = 'users.json',
+                 lock_timeout: float = FILE_LOCK_TIMEOUT):
+        self.db_file = db_file
+        self._lock = threading.RLock()  # dbm handles are not thread-safe
+        # One process at a time (dbm.dumb does no locking of its own); held until close()
+        self._file_lock = FileLock(db_file + '.lock', lock_timeout)
+        self._file_lock.acquire()
+        self._db = dbm.open(db_file, 'c')
+
+        if STATS_KEY not in self._db:
+            if import_from and os.path.exists(import_from):
+                self.import_json(import_from)
+            else:
+                self._put(STATS_KEY, _empty_stats())
+
+    def _get(self, key: str, default=None):
+        """Read and decode a value"""
+        value = self._db.get(key.encode())
+        return json.loads(value) if value is not None else default
+
+    def _put(self, key: str, value):
+        """Encode and write a value"""
+        self._db[key.encode()] = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def _keys(self, prefix: str) -> List[str]:
+        """All keys starting with a prefix (full scan)"""
+        encoded = prefix.encode()
+        return [key.decode() for key in self._db.keys() if key.startswith(encoded)]
+
+    def _bump_stats(self, **deltas):
+        """Add to the running totals (caller holds the lock)"""
+        stats = self._get(STATS_KEY, _empty_stats())
+        for field, delta in deltas.items():
+            stats[field] += delta
+        self._put(STATS_KEY, stats)
+
+    def _bump_day(self, day: str, field: str):
+        """Count a record in its day bucket (caller holds the lock)"""
+        counts = self._get(f'day:{day}', {'transactions': 0, 'activations': 0})
+        counts[field] += 1
+        self._put(f'day:{day}', counts)
+
+    def import_json(self, json_file: str):
+        """Import users, transactions and activations from a users.json file"""
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading {json_file} for import: {e}")
+            return
+
+        users = {}
+        transactions: Dict[int, List[Dict]] = {}
+        activations: Dict[int, List[Dict]] = {}
+        days: Dict[str, Dict[str, int]] = {}
+        for user in data.get('users', {}).values():
+            users[user['user_id']] = migrate_legacy_fields(user)
+        for transaction in sorted(data.get('transactions', []), key=lambda x: x['timestamp']):
+            transactions.setdefault(transaction['user_id'], []).append(migrate_legacy_fields(transaction))
+            days.setdefault(transaction['timestamp'][:10], {'transactions': 0, 'activations': 0})['transactions'] += 1
+        for activation in sorted(data.get('activations', []), key=lambda x: x['created_at']):
+            activations.setdefault(activation['user_id'], []).append(migrate_legacy_fields(activation))
+            days.setdefault(activation['created_at'][:10], {'transactions': 0, 'activations': 0})['activations'] += 1
+
+        with self._lock:
+            for user_id, user in users.items():
+                self._put(f'user:{user_id}', user)
+            for user_id, records in transactions.items():
+                self._put(f'tx:{user_id}', records)
+            for user_id, records in activations.items():
+                self._put(f'act:{user_id}', records)
+                for activation in records:
+                    key = f"aid:{activation.get('activation_id')}"
+                    if key not in self._db:
+                        self._put(key, user_id)
+            for day, counts in days.items():
+                self._put(f'day:{day}', counts)
+            self._put(STATS_KEY, {
+                'total_users': len(users),
+                'total_balance_cents': sum(u.get('balance_cents', 0) for u in users.values()),
+                'total_spent_cents': sum(u.get('total_spent_cents', 0) for u in users.values()),
+                'total_activations': sum(len(records) for records in activations.values())
+            })
+
+        logger.info(f"Imported {len(users)} users, {len(data.get('transactions', []))} transactions "
+                    f"and {len(data.get('activations', []))} activations from {json_file}")
+
+    def close(self):
+        """Flush and close the dbm file"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self._file_lock.release()
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        with self._lock:
+            return self._get(f'user:{user_id}')
+
+    def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Create a new user"""
+        user_data = {
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'balance_cents': 0,
+            'language': 'en',
+            'created_at': datetime.now().isoformat(),
+            'total_spent_cents': 0,
+            'total_activations': 0
+        }
+        with self._lock:
+            existing = self._get(f'user:{user_id}')
+            if existing:
+                return existing
+            self._put(f'user:{user_id}', user_data)
+            self._bump_stats(total_users=1)
+        logger.info(f"Created new user: {user_id}")
+        return user_data
+
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        with self._lock:
+            user = self._get(f'user:{user_id}')
+            if not user:
+                return
+            balance = user.get('balance_cents', 0)
+            spent = user.get('total_spent_cents', 0)
+            self._bump_stats(total_balance_cents=kwargs.get('balance_cents', balance) - balance,
+                             total_spent_cents=kwargs.get('total_spent_cents', spent) - spent)
+            user.update(kwargs)
+            self._put(f'user:{user_id}', user)
+
+    def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Get existing user or create new one"""
+        user = self.get_user(user_id)
+        if not user:
+            user = self.create_user(user_id, username, first_name)
+        return user
+
+    def set_language(self, user_id: int, language: str):
+        """Set user language"""
+        self.update_user(user_id, language=language)
+
+    def get_language(self, user_id: int) -> str:
+        """Get user language"""
+        user = self.get_user(user_id)
+        return user.get('language', 'en') if user else 'en'
+
+    def get_balance(self, user_id: int) -> int:
+        """Get user balance in cents"""
+        user = self.get_user(user_id)
+        return user.get('balance_cents', 0) if user else 0
+
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str, description: str = "") -> Optional[int]:
+        """
+        Atomically change a user's balance and record the transaction.
+        type 'add' credits amount_cents; 'deduct' debits it only if the balance covers it
+        and counts it as spent. Returns the new balance in cents, or None if refused.
+        """
+        with self._lock:
+            user = self._get(f'user:{user_id}')
+            if not user:
+                return None
+            balance = user.get('balance_cents', 0)
+            if type == 'deduct':
+                if balance < amount_cents:
+                    return None
+                user['balance_cents'] = balance - amount_cents
+                user['total_spent_cents'] = user.get('total_spent_cents', 0) + amount_cents
+                self._bump_stats(total_balance_cents=-amount_cents, total_spent_cents=amount_cents)
+            else:
+                user['balance_cents'] = balance + amount_cents
+                self._bump_stats(total_balance_cents=amount_cents)
+            # dbm has no multi-key transactions: write the ledger row before the balance
+            self._append_transaction(user_id, amount_cents, type, description)
+            self._put(f'user:{user_id}', user)
+            return user['balance_cents']
+
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""):
+        """Add balance (in cents) to user"""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'add', description)
+        if new_balance is not None:
+            logger.info(f"Added {format_money(amount_cents)} to user {user_id}. "
+                        f"New balance: {format_money(new_balance)}")
+
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool:
+        """Deduct balance (in cents) from user. Returns True if successful."""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'deduct', description)
+        if new_balance is None:
+            return False
+        logger.info(f"Deducted {format_money(amount_cents)} from user {user_id}. "
+                    f"New balance: {format_money(new_balance)}")
+        return True
+
+    def _append_transaction(self, user_id: int, amount_cents: int, type: str, description: str):
+        """Append to the user's transaction list (caller holds the lock)"""
+        transaction = {
+            'user_id': user_id,
+            'amount_cents': amount_cents,
+            'type': type,
+            'description': description,
+            'timestamp': datetime.now().isoformat()
+        }
+        records = self._get(f'tx:{user_id}', [])
+        records.append(transaction)
+        self._put(f'tx:{user_id}', records)
+        self._bump_day(transaction['timestamp'][:10], 'transactions')
+
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""):
+        """Add transaction record"""
+        with self._lock:
+            self._append_transaction(user_id, amount_cents, type, description)
+
+    def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user transactions"""
+        with self._lock:
+            records = self._get(f'tx:{user_id}', [])
+        return records[:-limit - 1:-1] if limit > 0 else []
+
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """One page of a user's (or everyone's, full scan) transactions, newest first, from a cursor"""
+        with self._lock:
+            if user_id is not None:
+                transactions = self._get(f'tx:{user_id}', [])
+            else:
+                transactions = sorted(self._all_records('tx:'), key=lambda x: x['timestamp'])
+        return paginate([(None, lambda: (transactions, lambda x: to_epoch(x['timestamp'])))],
+                        limit, before, after)
+
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int):
+        """Add activation record (cost_cents is what the user paid)"""
+        activation = {
+            'user_id': user_id,
+            'activation_id': activation_data.get('activationId'),
+            'phone_number': activation_data.get('phoneNumber'),
+            'service': activation_data.get('service'),
+            'country': activation_data.get('countryCode'),
+            'cost_cents': cost_cents,
+            'status': 'active',
+            'created_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            records = self._get(f'act:{user_id}', [])
+            records.append(activation)
+            self._put(f'act:{user_id}', records)
+            key = f"aid:{activation['activation_id']}"
+            if key not in self._db:
+                self._put(key, user_id)
+            self._bump_day(activation['created_at'][:10], 'activations')
+            self._bump_stats(total_activations=1)
+
+            user = self._get(f'user:{user_id}')
+            if user:
+                user['total_activations'] = user.get('total_activations', 0) + 1
+                self._put(f'user:{user_id}', user)
+
+    def update_activation(self, activation_id: str, **kwargs):
+        """Update activation record"""
+        with self._lock:
+            user_id = self._get(f'aid:{activation_id}')
+            if user_id is None:
+                return
+            records = self._get(f'act:{user_id}', [])
+            for activation in records:
+                if str(activation.get('activation_id')) == str(activation_id):
+                    activation.update(kwargs)
+                    break
+            self._put(f'act:{user_id}', records)
+
+    def get_activation(self, activation_id: str) -> Optional[Dict]:
+        """Get activation by ID"""
+        with self._lock:
+            user_id = self._get(f'aid:{activation_id}')
+            if user_id is None:
+                return None
+            for activation in self._get(f'act:{user_id}', []):
+                if str(activation.get('activation_id')) == str(activation_id):
+                    return activation
+        return None
+
+    def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user activations"""
+        with self._lock:
+            records = self._get(f'act:{user_id}', [])
+        return records[:-limit - 1:-1] if limit > 0 else []
+
+    def get_all_users(self) -> List[Dict]:
+        """Get all users"""
+        with self._lock:
+            return [self._get(key) for key in self._keys('user:')]
+
+    def _all_records(self, prefix: str) -> List[Dict]:
+        """Every record under a per-user history prefix (full scan)"""
+        with self._lock:
+            return [record for key in self._keys(prefix) for record in self._get(key, [])]
+
+    def get_all_transactions(self, limit: int = 100) -> List[Dict]:
+        """Get all transactions"""
+        return heapq.nlargest(limit, self._all_records('tx:'), key=lambda x: x['timestamp'])
+
+    def get_all_activations(self, limit: int = 100) -> List[Dict]:
+        """Get all activations"""
+        return heapq.nlargest(limit, self._all_records('act:'), key=lambda x: x['created_at'])
+
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]:
+        """
+        Transactions or activations with start <= time < end, oldest first.
+        No global time index: heapq.merge of the per-user lists (each oldest first).
+        The merge needs every user's head record, so each list is decoded and cut to
+        the range up front: memory is O(records in the range), without a sorted copy.
+        """
+        if kind == 'transactions':
+            prefix, time_key = 'tx:', 'timestamp'
+        elif kind == 'activations':
+            prefix, time_key = 'act:', 'created_at'
+        else:
+            raise ValueError(f"Unknown export kind: {kind}")
+        low = start.isoformat() if start else None
+        high = end.isoformat() if end else None
+        with self._lock:
+            keys = self._keys(prefix)
+        streams = [self._history_range(key, time_key, low, high) for key in keys]
+        yield from heapq.merge(*streams, key=itemgetter(time_key))
+
+    def _history_range(self, key: str, time_key: str, low: Optional[str], high: Optional[str]) -> Iterator[Dict]:
+        """Records of one time-ordered history list with low <= time < high, read on the first pull"""
+        with self._lock:
+            records = self._get(key, [])
+        first = bisect_left(records, low, key=itemgetter(time_key)) if low else 0
+        last = bisect_left(records, high, key=itemgetter(time_key)) if high else len(records)
+        del records[last:], records[:first]  # Only the in-range slice stays alive
+        yield from records
+
+    def get_statistics(self) -> Dict:
+        """Get overall statistics"""
+        with self._lock:
+            stats = self._get(STATS_KEY, _empty_stats())
+            today = self._get(f'day:{datetime.now().date().isoformat()}', {'transactions': 0, 'activations': 0})
+        return {
+            'total_users': stats['total_users'],
+            'total_balance_cents': stats['total_balance_cents'],
+            'total_spent_cents': stats['total_spent_cents'],
+            'total_activations': stats['total_activations'],
+            'today_transactions': today['transactions'],
+            'today_activations': today['activations']
+        }
+
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Optional[Dict]:
+        """Not available: answering it would mean scanning every history key on each /stats"""
+        return None
+
+
+def _empty_stats() -> Dict:
+    """Running totals of an empty database"""
+    return {'total_users': 0, 'total_balance_cents': 0, 'total_spent_cents': 0, 'total_activations': 0}
@@ -0,0 +1,70 @@
+"""
+Streaming export of the transaction ledger and activations for accounting
+Rows from Database.export_iter are written as CSV or JSONL in fixed-size chunks
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+import logging
+
+from records import Activation, Transaction
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_DIR = 'exports'
+EXPORT_CHUNK_ROWS = 10000  # rows buffered per write
+
+# CSV columns per kind (JSONL keeps every field of the record)
+EXPORT_COLUMNS = {
+    'transactions': Transaction.FIELDS,
+    'activations': Activation.FIELDS
+}
+
+
+def write_export(rows: Iterable[Dict], kind: str, fmt: str, path: str) -> int:
+    """Write rows to `path` as CSV or JSONL, one chunk at a time. Returns the row count."""
+    if kind not in EXPORT_COLUMNS:
+        raise ValueError(f"Unknown export kind: {kind}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected one of: {', '.join(EXPORT_FORMATS)})")
+
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS[kind], extrasaction='ignore')
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        def write_row(row: Dict):
+            buffer.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            buffer.write('\n')
+
+    count = 0
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+        for row in rows:
+            write_row(row)
+            count += 1
+            if count % EXPORT_CHUNK_ROWS == 0:
+                f.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+        f.write(buffer.getvalue())
+    os.replace(tmp_file, path)
+    return count
+
+
+def export_to_file(db, kind: str, fmt: str = 'csv', start: Optional[datetime] = None,
+                   end: Optional[datetime] = None, directory: str = EXPORT_DIR) -> str:
+    """Export one kind over a time range into `directory`. Returns the file path."""
+    os.makedirs(directory, exist_ok=True)
+    # The file name shows the last day included (end itself is exclusive)
+    span = f"{start.date() if start else 'start'}_{(end - timedelta(microseconds=1)).date() if end else 'now'}"
+    path = os.path.join(directory, f"{kind}_{span}_{datetime.now():%Y%m%d%H%M%S}.{fmt}")
+    count = write_export(db.export_iter(kind, start, end), kind, fmt, path)
+    logger.info(f"Exported {count:,} {kind} to {path}")
+    return path
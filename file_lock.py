@@ -0,0 +1,83 @@
+"""
+Advisory inter-process file locks
+One exclusive flock per database: the process holding it owns the files next to it
+"""
+
+import os
+import time
+from typing import Optional
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: run without inter-process protection
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# A restarted bot waits this long for the previous process to exit
+FILE_LOCK_TIMEOUT = 30  # seconds
+FILE_LOCK_POLL_INTERVAL = 0.2  # seconds
+
+
+class FileLockTimeout(Exception):
+    """Another process kept the lock past the timeout"""
+
+
+class FileLock:
+    """Exclusive advisory lock on a side file, held until release()"""
+
+    def __init__(self, path: str, timeout: float = FILE_LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    def acquire(self):
+        """Take the lock, waiting up to `timeout` seconds for the current holder to let go"""
+        if fcntl is None:
+            logger.warning(f"File locking is not available here; {self.path} is not protected")
+            return
+        lock_file = open(self.path, 'a+', encoding='utf-8')
+        deadline = time.monotonic() + self.timeout
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                holder = _read_pid(lock_file)
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    raise FileLockTimeout(f"{self.path} is still held by process {holder or '?'} "
+                                          f"after {self.timeout}s")
+                if not waiting:
+                    logger.warning(f"Waiting for process {holder or '?'} to release {self.path}")
+                    waiting = True
+                time.sleep(FILE_LOCK_POLL_INTERVAL)
+
+        # Leave our pid for whoever waits next
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+
+    def release(self):
+        """Let the next process in"""
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _read_pid(lock_file) -> Optional[str]:
+    """Pid written by the current holder, if any"""
+    lock_file.seek(0)
+    return lock_file.read().strip() or None
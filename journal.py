@@ -0,0 +1,175 @@
+"""
+Append-only mutation journal for the JSON database
+Each mutation is one compact JSON line; fsync is group-committed by a writer thread
+"""
+
+import json
+import os
+import shutil
+import threading
+from typing import Dict, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_RETRY_INTERVAL = 1  # seconds between attempts after a failed write
+
+
+class JournalWriteError(Exception):
+    """Records could not be written to the journal (yet)"""
+
+
+class MutationJournal:
+    """JSONL write-ahead journal with group-committed fsync"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0  # Records in the current journal file
+        self._file = open(path, 'a', encoding='utf-8')
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending: List[str] = []
+        self._appended = 0  # Last ticket handed out
+        self._durable = 0   # Last ticket that reached the disk
+        self._error: Optional[Exception] = None  # Why the last write failed, until one succeeds
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._flush_worker, daemon=True)
+        self._thread.start()
+
+    def append(self, record: Dict) -> int:
+        """Queue a record and return its ticket for wait()"""
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._pending.append(line)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+
+    @property
+    def pending(self) -> bool:
+        """Whether records are queued but not yet written"""
+        with self._cond:
+            return bool(self._pending)
+
+    def wait(self, ticket: int):
+        """Block until the record with this ticket is fsynced; JournalWriteError if writing it failed"""
+        with self._cond:
+            while self._durable < ticket and not self._closed:
+                if self._error is not None:
+                    raise JournalWriteError(f"Journal record {ticket} is not on disk: {self._error}")
+                self._cond.wait()
+
+    def _flush_worker(self):
+        """Write and fsync everything queued since the last flush in one go"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+
+            with self._io_lock:
+                with self._cond:
+                    lines, self._pending = self._pending, []
+                    ticket = self._appended
+                try:
+                    self._write(lines)
+                    error = None
+                except Exception as e:
+                    error = e
+
+            with self._cond:
+                if error is None:
+                    self._durable = max(self._durable, ticket)
+                    self._error = None
+                    self._cond.notify_all()
+                    continue
+                # Not durable: waiters hear about it, the lines go back in front of newer ones
+                logger.error(f"Error writing journal, will retry: {error}")
+                self._pending = lines + self._pending
+                self._error = error
+                self._cond.notify_all()
+                if self._closed:
+                    logger.error(f"Giving up on {len(self._pending)} journal records at close")
+                    return
+                self._cond.wait(JOURNAL_RETRY_INTERVAL)
+
+    def _write(self, lines: List[str]):
+        """Append lines and fsync (caller holds the io lock)"""
+        if not lines:
+            return
+        start = self._file.tell()
+        try:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception:
+            # Drop a partly written batch: a torn line would hide every record after it on replay
+            try:
+                self._file.truncate(start)
+                self._file.seek(start)
+            except OSError:
+                pass
+            raise
+        self.records += len(lines)
+
+    def rotate(self) -> str:
+        """Flush and move the current journal aside, start a new one. Returns the old path."""
+        old_path = self.path + '.old'
+        with self._io_lock:
+            with self._cond:
+                lines, self._pending = self._pending, []
+                ticket = self._appended
+            try:
+                self._write(lines)
+            except Exception:
+                with self._cond:
+                    self._pending = lines + self._pending
+                raise
+            self._file.close()
+            if os.path.exists(old_path):
+                # A compaction failed after its rotate: the old segment still holds records
+                # no snapshot has, so append to it rather than replace it
+                with open(self.path, 'rb') as current, open(old_path, 'ab') as old:
+                    shutil.copyfileobj(current, old)
+                    old.flush()
+                    os.fsync(old.fileno())
+                self._file = open(self.path, 'w', encoding='utf-8')
+            else:
+                os.replace(self.path, old_path)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self.records = 0
+
+        with self._cond:
+            self._durable = max(self._durable, ticket)
+            self._error = None
+            self._cond.notify_all()
+        return old_path
+
+    def close(self):
+        """Flush pending records and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._io_lock:
+            self._file.close()
+
+
+def read_journal(path: str) -> Iterator[Dict]:
+    """Read journal records, stopping at a torn last line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring corrupt journal record at {path}:{line_number}")
+                return
@@ -0,0 +1,882 @@
+"""
+JSON storage engine for user management and transactions
+users.json snapshot, optionally with a mutation journal, history archive and columnar ledger
+"""
+
+import bisect
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+from operator import attrgetter, itemgetter
+from typing import Optional, Dict, Iterator, List
+import logging
+
+from archive import HistoryArchive, TIME_KEYS
+from file_lock import FILE_LOCK_TIMEOUT, FileLock
+from journal import MutationJournal, read_journal
+from json_stream import JSONSectionReader
+from ledger import ColumnarLedger
+from pagination import paginate
+from money import format_money, migrate_legacy_fields
+from records import ACTIVE_STATUSES, Activation, MICROS_PER_DAY, Transaction, User, from_epoch, to_epoch, to_json
+
+logger = logging.getLogger(__name__)
+
+# Plain JSON mode: users.json is rewritten by a background writer at most this
+# often, or sooner once SNAPSHOT_FLUSH_MUTATIONS mutations are waiting
+SNAPSHOT_FLUSH_INTERVAL = 0.5  # seconds
+SNAPSHOT_FLUSH_MUTATIONS = 100
+
+# Journal mode: fold the journal into a fresh users.json this often,
+# or sooner once it grows past JOURNAL_COMPACT_RECORDS records
+JOURNAL_COMPACT_INTERVAL = 300  # seconds
+JOURNAL_COMPACT_RECORDS = 10000
+
+# Version 2: money is stored as integer cents (balance_cents, amount_cents, ...)
+SCHEMA_VERSION = 2
+
+# Startup: log load progress every this many records
+LOAD_PROGRESS_RECORDS = 100000
+
+# History archive: how often to look for months that left the hot window
+# and for finished activations past their retention period
+ARCHIVE_CHECK_INTERVAL = 3600  # seconds
+
+
+class JSONDatabase:
+    """Simple JSON-based database for user data"""
+    
+    def __init__(self, db_file: str = 'users.json', journal: bool = False,
+                 compact_interval: float = JOURNAL_COMPACT_INTERVAL, hot_months: int = 0,
+                 columnar: bool = False, flush_interval: float = SNAPSHOT_FLUSH_INTERVAL,
+                 flush_mutations: int = SNAPSHOT_FLUSH_MUTATIONS, lock_timeout: float = FILE_LOCK_TIMEOUT,
+                 activation_retention_days: int = 0):
+        self.db_file = db_file
+        self.journal_file = db_file + '.journal'
+        # Held until close(): a second bot process waits here instead of overwriting our files
+        self._file_lock = FileLock(db_file + '.lock', lock_timeout)
+        self._file_lock.acquire()
+        self._lock = threading.RLock()  # Guards the shared structures, held briefly
+        self._user_locks: Dict[int, threading.Lock] = {}
+        self._user_locks_guard = threading.Lock()
+        self._stop = threading.Event()
+        self._snapshot_cond = threading.Condition(self._lock)  # Wakes the snapshot writer
+        self._save_lock = threading.Lock()  # One snapshot write at a time, in order
+        self._dirty = 0  # Mutations not yet written to users.json
+        self._dirty_since = 0.0
+        
+        # hot_months > 0: keep only that many months (incl. the current one) in memory
+        self.hot_months = hot_months
+        # activation_retention_days > 0: archive cancelled/completed activations older than that
+        self.activation_retention_days = activation_retention_days
+        self.archive = None
+        if hot_months > 0 or activation_retention_days > 0:
+            self.archive = HistoryArchive(os.path.splitext(db_file)[0] + '_archive',
+                                          normalize=migrate_legacy_fields)
+        
+        # columnar: keep a column-array projection of the history for admin queries
+        self.ledger = ColumnarLedger() if columnar else None
+        
+        self.data = self._load()  # Also builds the indexes
+        if not all(self._time_ordered.values()):
+            self._sort_history()
+        self.rebuild_statistics()
+        self.journal = None
+        
+        if journal:
+            self._replay_journal()
+            # Fold whatever was replayed into the snapshot before taking new writes
+            self._write_snapshot(self._serialize())
+            for path in (self.journal_file + '.old', self.journal_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.journal = MutationJournal(self.journal_file)
+            self._start_compactor(compact_interval)
+        else:
+            self._start_snapshot_writer(flush_interval, flush_mutations)
+        
+        if self.archive:
+            self.seal_old_months()
+            self._start_archiver()
+    
+    def _load(self) -> Dict:
+        """Load database from file, streaming it record by record and indexing as it goes"""
+        self._reset_indexes()
+        if not os.path.exists(self.db_file):
+            return self._default_structure()
+        
+        started = time.monotonic()
+        size = os.path.getsize(self.db_file)
+        data = self._default_structure()
+        reader = JSONSectionReader(self.db_file)
+        loaded = 0
+        # Old float-dollar records are converted on the fly; snapshots write
+        # schema_version first, so current files skip the conversion
+        version = 1
+        legacy = True
+        try:
+            for section, item in reader:
+                if section == 'users':
+                    user = migrate_legacy_fields(item[1]) if legacy else item[1]
+                    data['users'][item[0]] = User.from_dict(user)
+                elif section == 'transactions':
+                    transaction = Transaction.from_dict(migrate_legacy_fields(item) if legacy else item)
+                    data['transactions'].append(transaction)
+                    self._index_transaction(transaction)
+                elif section == 'activations':
+                    activation = Activation.from_dict(migrate_legacy_fields(item) if legacy else item)
+                    data['activations'].append(activation)
+                    self._index_activation(activation)
+                elif section == 'schema_version':
+                    version = item
+                    legacy = version < SCHEMA_VERSION
+                    continue
+                else:
+                    data[section] = item
+                    continue
+                loaded += 1
+                if loaded % LOAD_PROGRESS_RECORDS == 0:
+                    logger.info(f"Loading {self.db_file}: {loaded:,} records, "
+                                f"~{min(100, reader.chars_read * 100 // max(size, 1))}%")
+        except Exception as e:
+            logger.error(f"Error loading database: {e}")
+            self._reset_indexes()
+            return self._default_structure()
+        
+        if version < 2:
+            logger.info("Migrated database money fields to integer cents")
+        logger.info(f"Loaded {self.db_file} ({size / 1e6:.1f} MB): {len(data['users']):,} users, "
+                    f"{len(data['transactions']):,} transactions, {len(data['activations']):,} activations "
+                    f"in {time.monotonic() - started:.2f}s")
+        return data
+    
+    def _default_structure(self) -> Dict:
+        """Default database structure"""
+        return {
+            'schema_version': SCHEMA_VERSION,
+            'users': {},
+            'transactions': [],
+            'activations': []
+        }
+    
+    def _serialize(self) -> str:
+        """users.json text for the current data, records in their dict form (caller holds the lock)"""
+        return json.dumps(self.data, indent=2, ensure_ascii=False, default=to_json)
+    
+    def _save(self):
+        """Write a snapshot to users.json if anything changed since the last one"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = self._serialize()
+                written = self._dirty
+                self._dirty = 0
+            try:
+                self._write_snapshot(snapshot)
+            except Exception as e:
+                logger.error(f"Error saving database: {e}")
+                with self._lock:
+                    self._mark_dirty(written)  # Try again on the next flush
+    
+    def _mark_dirty(self, mutations: int = 1):
+        """Schedule a background snapshot (caller holds the lock)"""
+        if not self._dirty:
+            self._dirty_since = time.monotonic()
+        self._dirty += mutations
+        self._snapshot_cond.notify()
+    
+    def _start_snapshot_writer(self, interval: float, max_mutations: int):
+        """Start background thread that coalesces mutations into one snapshot write"""
+        def writer_worker():
+            while True:
+                with self._snapshot_cond:
+                    while not self._dirty and not self._stop.is_set():
+                        self._snapshot_cond.wait()
+                    if self._stop.is_set():
+                        return  # close() writes the last snapshot
+                    # Let a burst of mutations finish, unless it is already large
+                    deadline = self._dirty_since + interval
+                    while self._dirty < max_mutations and not self._stop.is_set():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._snapshot_cond.wait(remaining)
+                self._save()
+        
+        self._writer = threading.Thread(target=writer_worker, daemon=True)
+        self._writer.start()
+    
+    def _write_snapshot(self, snapshot: str):
+        """Atomically replace the database file with a serialized snapshot"""
+        tmp_file = self.db_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.db_file)
+    
+    # ========== INDEXES ==========
+    
+    def _build_indexes(self):
+        """Build per-user, time-ordered indexes, the activation_id index and the ledger"""
+        self._reset_indexes()
+        for transaction in self.data['transactions']:
+            self._index_transaction(transaction)
+        for activation in self.data['activations']:
+            self._index_activation(activation)
+    
+    def _sort_history(self):
+        """Put the history lists back in time order (the snapshot keeps it from then on)"""
+        for kind, time_key in TIME_KEYS.items():
+            self.data[kind].sort(key=attrgetter(time_key))
+        self._build_indexes()
+        with self._lock:
+            self._mark_dirty()
+        logger.info("Sorted history records into time order")
+    
+    def _reset_indexes(self):
+        """Start with empty indexes"""
+        self._user_transactions: Dict[int, List[Transaction]] = {}
+        self._user_activations: Dict[int, List[Activation]] = {}
+        self._activations_by_id: Dict[str, Activation] = {}
+        # Whether data['transactions'] / data['activations'] are in time order (exports bisect them)
+        self._time_ordered = {kind: True for kind in TIME_KEYS}
+        self._newest = {kind: 0 for kind in TIME_KEYS}
+        if self.ledger:
+            self.ledger.clear()
+    
+    def _track_order(self, kind: str, moment: int):
+        """Note the time of a record indexed after the previous one of its kind"""
+        if moment < self._newest[kind]:
+            self._time_ordered[kind] = False
+        else:
+            self._newest[kind] = moment
+    
+    def _index_transaction(self, transaction: Transaction):
+        """Add a transaction to the indexes"""
+        self._index_record(self._user_transactions, transaction, 'timestamp')
+        self._track_order('transactions', transaction.timestamp)
+        if self.ledger:
+            self.ledger.add_transaction(transaction)
+    
+    def _index_activation(self, activation: Activation):
+        """Add an activation to the indexes"""
+        self._index_record(self._user_activations, activation, 'created_at')
+        self._track_order('activations', activation.created_at)
+        # First record wins, like the old linear scan did
+        self._activations_by_id.setdefault(str(activation.activation_id), activation)
+        if self.ledger:
+            self.ledger.add_activation(activation)
+    
+    def _index_record(self, index: Dict[int, List], record, time_key: str):
+        """Insert a record into a per-user index, keeping it sorted by time"""
+        records = index.setdefault(record.user_id, [])
+        # New records are almost always the newest, so this is an append
+        bisect.insort(records, record, key=attrgetter(time_key))
+    
+    def _insert_transaction(self, transaction: Transaction):
+        """Append a transaction and index it (caller holds the lock)"""
+        self.data['transactions'].append(transaction)
+        self._index_transaction(transaction)
+        self._stats['transactions_by_day'][transaction.timestamp // MICROS_PER_DAY] += 1
+    
+    def _insert_activation(self, activation: Activation):
+        """Append an activation and index it (caller holds the lock)"""
+        self.data['activations'].append(activation)
+        self._index_activation(activation)
+        self._stats['activations_by_day'][activation.created_at // MICROS_PER_DAY] += 1
+    
+    def _insert_user(self, user: User):
+        """Add or replace a user record (caller holds the lock)"""
+        previous = self.data['users'].get(str(user.user_id))
+        if previous:
+            self._count_user(previous, -1)
+        self.data['users'][str(user.user_id)] = user
+        self._count_user(user, 1)
+    
+    def _update_user_fields(self, user: User, fields: Dict):
+        """Update a user record and the running totals (caller holds the lock)"""
+        self._count_user(user, -1)
+        user.update(fields)
+        self._count_user(user, 1)
+    
+    def _user_lock(self, user_id: int) -> threading.Lock:
+        """Get the lock serializing read-modify-write operations on one user"""
+        with self._user_locks_guard:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+    
+    # ========== STATISTICS ==========
+    
+    def _count_user(self, user: User, sign: int):
+        """Add (sign=1) or remove (sign=-1) a user's money from the running totals"""
+        self._stats['total_balance_cents'] += sign * user.balance_cents
+        self._stats['total_spent_cents'] += sign * user.total_spent_cents
+    
+    def _compute_statistics(self) -> Dict:
+        """Compute the aggregates from scratch by scanning users and the ledger"""
+        users = self.data['users'].values()
+        return {
+            'total_balance_cents': sum(u.balance_cents for u in users),
+            'total_spent_cents': sum(u.total_spent_cents for u in users),
+            # Keyed by epoch day number
+            'transactions_by_day': Counter(t.timestamp // MICROS_PER_DAY for t in self.data['transactions']),
+            'activations_by_day': Counter(a.created_at // MICROS_PER_DAY for a in self.data['activations'])
+        }
+    
+    def rebuild_statistics(self) -> Dict:
+        """Recompute the running aggregates from the ledger. Returns the previous values."""
+        with self._lock:
+            previous = getattr(self, '_stats', None)
+            self._stats = self._compute_statistics()
+            if previous is not None and previous != self._stats:
+                logger.warning("Running statistics drifted from the ledger and were rebuilt")
+            return previous
+    
+    # ========== JOURNAL MODE ==========
+    
+    def _log(self, op: str, **payload) -> Optional[int]:
+        """Record a mutation (caller holds the lock). Returns a journal ticket."""
+        if self.journal is None:
+            self._mark_dirty()
+            return None
+        seq = self.data.get('journal_seq', 0) + 1
+        self.data['journal_seq'] = seq
+        return self.journal.append({'seq': seq, 'op': op, **payload})
+    
+    def _sync(self, ticket: Optional[int]):
+        """Wait until a logged mutation is durable"""
+        if ticket is not None:
+            self.journal.wait(ticket)
+            if self.journal.records >= JOURNAL_COMPACT_RECORDS:
+                self._compact_event.set()
+    
+    def _replay_journal(self):
+        """Apply journal records newer than the snapshot"""
+        snapshot_seq = self.data.get('journal_seq', 0)
+        replayed = 0
+        for path in (self.journal_file + '.old', self.journal_file):
+            for record in read_journal(path):
+                if record.get('seq', 0) <= snapshot_seq:
+                    continue
+                self._apply_record(record)
+                self.data['journal_seq'] = snapshot_seq = record['seq']
+                replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} journal records")
+    
+    def _apply_record(self, record: Dict):
+        """Apply one journal record to the in-memory data"""
+        # Records journaled before the switch to cents still carry floats
+        for key in ('user', 'fields', 'user_fields', 'transaction', 'activation'):
+            if key in record:
+                migrate_legacy_fields(record[key])
+        op = record['op']
+        if op == 'create_user':
+            self._insert_user(User.from_dict(record['user']))
+        elif op == 'update_user':
+            user = self.data['users'].get(str(record['user_id']))
+            if user:
+                self._update_user_fields(user, record['fields'])
+        elif op == 'add_transaction':
+            self._insert_transaction(Transaction.from_dict(record['transaction']))
+        elif op == 'balance_change':
+            user = self.data['users'].get(str(record['user_id']))
+            if user:
+                self._update_user_fields(user, record['fields'])
+            self._insert_transaction(Transaction.from_dict(record['transaction']))
+        elif op == 'add_activation':
+            self._insert_activation(Activation.from_dict(record['activation']))
+            user = self.data['users'].get(str(record['activation']['user_id']))
+            if user and 'user_fields' in record:
+                self._update_user_fields(user, record['user_fields'])
+        elif op == 'update_activation':
+            activation = self._activations_by_id.get(str(record['activation_id']))
+            if activation:
+                activation.update(record['fields'])
+        elif op == 'seal_months':
+            for kind in TIME_KEYS:
+                gone = set(map(id, self._sealable(kind, record['before'])))
+                self.data[kind] = [r for r in self.data[kind] if id(r) not in gone]
+            self._build_indexes()
+            self._stats = self._compute_statistics()
+        elif op == 'expire_activations':
+            # The segments were written before the record was logged
+            keys = {(activation_id, created_at) for activation_id, created_at in record['activations']}
+            self._drop_activations([activation for activation in self.data['activations']
+                                    if (str(activation.activation_id), activation.created_at) in keys])
+        else:
+            logger.warning(f"Unknown journal operation: {op}")
+    
+    def _start_compactor(self, interval: float):
+        """Start background thread that folds the journal into users.json"""
+        self._compact_event = threading.Event()
+        
+        def compactor_worker():
+            while not self._stop.is_set():
+                self._compact_event.wait(interval)
+                self._compact_event.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.error(f"Error compacting journal: {e}")
+        
+        self._compactor = threading.Thread(target=compactor_worker, daemon=True)
+        self._compactor.start()
+    
+    def compact(self, force: bool = False):
+        """Write a fresh snapshot and drop the journal records it contains"""
+        if self.journal is None:
+            return
+        with self._lock:
+            if not force and self.journal.records == 0 and not self.journal.pending:
+                return
+            snapshot = self._serialize()
+            old_journal = self.journal.rotate()
+        
+        # Records logged from here on go to the new journal; the old one is
+        # only needed until the snapshot is safely on disk
+        self._write_snapshot(snapshot)
+        os.remove(old_journal)
+        logger.info("Compacted database journal")
+    
+    def close(self):
+        """Flush everything to disk"""
+        self._stop.set()
+        if self.archive:
+            self._archiver.join()  # Let a running archive pass finish first
+        if self.journal is None:
+            with self._snapshot_cond:
+                self._snapshot_cond.notify_all()
+            self._writer.join()
+            self._save()
+        else:
+            self._compact_event.set()
+            self._compactor.join()
+            self.compact()
+            self.journal.close()
+            self.journal = None
+        self._file_lock.release()
+    
+    # ========== HISTORY ARCHIVE ==========
+    
+    def _start_archiver(self):
+        """Start background thread that seals old months and expires finished activations"""
+        def archiver_worker():
+            while True:
+                for task in (self.seal_old_months, self.expire_activations):
+                    try:
+                        task()
+                    except Exception as e:
+                        logger.error(f"Error archiving history: {e}")
+                if self._stop.wait(ARCHIVE_CHECK_INTERVAL):
+                    return
+        
+        self._archiver = threading.Thread(target=archiver_worker, daemon=True)
+        self._archiver.start()
+    
+    def _hot_cutoff(self) -> str:
+        """First month (YYYY-MM) that stays in memory"""
+        now = datetime.now()
+        months = now.year * 12 + now.month - 1 - (self.hot_months - 1)
+        return f"{months // 12:04d}-{months % 12 + 1:02d}"
+    
+    def seal_old_months(self) -> int:
+        """Move records older than the hot window into archive segments. Returns how many."""
+        if not self.archive or self.hot_months <= 0:
+            return 0
+        cutoff = self._hot_cutoff()
+        cutoff_time = to_epoch(f"{cutoff}-01T00:00:00")
+        sealed = 0
+        
+        with self._lock:
+            for kind, time_key in TIME_KEYS.items():
+                old = self._sealable(kind, cutoff_time)
+                if not old:
+                    continue
+                old_months: Dict[str, List[Dict]] = {}
+                for record in old:
+                    old_months.setdefault(from_epoch(getattr(record, time_key))[:7], []).append(record.to_dict())
+                
+                for month, records in old_months.items():
+                    # Merges with expired activations sealed earlier, and skips records
+                    # a previous run sealed before it could save the snapshot
+                    self.archive.append(kind, month, records)
+                    sealed += len(records)
+                gone = set(map(id, old))
+                self.data[kind] = [r for r in self.data[kind] if id(r) not in gone]
+            
+            if not sealed:
+                return 0
+            
+            self._build_indexes()
+            self._stats = self._compute_statistics()
+            if self.journal is None:
+                self._mark_dirty(sealed)
+                ticket = None
+            else:
+                # Under the lock the same cutoff selects the same records again on replay
+                ticket = self._log('seal_months', before=cutoff_time)
+        self._sync(ticket)
+        
+        logger.info(f"Archived {sealed} records older than {cutoff}")
+        return sealed
+    
+    def _sealable(self, kind: str, cutoff_time: int) -> List:
+        """Records of a kind older than the cutoff that may be sealed (caller holds the lock)"""
+        moment = attrgetter(TIME_KEYS[kind])
+        # Orders still in progress stay hot whatever their age: the archive is read-only,
+        # so status updates and refunds would no longer reach them
+        return [record for record in self.data[kind] if moment(record) < cutoff_time
+                and (kind != 'activations' or record.status not in ACTIVE_STATUSES)]
+    
+    def expire_activations(self) -> int:
+        """Move finished activations older than the retention period into the archive. Returns how many."""
+        if not self.archive or self.activation_retention_days <= 0:
+            return 0
+        cutoff = to_epoch(datetime.now() - timedelta(days=self.activation_retention_days))
+        
+        with self._lock:
+            expired = [activation for activation in self.data['activations']
+                       if activation.created_at < cutoff and activation.status not in ACTIVE_STATUSES]
+            if not expired:
+                return 0
+            by_month: Dict[str, List[Dict]] = {}
+            for activation in expired:
+                by_month.setdefault(from_epoch(activation.created_at)[:7], []).append(activation.to_dict())
+        
+        # Writing the segments is the slow part: handlers keep running meanwhile
+        for month, records in by_month.items():
+            self.archive.append('activations', month, records)
+        
+        with self._lock:
+            self._drop_activations(expired)
+            if self.journal is None:
+                self._mark_dirty(len(expired))
+                ticket = None
+            else:
+                ticket = self._log('expire_activations', activations=[
+                    [str(activation.activation_id), activation.created_at] for activation in expired])
+        self._sync(ticket)
+        
+        logger.info(f"Archived {len(expired)} finished activations older than "
+                    f"{self.activation_retention_days} days")
+        return len(expired)
+    
+    def _drop_activations(self, expired: List[Activation]):
+        """Remove archived activations from memory and the indexes (caller holds the lock)"""
+        gone = set(map(id, expired))
+        activations = self.data['activations']
+        kept = [row for row, activation in enumerate(activations) if id(activation) not in gone]
+        self.data['activations'] = [activations[row] for row in kept]
+        if self.ledger:
+            self.ledger.select_activations(kept)
+        for user_id in {activation.user_id for activation in expired}:
+            records = [a for a in self._user_activations[user_id] if id(a) not in gone]
+            if records:
+                self._user_activations[user_id] = records
+            else:
+                del self._user_activations[user_id]
+        for activation in expired:
+            if self._activations_by_id.get(str(activation.activation_id)) is activation:
+                del self._activations_by_id[str(activation.activation_id)]
+            self._stats['activations_by_day'][activation.created_at // MICROS_PER_DAY] -= 1
+    
+    def _with_archive(self, kind: str, records: List, limit: int, user_id: int = None) -> List[Dict]:
+        """Newest-first records as dicts, topped up from the archive when the hot window runs out"""
+        records = [record.to_dict() for record in records]
+        if self.archive and len(records) < limit:
+            # Unfinished activations stay hot past the window, so the two sides can interleave
+            archived = islice(self.archive.iter_newest(kind, user_id), limit - len(records))
+            records = list(heapq.merge(records, archived, key=itemgetter(TIME_KEYS[kind]), reverse=True))
+        return records
+    
+    def _user_record(self, user_id: int) -> Optional[User]:
+        """The stored user record (not a copy)"""
+        return self.data['users'].get(str(user_id))
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        user = self._user_record(user_id)
+        return user.to_dict() if user else None
+    
+    def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Create a new user"""
+        user = User(user_id, username, first_name, created_at=to_epoch(datetime.now()))
+        user_data = user.to_dict()
+        with self._lock:
+            self._insert_user(user)
+            ticket = self._log('create_user', user=user_data)
+        self._sync(ticket)
+        logger.info(f"Created new user: {user_id}")
+        return user_data
+    
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        user_key = str(user_id)
+        with self._lock:
+            if user_key not in self.data['users']:
+                return
+            self._update_user_fields(self.data['users'][user_key], kwargs)
+            ticket = self._log('update_user', user_id=user_id, fields=kwargs)
+        self._sync(ticket)
+    
+    def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Get existing user or create new one"""
+        user = self.get_user(user_id)
+        if not user:
+            user = self.create_user(user_id, username, first_name)
+        return user
+    
+    def set_language(self, user_id: int, language: str):
+        """Set user language"""
+        self.update_user(user_id, language=language)
+    
+    def get_language(self, user_id: int) -> str:
+        """Get user language"""
+        user = self._user_record(user_id)
+        return user.language if user else 'en'
+    
+    def get_balance(self, user_id: int) -> int:
+        """Get user balance in cents"""
+        user = self._user_record(user_id)
+        return user.balance_cents if user else 0
+    
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str, description: str = "") -> Optional[int]:
+        """
+        Atomically change a user's balance and record the transaction.
+        type 'add' credits amount_cents; 'deduct' debits it only if the balance covers it
+        and counts it as spent. Returns the new balance in cents, or None if refused.
+        """
+        with self._user_lock(user_id):
+            user = self._user_record(user_id)
+            if not user:
+                return None
+            
+            balance = user.balance_cents
+            if type == 'deduct':
+                if balance < amount_cents:
+                    return None
+                fields = {
+                    'balance_cents': balance - amount_cents,
+                    'total_spent_cents': user.total_spent_cents + amount_cents
+                }
+            else:
+                fields = {'balance_cents': balance + amount_cents}
+            
+            # Balance, counters and ledger row go out as one commit; stamped under
+            # the lock so the history list stays in time order
+            with self._lock:
+                transaction = Transaction(user_id, amount_cents, type, description, to_epoch(datetime.now()))
+                self._update_user_fields(user, fields)
+                self._insert_transaction(transaction)
+                ticket = self._log('balance_change', user_id=user_id, fields=fields,
+                                   transaction=transaction.to_dict())
+        
+        self._sync(ticket)
+        return fields['balance_cents']
+    
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""):
+        """Add balance (in cents) to user"""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'add', description)
+        if new_balance is not None:
+            logger.info(f"Added {format_money(amount_cents)} to user {user_id}. "
+                        f"New balance: {format_money(new_balance)}")
+    
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool:
+        """Deduct balance (in cents) from user. Returns True if successful."""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'deduct', description)
+        if new_balance is None:
+            return False
+        logger.info(f"Deducted {format_money(amount_cents)} from user {user_id}. "
+                    f"New balance: {format_money(new_balance)}")
+        return True
+    
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""):
+        """Add transaction record"""
+        with self._lock:
+            transaction = Transaction(user_id, amount_cents, type, description, to_epoch(datetime.now()))
+            self._insert_transaction(transaction)
+            ticket = self._log('add_transaction', transaction=transaction.to_dict())
+        self._sync(ticket)
+    
+    def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user transactions"""
+        transactions = _newest_first(self._user_transactions.get(user_id, []), limit)
+        return self._with_archive('transactions', transactions, limit, user_id)
+    
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """One page of a user's (or everyone's) transactions, newest first, from a cursor"""
+        runs = []
+        if self.archive:
+            for month in self.archive.months('transactions'):
+                if user_id is None or str(user_id) in self.archive.manifest['transactions'][month]['users']:
+                    runs.append((month, partial(self._archived_run, 'transactions', month, user_id)))
+        with self._lock:
+            if user_id is not None:
+                hot = self._user_transactions.get(user_id, [])
+            elif self._time_ordered['transactions']:
+                hot = self.data['transactions']
+            else:
+                hot = sorted(self.data['transactions'], key=attrgetter('timestamp'))
+        runs.append((None, lambda: (hot, attrgetter('timestamp'))))
+        return paginate(runs, limit, before, after)
+    
+    def _archived_run(self, kind: str, month: str, user_id: Optional[int]):
+        """An archived month as a pagination run (filtered to one user)"""
+        records = self.archive.load(kind, month)
+        if user_id is not None:
+            records = [record for record in records if record['user_id'] == user_id]
+        time_key = TIME_KEYS[kind]
+        return records, lambda record: to_epoch(record[time_key])
+    
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int):
+        """Add activation record (cost_cents is what the user paid)"""
+        activation = Activation.from_dict({
+            'user_id': user_id,
+            'activation_id': activation_data.get('activationId'),
+            'phone_number': activation_data.get('phoneNumber'),
+            'service': activation_data.get('service'),
+            'country': activation_data.get('countryCode'),
+            'cost_cents': cost_cents,
+            'status': 'active'
+        })
+        with self._user_lock(user_id):
+            user = self._user_record(user_id)
+            
+            # Activation and the user's counter go out as one commit
+            with self._lock:
+                activation.created_at = to_epoch(datetime.now())
+                self._insert_activation(activation)
+                if user:
+                    user_fields = {'total_activations': user.total_activations + 1}
+                    self._update_user_fields(user, user_fields)
+                    ticket = self._log('add_activation', activation=activation.to_dict(), user_fields=user_fields)
+                else:
+                    ticket = self._log('add_activation', activation=activation.to_dict())
+        self._sync(ticket)
+    
+    def update_activation(self, activation_id: str, **kwargs):
+        """Update activation record"""
+        with self._lock:
+            activation = self._activations_by_id.get(str(activation_id))
+            if not activation:
+                return
+            activation.update(kwargs)
+            ticket = self._log('update_activation', activation_id=activation_id, fields=kwargs)
+        self._sync(ticket)
+    
+    def get_activation(self, activation_id: str) -> Optional[Dict]:
+        """Get activation by ID"""
+        activation = self._activations_by_id.get(str(activation_id))
+        return activation.to_dict() if activation else None
+    
+    def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user activations"""
+        activations = _newest_first(self._user_activations.get(user_id, []), limit)
+        return self._with_archive('activations', activations, limit, user_id)
+    
+    def get_all_users(self) -> List[Dict]:
+        """Get all users"""
+        with self._lock:
+            return [user.to_dict() for user in self.data['users'].values()]
+    
+    def get_all_transactions(self, limit: int = 100) -> List[Dict]:
+        """Get all transactions"""
+        with self._lock:
+            if self._time_ordered['transactions']:
+                transactions = _newest_first(self.data['transactions'], limit)
+            elif self.ledger:
+                transactions = [self.data['transactions'][row] for row in self.ledger.newest_transactions(limit)]
+            else:
+                transactions = sorted(self.data['transactions'], key=attrgetter('timestamp'), reverse=True)[:limit]
+        return self._with_archive('transactions', transactions, limit)
+    
+    def get_all_activations(self, limit: int = 100) -> List[Dict]:
+        """Get all activations"""
+        with self._lock:
+            if self._time_ordered['activations']:
+                activations = _newest_first(self.data['activations'], limit)
+            elif self.ledger:
+                activations = [self.data['activations'][row] for row in self.ledger.newest_activations(limit)]
+            else:
+                activations = sorted(self.data['activations'], key=attrgetter('created_at'), reverse=True)[:limit]
+        return self._with_archive('activations', activations, limit)
+    
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Transactions or activations with start <= time < end, oldest first, one dict at a time"""
+        if kind not in TIME_KEYS:
+            raise ValueError(f"Unknown export kind: {kind}")
+        hot = self._export_hot(kind, start, end)
+        if not self.archive:
+            return hot
+        # Expired activations can be archived while older unfinished ones stay in memory
+        archived = self.archive.iter_range(kind, start and start.isoformat(), end and end.isoformat())
+        return heapq.merge(archived, hot, key=itemgetter(TIME_KEYS[kind]))
+    
+    def _export_hot(self, kind: str, start: Optional[datetime], end: Optional[datetime]) -> Iterator[Dict]:
+        """In-memory records with start <= time < end, oldest first"""
+        moment = attrgetter(TIME_KEYS[kind])
+        low = to_epoch(start) if start else None
+        high = to_epoch(end) if end else None
+        with self._lock:
+            records = self.data[kind]  # Appended to under the lock, replaced (not changed) by archiving
+            if self._time_ordered[kind]:
+                first = bisect.bisect_left(records, low, key=moment) if low is not None else 0
+                last = bisect.bisect_left(records, high, key=moment) if high is not None else len(records)
+                rows = range(first, last)
+            else:
+                # The clock went back since startup: order the matching row numbers instead
+                rows = array('q', sorted(
+                    (row for row, record in enumerate(records)
+                     if (low is None or moment(record) >= low) and (high is None or moment(record) < high)),
+                    key=lambda row: moment(records[row])))
+        for row in rows:
+            yield records[row].to_dict()
+    
+    def get_statistics(self) -> Dict:
+        """Get overall statistics"""
+        today = to_epoch(datetime.now()) // MICROS_PER_DAY
+        
+        with self._lock:
+            return {
+                'total_users': len(self.data['users']),
+                'total_balance_cents': self._stats['total_balance_cents'],
+                'total_spent_cents': self._stats['total_spent_cents'],
+                'total_activations': len(self.data['activations']) + (
+                    self.archive.count('activations') if self.archive else 0),
+                'today_transactions': self._stats['transactions_by_day'][today],
+                'today_activations': self._stats['activations_by_day'][today]
+            }
+    
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Optional[Dict]:
+        """Revenue per day, top spenders and per-service volume over the last `days` days (None without the ledger)"""
+        if self.ledger is None:
+            return None
+        since = datetime.combine(datetime.now().date() - timedelta(days=days - 1), datetime.min.time())
+        # The ledger has its own lock; the database lock stays free for writers
+        return {
+            'revenue_by_day': self.ledger.revenue_by_day(since),
+            'top_spenders': self.ledger.top_spenders(since, limit),
+            'service_volume': self.ledger.service_volume(since)
+        }
+
+
+def _newest_first(records: List, limit: int) -> List:
+    """Last `limit` records of a time-ordered list, newest first"""
+    return records[:-limit - 1:-1] if limit > 0 else []
+
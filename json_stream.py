@@ -0,0 +1,193 @@
+"""
+Incremental reader for large JSON snapshot files
+Yields the members of each top-level section one at a time instead of decoding the whole file
+"""
+
+import json
+import re
+from typing import Any, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20  # characters read per refill
+
+DELIMITERS = ' \t\r\n,:]}'
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+SEPARATOR = re.compile(r'[ \t\r\n]*,[ \t\r\n]*')
+
+# After a batch that could not be decoded, go value by value for this many items
+BATCH_BACKOFF = 1000
+
+
+class JSONSectionReader:
+    """
+    Stream a top-level JSON object section by section.
+    Iterating yields (section, item):
+      object-valued sections -> one (key, value) pair per member
+      array-valued sections  -> one element at a time
+      anything else          -> the decoded value
+    """
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chars_read = 0  # For progress reporting
+        self._scan = json.JSONDecoder().scan_once
+        self._file = None
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._backoff = 0
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        with open(self.path, 'r', encoding='utf-8') as self._file:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                section = self._value()
+                self._expect(':')
+                opener = self._peek()
+                if opener == '{':
+                    yield from self._members(section)
+                elif opener == '[':
+                    yield from self._elements(section)
+                else:
+                    yield section, self._value()
+                if self._next_separator('}'):
+                    return
+
+    def _members(self, section: str) -> Iterator[Tuple[str, Tuple[str, Any]]]:
+        """Key/value pairs of the object at the cursor"""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        needle = None
+        self._backoff = 0
+        while True:
+            batch = self._batch('{', '}', needle) if needle else None
+            if batch is not None:
+                for member in batch.items():
+                    yield section, member
+            else:
+                key = self._value()
+                self._expect(':')
+                value = self._value()
+                end = self._pos
+                yield section, (key, value)
+            if needle is None and isinstance(value, dict):
+                # Members look like `"key": {...}`: cut batches between "}" and the next key
+                separator = SEPARATOR.match(self._buf, end)
+                if separator and separator.end() < len(self._buf):
+                    needle = '}' + separator.group() + '"'
+            if self._next_separator('}'):
+                return
+
+    def _elements(self, section: str) -> Iterator[Tuple[str, Any]]:
+        """Elements of the array at the cursor"""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        needle = None
+        self._backoff = 0
+        while True:
+            batch = self._batch('[', ']', needle) if needle else None
+            if batch is not None:
+                for element in batch:
+                    yield section, element
+            else:
+                element = self._value()
+                end = self._pos
+                yield section, element
+            if needle is None and isinstance(element, dict):
+                # Elements look like `{...}`: cut batches between "}" and the next "{"
+                separator = SEPARATOR.match(self._buf, end)
+                if separator and separator.end() < len(self._buf):
+                    needle = '}' + separator.group() + '{'
+            if self._next_separator(']'):
+                return
+
+    def _batch(self, opener: str, closer: str, needle: str) -> Optional[Any]:
+        """
+        Decode every complete item left in the buffer with one scanner call.
+        The cut goes after the last `needle` (the separator seen between the first
+        two items); a cut inside a string or nested value fails to decode, and the
+        caller falls back to one value at a time.
+        """
+        if self._backoff:
+            self._backoff -= 1
+            return None
+        self._peek()
+        if len(self._buf) - self._pos < self.chunk_size and not self._eof:
+            self._fill()  # Top up so a batch covers about one chunk
+        cut = self._buf.rfind(needle, self._pos)
+        if cut <= self._pos:
+            return None
+        cut += 1  # Keep the closing brace of the last whole item
+        text = opener + self._buf[self._pos:cut] + closer
+        try:
+            batch, end = self._scan(text, 0)
+        except (StopIteration, json.JSONDecodeError):
+            end = None
+        if end != len(text):
+            self._backoff = BATCH_BACKOFF
+            return None
+        self._pos = cut
+        return batch
+
+    def _next_separator(self, closer: str) -> bool:
+        """Consume ',' (returns False) or the closing bracket (returns True)"""
+        char = self._peek()
+        self._pos += 1
+        if char == closer:
+            return True
+        if char != ',':
+            raise ValueError(f"Expected ',' or '{closer}' in {self.path}, got {char!r}")
+        return False
+
+    def _value(self) -> Any:
+        """Decode one complete JSON value at the cursor"""
+        while True:
+            self._peek()
+            try:
+                value, end = self._scan(self._buf, self._pos)
+            except (StopIteration, json.JSONDecodeError):
+                # Incomplete value at the end of the buffer (or invalid JSON)
+                if self._eof:
+                    raise ValueError(f"Invalid JSON value in {self.path}")
+            else:
+                # A number cut by the chunk boundary ("1." + "5e3") decodes early:
+                # only trust a value once a delimiter follows it
+                if self._eof or (end < len(self._buf) and self._buf[end] in DELIMITERS):
+                    self._pos = end
+                    return value
+            self._fill()
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it"""
+        while True:
+            if self._pos < len(self._buf) and self._buf[self._pos] not in ' \t\r\n':
+                return self._buf[self._pos]
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise ValueError(f"Unexpected end of {self.path}")
+            self._fill()
+
+    def _expect(self, char: str):
+        """Consume an expected structural character"""
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in {self.path}, got {found!r}")
+        self._pos += 1
+
+    def _fill(self):
+        """Drop the consumed part of the buffer and read the next chunk"""
+        chunk = self._file.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return
+        self.chars_read += len(chunk)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
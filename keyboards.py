@@ -3,9 +3,12 @@ Keyboard layouts for the bot
 ReplyKeyboardMarkup and InlineKeyboardMarkup
 """
 
+from typing import Optional
+
 from telebot import types
 from languages import get_text
 from service_names import get_service_display_name, get_country_display_name
+from money import format_money
 
 
 def get_main_keyboard(lang: str) -> types.ReplyKeyboardMarkup:
@@ -288,7 +291,7 @@ def get_countries_keyboard(countries_data: dict, page: int = 0, prefix: str = "c
         if service_code and price_getter:
             price = price_getter(service_code, country['id'])
             if price > 0:
-                button_text = f"{button_text} - ${price:.2f}"
+                button_text = f"{button_text} - ${format_money(price)}"
         
         callback_data = f"{prefix}_{country['id']}"
         markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
@@ -333,12 +336,12 @@ def get_services_keyboard(services_data: list, page: int = 0, prefix: str = "ser
                 # Show approximate exact price for this country
                 price = price_getter('exact', code, country_id)
                 if price > 0:
-                    display_name = f"{display_name} - ~${price:.2f}"
+                    display_name = f"{display_name} - ~${format_money(price)}"
             else:
                 # Show approximate minimum price across all countries
                 price = price_getter('min', code)
                 if price > 0:
-                    display_name = f"{display_name} - from ~${price:.2f}"
+                    display_name = f"{display_name} - from ~${format_money(price)}"
         
         # Truncate if too long
         if len(display_name) > 40:
@@ -421,3 +424,17 @@ def get_order_action_keyboard(lang: str, order_id: str) -> types.InlineKeyboardM
     
     return markup
 
+
+def get_history_keyboard(prefix: str, older: str = None, newer: str = None) -> Optional[types.InlineKeyboardMarkup]:
+    """Get Previous (newer) / Next (older) buttons for a history page, None on a single page"""
+    nav_buttons = []
+    if newer:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ Previous", callback_data=f"{prefix}_newer_{newer}"))
+    if older:
+        nav_buttons.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}_older_{older}"))
+    
+    if not nav_buttons:
+        return None
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*nav_buttons)
+    return markup
@@ -38,7 +38,7 @@ Contact admin: {admin}
         'language_select': 'Please select your language:',
         'language_changed': '✅ Language changed to English',
         
-        'balance': '💰 *Your Balance*\n\nBalance: `${balance:.2f}` USD',
+        'balance': '💰 *Your Balance*\n\nBalance: `${balance}` USD',
         'no_balance': '⚠️ Insufficient balance. Please top up your account with /deposit',
         
         'deposit_request': """
@@ -72,7 +72,7 @@ Use /services and /countries to see codes.
 *Order ID:* `{order_id}`
 *Service:* `{service}`
 *Country:* `{country}`
-*Cost:* ${cost:.2f} USD
+*Cost:* ${cost} USD
 
 ⏳ *Waiting for SMS...*
 
@@ -110,11 +110,12 @@ Use `/cancel {order_id}` to cancel
         
         'history_empty': '📭 No transaction history.',
         'history_title': '📜 *Transaction History*\n\n',
-        'history_item': '• {date}: {type} ${amount:.2f} USD\n  {description}\n\n',
+        'history_item': '• {date}: {type} ${amount} USD\n  {description}\n\n',
         
         'admin_only': '⚠️ This command is only available to administrators.',
         'stats_title': '📊 *Bot Statistics*\n\n',
         'error_occurred': '❌ An error occurred. Please try again later.',
+        'service_unavailable': '❌ Service temporarily unavailable\n\nPlease try again later or contact admin.',
     },
     
     'ru': {
@@ -151,7 +152,7 @@ Use `/cancel {order_id}` to cancel
         'language_select': 'Пожалуйста, выберите язык:',
         'language_changed': '✅ Язык изменён на Русский',
         
-        'balance': '💰 *Ваш Баланс*\n\nБаланс: `${balance:.2f}` USD',
+        'balance': '💰 *Ваш Баланс*\n\nБаланс: `${balance}` USD',
         'no_balance': '⚠️ Недостаточно средств. Пополните баланс через /deposit',
         
         'deposit_request': """
@@ -185,7 +186,7 @@ Use `/cancel {order_id}` to cancel
 *ID Заказа:* `{order_id}`
 *Сервис:* `{service}`
 *Страна:* `{country}`
-*Стоимость:* ${cost:.2f} USD
+*Стоимость:* ${cost} USD
 
 ⏳ *Ожидание SMS...*
 
@@ -223,11 +224,12 @@ Use `/cancel {order_id}` to cancel
         
         'history_empty': '📭 История транзакций пуста.',
         'history_title': '📜 *История Транзакций*\n\n',
-        'history_item': '• {date}: {type} ${amount:.2f} USD\n  {description}\n\n',
+        'history_item': '• {date}: {type} ${amount} USD\n  {description}\n\n',
         
         'admin_only': '⚠️ Эта команда доступна только администраторам.',
         'stats_title': '📊 *Статистика Бота*\n\n',
         'error_occurred': '❌ Произошла ошибка. Попробуйте позже.',
+        'service_unavailable': '❌ Сервис временно недоступен\n\nПопробуйте позже или свяжитесь с админом.',
     },
     
     'uz': {
@@ -264,7 +266,7 @@ Admin bilan bog'laning: {admin}
         'language_select': "Iltimos, tilni tanlang:",
         'language_changed': "✅ Til O'zbekchaga o'zgartirildi",
         
-        'balance': '💰 *Sizning Balansingiz*\n\nBalans: `${balance:.2f}` USD',
+        'balance': '💰 *Sizning Balansingiz*\n\nBalans: `${balance}` USD',
         'no_balance': '⚠️ Mablag yetarli emas. /deposit orqali balansni to\'ldiring',
         
         'deposit_request': """
@@ -298,7 +300,7 @@ Kodlarni ko'rish uchun /services va /countries dan foydalaning.
 *Buyurtma ID:* `{order_id}`
 *Xizmat:* `{service}`
 *Davlat:* `{country}`
-*Narx:* ${cost:.2f} USD
+*Narx:* ${cost} USD
 
 ⏳ *SMS kutilmoqda...*
 
@@ -336,11 +338,12 @@ Bekor qilish uchun: `/cancel {order_id}`
         
         'history_empty': '📭 Tranzaksiyalar tarixi bo\'sh.',
         'history_title': '📜 *Tranzaksiyalar Tarixi*\n\n',
-        'history_item': '• {date}: {type} ${amount:.2f} USD\n  {description}\n\n',
+        'history_item': '• {date}: {type} ${amount} USD\n  {description}\n\n',
         
         'admin_only': '⚠️ Bu buyruq faqat administratorlar uchun.',
         'stats_title': '📊 *Bot Statistikasi*\n\n',
         'error_occurred': '❌ Xatolik yuz berdi. Keyinroq urinib ko\'ring.',
+        'service_unavailable': '❌ Xizmat vaqtincha mavjud emas\n\nKeyinroq urinib ko\'ring yoki admin bilan bog\'laning.',
     }
 }
 
@@ -0,0 +1,187 @@
+"""
+Columnar projection of the transaction and activation history
+Parallel typed arrays (one per field) for admin analytics; NumPy is used when installed
+"""
+
+import heapq
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+import logging
+
+from records import Activation, MICROS_PER_DAY, Transaction, epoch_day, to_epoch
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the same queries run as plain loops over the arrays
+    np = None
+
+logger = logging.getLogger(__name__)
+
+TYPE_CODES = {'add': 0, 'deduct': 1}
+TYPE_OTHER = 2
+
+
+class ColumnarLedger:
+    """Column arrays aligned row for row with data['transactions'] and data['activations'] (records)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop all rows"""
+        with self._lock:
+            self.tx_user = array('q')
+            self.tx_amount = array('q')
+            self.tx_type = array('b')
+            self.tx_time = array('q')
+            self.act_user = array('q')
+            self.act_cost = array('q')
+            self.act_service = array('l')
+            self.act_time = array('q')
+            self._services: List[str] = []
+            self._service_codes: Dict[str, int] = {}
+
+    def rebuild(self, transactions: Iterable[Transaction], activations: Iterable[Activation]):
+        """Project the full record lists again (after records were removed)"""
+        self.clear()
+        for transaction in transactions:
+            self.add_transaction(transaction)
+        for activation in activations:
+            self.add_activation(activation)
+
+    def select_activations(self, rows: Iterable[int]):
+        """Keep only these activation rows, in this order (after activations were removed)"""
+        rows = list(rows)
+        with self._lock:
+            for name in ('act_user', 'act_cost', 'act_service', 'act_time'):
+                column = getattr(self, name)
+                setattr(self, name, array(column.typecode, map(column.__getitem__, rows)))
+
+    def add_transaction(self, transaction: Transaction):
+        """Append one transaction row"""
+        with self._lock:
+            self.tx_user.append(transaction.user_id)
+            self.tx_amount.append(transaction.amount_cents)
+            self.tx_type.append(TYPE_CODES.get(transaction.type, TYPE_OTHER))
+            self.tx_time.append(transaction.timestamp)
+
+    def add_activation(self, activation: Activation):
+        """Append one activation row"""
+        service = activation.service or ''
+        with self._lock:
+            code = self._service_codes.get(service)
+            if code is None:
+                code = self._service_codes[service] = len(self._services)
+                self._services.append(service)
+            self.act_user.append(activation.user_id)
+            self.act_cost.append(activation.cost_cents or 0)
+            self.act_service.append(code)
+            self.act_time.append(activation.created_at)
+
+    # ========== QUERIES ==========
+
+    def newest_transactions(self, limit: int) -> List[int]:
+        """Row numbers of the newest transactions, newest first"""
+        with self._lock:
+            return _newest_rows(self.tx_time, limit)
+
+    def newest_activations(self, limit: int) -> List[int]:
+        """Row numbers of the newest activations, newest first"""
+        with self._lock:
+            return _newest_rows(self.act_time, limit)
+
+    def revenue_by_day(self, since: datetime) -> Dict[str, int]:
+        """Cents spent by users (deduct transactions) per day since a moment"""
+        start = to_epoch(since)
+        with self._lock:
+            if np is not None:
+                days, totals = _deduct_sums(self.tx_type, self.tx_time, self.tx_amount, start)
+            else:
+                grouped: Dict[int, int] = {}
+                for kind, time, amount in zip(self.tx_type, self.tx_time, self.tx_amount):
+                    if kind == TYPE_CODES['deduct'] and time >= start:
+                        day = time // MICROS_PER_DAY
+                        grouped[day] = grouped.get(day, 0) + amount
+                days, totals = list(grouped), list(grouped.values())
+        return {epoch_day(int(day)): int(total) for day, total in sorted(zip(days, totals))}
+
+    def top_spenders(self, since: datetime, limit: int = 10) -> List[Tuple[int, int]]:
+        """(user_id, cents spent) since a moment, biggest first"""
+        start = to_epoch(since)
+        with self._lock:
+            if np is not None:
+                users, totals = _deduct_sums(self.tx_type, self.tx_time, self.tx_amount, start, self.tx_user)
+            else:
+                grouped: Dict[int, int] = {}
+                for kind, time, user, amount in zip(self.tx_type, self.tx_time, self.tx_user, self.tx_amount):
+                    if kind == TYPE_CODES['deduct'] and time >= start:
+                        grouped[user] = grouped.get(user, 0) + amount
+                users, totals = list(grouped), list(grouped.values())
+        spenders = [(int(user), int(total)) for user, total in zip(users, totals)]
+        return heapq.nlargest(limit, spenders, key=lambda x: x[1])
+
+    def service_volume(self, since: datetime) -> Dict[str, Tuple[int, int]]:
+        """service -> (activations, cents charged) since a moment"""
+        start = to_epoch(since)
+        with self._lock:
+            services = list(self._services)
+            if np is not None:
+                mask = _view(self.act_time) >= start
+                codes = _view(self.act_service)[mask]
+                counts = np.bincount(codes, minlength=len(services))
+                _, totals = _group_sums(codes, _view(self.act_cost)[mask], size=len(services))
+            else:
+                counts = [0] * len(services)
+                totals = [0] * len(services)
+                for code, time, cost in zip(self.act_service, self.act_time, self.act_cost):
+                    if time >= start:
+                        counts[code] += 1
+                        totals[code] += cost
+        return {service: (int(counts[code]), int(totals[code]))
+                for code, service in enumerate(services) if counts[code]}
+
+
+def _newest_rows(times: array, limit: int) -> List[int]:
+    """Row numbers with the largest times, newest first (later rows win ties)"""
+    if limit <= 0:
+        return []
+    if np is not None and len(times) > limit:
+        column = _view(times)
+        rows = np.argpartition(column, -limit)[-limit:]
+        # lexsort: last key is primary -> by time, then by row
+        return [int(row) for row in rows[np.lexsort((rows, column[rows]))][::-1]]
+    return heapq.nlargest(limit, range(len(times)), key=lambda row: (times[row], row))
+
+
+def _view(column: array):
+    """NumPy array over a column's buffer (no copy)"""
+    # array.append raises BufferError while a view exists: views must not outlive the ledger lock
+    if not len(column):
+        return np.zeros(0, dtype=column.typecode)
+    return np.frombuffer(column, dtype=column.typecode)
+
+
+def _deduct_sums(types: array, times: array, amounts: array, start: int, keys: array = None):
+    """Deduct amounts at or after `start` summed per key, or per epoch day without keys (NumPy)"""
+    time_view = _view(times)
+    mask = (_view(types) == TYPE_CODES['deduct']) & (time_view >= start)
+    groups = time_view[mask] // MICROS_PER_DAY if keys is None else _view(keys)[mask]
+    return _group_sums(groups, _view(amounts)[mask])
+
+
+def _group_sums(keys, values, size: int = None):
+    """Exact int64 sums of values per distinct key (NumPy arrays). Returns (keys, sums)."""
+    if size is not None:
+        # Dense keys 0..size-1
+        sums = np.zeros(size, dtype=np.int64)
+        np.add.at(sums, keys, values)
+        return np.arange(size), sums
+    if not len(keys):
+        return keys, values
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(values, starts)
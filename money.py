@@ -0,0 +1,64 @@
+"""
+Fixed-point money helpers
+All balances, prices and ledger amounts are integer cents (1 USD = 100)
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict
+
+CENTS_PER_UNIT = 100
+
+
+def to_cents(value) -> int:
+    """Convert a decimal amount (str, int, float or Decimal) to integer cents, rounding half up"""
+    try:
+        # str() first so floats convert by their shortest repr (0.1 -> "0.1")
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    return int((amount * CENTS_PER_UNIT).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def apply_multipliers(value, *multipliers) -> int:
+    """Multiply a provider price by markup/currency factors and round once to cents"""
+    try:
+        amount = Decimal(str(value).strip())
+        for multiplier in multipliers:
+            amount *= Decimal(str(multiplier))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    return to_cents(amount)
+
+
+def format_money(cents: int) -> str:
+    """Format cents for display, e.g. 1725 -> '17.25'"""
+    sign = '-' if cents < 0 else ''
+    units, rest = divmod(abs(int(cents)), CENTS_PER_UNIT)
+    return f"{sign}{units}.{rest:02d}"
+
+
+def legacy_to_cents(value) -> int:
+    """Convert a legacy float amount to cents, dropping binary float noise first"""
+    if value is None:
+        return 0
+    # 1.7249999999999996 was meant to be 1.725
+    return to_cents(round(float(value), 6))
+
+
+# Legacy float money fields and their integer-cents replacements
+LEGACY_FIELDS = {
+    'balance': 'balance_cents',
+    'total_spent': 'total_spent_cents',
+    'amount': 'amount_cents',
+    'cost': 'cost_cents'
+}
+
+
+def migrate_legacy_fields(record: Dict) -> Dict:
+    """Replace legacy float money fields of a record (or an update dict) with cents, in place"""
+    for legacy, field in LEGACY_FIELDS.items():
+        if legacy in record:
+            record[field] = legacy_to_cents(record.pop(legacy))
+    return record
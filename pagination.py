@@ -0,0 +1,78 @@
+"""
+Cursor pagination over time-ordered history
+A cursor names one record: its time in epoch microseconds and its rank among records with the same time
+"""
+
+import bisect
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from records import Record, from_epoch
+
+# A run: (month 'YYYY-MM' it covers or None, loader returning (records oldest first, time of a record))
+Run = Tuple[Optional[str], Callable[[], Tuple[Sequence, Callable]]]
+
+
+def encode_cursor(moment: int, rank: int = 0) -> str:
+    """Cursor text, short enough for Telegram callback data"""
+    return f"{moment}.{rank}" if rank else str(moment)
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """(moment, rank) of a cursor; ValueError if it is not one"""
+    moment, _, rank = cursor.partition('.')
+    return int(moment), int(rank or 0)
+
+
+def paginate(runs: List[Run], limit: int, before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+    """
+    One page of records, newest first, from runs ordered oldest first.
+    before: records older than that cursor; after: records newer than it; neither: the newest page.
+    Runs are loaded only when the walk reaches them.
+    Returns {'items': [...], 'older': cursor or None, 'newer': cursor or None}.
+    """
+    forward = after is not None and before is None
+    cursor = decode_cursor(after if forward else before) if (after or before) is not None else None
+    cursor_month = from_epoch(cursor[0])[:7] if cursor else None
+
+    found = []  # (records, index, time_of) in walk order
+    for month, load in (runs if forward else reversed(runs)):
+        if cursor and month and (month < cursor_month if forward else month > cursor_month):
+            continue  # Entirely on the other side of the cursor
+        records, time_of = load()
+        if cursor:
+            left = bisect.bisect_left(records, cursor[0], key=time_of)
+            same = bisect.bisect_right(records, cursor[0], key=time_of) - left
+        need = limit + 1 - len(found)
+        if forward:
+            start = left + min(cursor[1] + 1, same) if cursor else 0
+            found.extend((records, index, time_of) for index in range(start, min(start + need, len(records))))
+        else:
+            end = left + min(cursor[1], same) if cursor else len(records)
+            found.extend((records, index, time_of) for index in range(end - 1, max(end - need, 0) - 1, -1))
+        if len(found) > limit:
+            break
+
+    more = len(found) > limit
+    page = found[:limit]
+    if forward:
+        page.reverse()  # Newest first, like every other page
+    # Walking back from a cursor (or forward to one) means the other side has records too
+    older = _cursor(page[-1]) if page and (more or forward) else None
+    newer = _cursor(page[0]) if page and (more if forward else cursor is not None) else None
+    return {
+        'items': [_item(records[index]) for records, index, _ in page],
+        'older': older,
+        'newer': newer
+    }
+
+
+def _cursor(entry: Tuple[Sequence, int, Callable]) -> str:
+    """Cursor naming one found record"""
+    records, index, time_of = entry
+    moment = time_of(records[index])
+    return encode_cursor(moment, index - bisect.bisect_left(records, moment, key=time_of))
+
+
+def _item(record) -> Dict:
+    """A page item in its dict form"""
+    return record.to_dict() if isinstance(record, Record) else record
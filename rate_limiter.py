@@ -0,0 +1,121 @@
+"""
+Process-wide token-bucket rate limiter with priority lanes
+Every SMS-Activate call takes a token; when tokens run out, waiting callers are served by lane, then in arrival order
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(IntEnum):
+    """Priority lanes, most urgent first"""
+    PURCHASE = 0    # buying and cancelling numbers
+    STATUS = 1      # a user checking an order
+    CATALOG = 2     # countries, services and prices
+    BACKGROUND = 3  # cleanup and auto-refund threads
+
+
+class RateLimitTimeout(Exception):
+    """No token was free within the caller's timeout"""
+
+
+class RateLimiter:
+    """Token bucket refilled at `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock  # seconds; tests pass a fake one
+        self._tokens = float(burst)
+        self._refilled = clock()
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (lane, arrival) tickets
+        self._arrivals = itertools.count()
+        # Per lane: [calls, calls that waited, total wait, longest wait]
+        self._metrics = {lane: [0, 0, 0.0, 0.0] for lane in Lane}
+
+    def _refill(self):
+        """Add the tokens earned since the last refill"""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self, lane: Lane = Lane.BACKGROUND, timeout: Optional[float] = None) -> float:
+        """Take one token, waiting behind more urgent and earlier callers. Returns the seconds waited."""
+        started = self._clock()
+        with self._cond:
+            ticket = (lane, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            queued = False
+            try:
+                while True:
+                    self._refill()
+                    if self._waiting[0] == ticket and self._tokens >= 1:
+                        self._tokens -= 1
+                        heapq.heappop(self._waiting)
+                        break
+                    remaining = None if timeout is None else started + timeout - self._clock()
+                    if remaining is not None and remaining <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        raise RateLimitTimeout(f"No API token for the {lane.name.lower()} lane "
+                                               f"within {timeout}s")
+                    # The head sleeps until its token is earned; the rest until the head moves on
+                    wait = (1 - self._tokens) / self.rate if self._waiting[0] == ticket else remaining
+                    if wait is not None and remaining is not None:
+                        wait = min(wait, remaining)
+                    queued = True
+                    self._cond.wait(wait)
+            finally:
+                self._cond.notify_all()
+
+            waited = self._clock() - started
+            self._record(lane, waited, queued)
+        return waited
+
+    def try_acquire(self, lane: Lane = Lane.BACKGROUND, waited: float = 0.0) -> float:
+        """
+        Take one token without blocking, for callers that cannot sleep in a thread (asyncio).
+        Returns 0 if the token was taken, otherwise the seconds to wait before trying again;
+        callers queued in acquire() on this or a more urgent lane go first.
+        `waited` is how long the caller has been trying, for the queue-wait metrics.
+        """
+        with self._cond:
+            self._refill()
+            ahead = sum(1 for waiting_lane, _ in self._waiting if waiting_lane <= lane)
+            if not ahead and self._tokens >= 1:
+                self._tokens -= 1
+                self._record(lane, waited, waited > 0)
+                return 0.0
+            return (ahead + 1 - self._tokens) / self.rate
+
+    def _record(self, lane: Lane, waited: float, queued: bool):
+        """Add one granted token to the lane's metrics (called under the lock)"""
+        metrics = self._metrics[lane]
+        metrics[0] += 1
+        if queued:
+            metrics[1] += 1
+        metrics[2] += waited
+        metrics[3] = max(metrics[3], waited)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Queue-wait metrics per lane since start"""
+        with self._cond:
+            queued = [lane for lane, _ in self._waiting]
+            return {
+                lane.name.lower(): {
+                    'calls': calls,
+                    'waited': waited,
+                    'queued': queued.count(lane),
+                    'avg_wait': total / calls if calls else 0.0,
+                    'max_wait': longest
+                }
+                for lane, (calls, waited, total, longest) in self._metrics.items()
+            }
@@ -0,0 +1,154 @@
+"""
+Compact in-memory records for users, transactions and activations
+Slotted dataclasses with interned codes and epoch timestamps; plain dicts only at the JSON boundary
+"""
+
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+EPOCH = datetime(1970, 1, 1)
+MICROS_PER_DAY = 86400 * 10 ** 6
+
+
+def to_epoch(moment) -> int:
+    """ISO timestamp (or datetime) to microseconds since 1970-01-01 in the same (local) wall clock"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def from_epoch(micros: int) -> str:
+    """Epoch microseconds back to the ISO timestamp written to users.json"""
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def epoch_day(day: int) -> str:
+    """Day number (epoch microseconds // MICROS_PER_DAY) to an ISO date"""
+    return (EPOCH + timedelta(days=day)).date().isoformat()
+
+
+class Record:
+    """JSON conversion shared by the slotted records"""
+
+    __slots__ = ()
+
+    FIELDS = ()  # JSON keys kept as attributes, in the order they are written
+    TIME_FIELDS = ()  # ISO timestamps, held as epoch microseconds
+    CODE_FIELDS = ()  # Short repeated strings, interned
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELD_SET = frozenset(cls.FIELDS)
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        """Build a record from its JSON form"""
+        if not data.keys() <= cls.FIELD_SET:
+            record = cls(data['user_id'])
+            record.update(data)
+            return record
+        # Common case (every record at startup): only known fields, convert the few that need it
+        record = cls(**data)
+        for key in cls.TIME_FIELDS:
+            value = getattr(record, key)
+            if isinstance(value, str):
+                setattr(record, key, to_epoch(value))
+        for key in cls.CODE_FIELDS:
+            value = getattr(record, key)
+            if isinstance(value, str):
+                setattr(record, key, sys.intern(value))
+        return record
+
+    def update(self, fields: Dict):
+        """Set fields by their JSON names; unknown ones are kept in `extra`"""
+        for key, value in fields.items():
+            if key not in self.FIELD_SET:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+                continue
+            if isinstance(value, str):
+                if key in self.TIME_FIELDS:
+                    value = to_epoch(value)
+                elif key in self.CODE_FIELDS:
+                    value = sys.intern(value)
+            setattr(self, key, value)
+
+    def to_dict(self) -> Dict:
+        """The record in its JSON form"""
+        data = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if key in self.TIME_FIELDS and value is not None:
+                value = from_epoch(value)
+            data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+@dataclass(slots=True, eq=False)
+class User(Record):
+    """One bot user"""
+    user_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    balance_cents: int = 0
+    language: str = 'en'
+    created_at: Optional[int] = None
+    total_spent_cents: int = 0
+    total_activations: int = 0
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS = ('user_id', 'username', 'first_name', 'balance_cents', 'language', 'created_at',
+              'total_spent_cents', 'total_activations')
+    TIME_FIELDS = ('created_at',)
+    CODE_FIELDS = ('language',)
+
+
+@dataclass(slots=True, eq=False)
+class Transaction(Record):
+    """One balance change"""
+    user_id: int
+    amount_cents: int = 0
+    type: str = 'add'
+    description: str = ''
+    timestamp: int = 0
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS = ('user_id', 'amount_cents', 'type', 'description', 'timestamp')
+    TIME_FIELDS = ('timestamp',)
+    CODE_FIELDS = ('type',)
+
+
+# Activation statuses that can still change; anything else is final
+ACTIVE_STATUSES = ('active', 'waiting', 'pending', None)
+
+
+@dataclass(slots=True, eq=False)
+class Activation(Record):
+    """One rented number"""
+    user_id: int
+    activation_id: Optional[str] = None
+    phone_number: Optional[str] = None
+    service: Optional[str] = None
+    country: Any = None
+    cost_cents: int = 0
+    status: str = 'active'
+    created_at: int = 0
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS = ('user_id', 'activation_id', 'phone_number', 'service', 'country', 'cost_cents',
+              'status', 'created_at')
+    TIME_FIELDS = ('created_at',)
+    CODE_FIELDS = ('service', 'country', 'status')
+
+
+def to_json(value: Any) -> Dict:
+    """json.dumps(default=...) hook: records are written in their dict form"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,56 @@
+"""
+Retry policy for SMS-Activate calls
+Idempotent calls retry any transient failure; the rest retry only when the request never reached the provider
+"""
+
+import random
+import threading
+from collections import Counter
+from typing import Dict
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Seconds to sleep before retry number `attempt` (0-based): exponential with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_connect_failure(error: Exception) -> bool:
+    """True if the request failed before it was sent (nothing can have happened on the provider)"""
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+def is_transient(error: Exception) -> bool:
+    """True for failures worth retrying an idempotent call on: network errors, timeouts, 429 and 5xx"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class RetryCounters:
+    """Per-action counts of retries, calls that recovered and calls that gave up"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Counter] = {}
+
+    def record(self, action: str, outcome: str, count: int = 1):
+        """Count an outcome ('retries', 'recovered' or 'gave_up') for an action"""
+        with self._lock:
+            self._counts.setdefault(action, Counter())[outcome] += count
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Counts per action since start"""
+        with self._lock:
+            return {
+                action: {outcome: counts[outcome] for outcome in ('retries', 'recovered', 'gave_up')}
+                for action, counts in sorted(self._counts.items())
+            }
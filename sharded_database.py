@@ -0,0 +1,272 @@
+"""
+Sharded JSON storage engine
+Users are spread over N JSON databases by user_id; each shard has its own file, lock, journal and archive
+"""
+
+import glob
+import heapq
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from itertools import chain
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional, Dict, List
+import logging
+
+from file_lock import FILE_LOCK_TIMEOUT
+from archive import TIME_KEYS
+from json_database import JSONDatabase, SCHEMA_VERSION
+from pagination import encode_cursor
+from records import to_epoch, to_json
+
+logger = logging.getLogger(__name__)
+
+SHARD_NAME = re.compile(r'\.shard\d+-of-(\d+)\.json$')
+
+
+def shard_file(db_file: str, shard: int, shards: int) -> str:
+    """users.json -> users.shard02-of-04.json"""
+    base, ext = os.path.splitext(db_file)
+    return f"{base}.shard{shard:02d}-of-{shards:02d}{ext or '.json'}"
+
+
+class ShardedDatabase:
+    """
+    JSON database split into `shards` files by user_id % shards.
+    A process opens (and locks) only the shards it owns, so several
+    scripts can run side by side on disjoint shards; the bot itself gets
+    every user's updates and must own them all. Admin queries cover the owned shards.
+    """
+
+    def __init__(self, db_file: str = 'users.json', shards: int = 4,
+                 owned: Optional[Iterable[int]] = None, **options):
+        if shards < 2:
+            raise ValueError(f"A sharded database needs at least 2 shards, got {shards}")
+        self.db_file = db_file
+        self.shards = shards
+        self.owned = sorted(set(owned)) if owned is not None else list(range(shards))
+        if not self.owned or any(not 0 <= shard < shards for shard in self.owned):
+            raise ValueError(f"Owned shards must be between 0 and {shards - 1}, got {self.owned}")
+
+        self._split(**options)
+        self._shards: Dict[int, JSONDatabase] = {}
+        try:
+            for shard in self.owned:
+                self._shards[shard] = JSONDatabase(shard_file(db_file, shard, shards), **options)
+        except Exception:
+            self.close()  # Let go of the shards already opened
+            raise
+        logger.info(f"Opened shards {self.owned} of {shards} for {db_file}")
+
+    def _split(self, **options):
+        """First start with shards: copy an existing single-file database into the shard files"""
+        files = [shard_file(self.db_file, shard, self.shards) for shard in range(self.shards)]
+        if any(os.path.exists(path) for path in files):
+            return
+        base, ext = os.path.splitext(self.db_file)
+        for path in glob.glob(glob.escape(base) + '.shard*-of-*' + (ext or '.json')):
+            match = SHARD_NAME.search(path)
+            if match and int(match.group(1)) != self.shards:
+                raise ValueError(f"{path} belongs to a {int(match.group(1))}-shard layout; "
+                                 f"re-shard it before opening {self.shards} shards")
+        if not os.path.exists(self.db_file):
+            return
+
+        # Opening the source takes its lock and folds a pending journal into it;
+        # a second worker waits here and then finds the shard files in place
+        source = JSONDatabase(self.db_file, journal=os.path.exists(self.db_file + '.journal'),
+                              lock_timeout=options.get('lock_timeout', FILE_LOCK_TIMEOUT))
+        try:
+            if any(os.path.exists(path) for path in files):
+                return
+            parts = [{'schema_version': SCHEMA_VERSION, 'users': {}, 'transactions': [], 'activations': []}
+                     for _ in range(self.shards)]
+            for key, user in source.data['users'].items():
+                parts[user.user_id % self.shards]['users'][key] = user
+            for kind in ('transactions', 'activations'):
+                for record in source.data[kind]:
+                    parts[record.user_id % self.shards][kind].append(record)
+
+            for path, part in zip(files, parts):
+                tmp_file = path + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(part, f, indent=2, ensure_ascii=False, default=to_json)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, path)
+        finally:
+            source.close()
+        logger.info(f"Split {self.db_file} into {self.shards} shards "
+                    f"({len(source.data['users']):,} users); {self.db_file} is no longer updated")
+
+    def _shard(self, user_id: int) -> JSONDatabase:
+        """The database holding a user"""
+        shard = user_id % self.shards
+        database = self._shards.get(shard)
+        if database is None:
+            raise ValueError(f"User {user_id} is in shard {shard}, which this process does not own")
+        return database
+
+    def _shard_for_activation(self, activation_id: str) -> Optional[JSONDatabase]:
+        """The owned shard holding an activation"""
+        for database in self._shards.values():
+            if database.get_activation(activation_id):
+                return database
+        return None
+
+    def close(self):
+        """Flush every shard to disk and release their locks"""
+        for database in getattr(self, '_shards', {}).values():
+            database.close()
+        self._shards = {}
+
+    # ========== USERS ==========
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        return self._shard(user_id).get_user(user_id)
+
+    def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Create a new user"""
+        return self._shard(user_id).create_user(user_id, username, first_name)
+
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        self._shard(user_id).update_user(user_id, **kwargs)
+
+    def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Get existing user or create new one"""
+        return self._shard(user_id).get_or_create_user(user_id, username, first_name)
+
+    def set_language(self, user_id: int, language: str):
+        """Set user language"""
+        self._shard(user_id).set_language(user_id, language)
+
+    def get_language(self, user_id: int) -> str:
+        """Get user language"""
+        return self._shard(user_id).get_language(user_id)
+
+    # ========== BALANCE ==========
+
+    def get_balance(self, user_id: int) -> int:
+        """Get user balance in cents"""
+        return self._shard(user_id).get_balance(user_id)
+
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str, description: str = "") -> Optional[int]:
+        """Atomically change a balance and record the transaction. Returns the new balance or None."""
+        return self._shard(user_id).apply_balance_change(user_id, amount_cents, type, description)
+
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""):
+        """Add balance (in cents) to user"""
+        self._shard(user_id).add_balance(user_id, amount_cents, description)
+
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool:
+        """Deduct balance (in cents) from user. Returns True if successful."""
+        return self._shard(user_id).deduct_balance(user_id, amount_cents, description)
+
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""):
+        """Add transaction record"""
+        self._shard(user_id).add_transaction(user_id, amount_cents, type, description)
+
+    def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user transactions"""
+        return self._shard(user_id).get_user_transactions(user_id, limit)
+
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """One page of a user's (or everyone's) transactions, newest first, from a cursor"""
+        if user_id is not None:
+            return self._shard(user_id).get_transactions_page(user_id, limit, before, after)
+        # Every shard pages from the same cursor, the page is the `limit` records next to it.
+        # Cursors name a time only here: records of different shards in the same microsecond can be skipped
+        forward = after is not None and before is None
+        pages = [database.get_transactions_page(None, limit, before, after) for database in self._shards.values()]
+        items = list(heapq.merge(*(page['items'] for page in pages), key=itemgetter('timestamp'), reverse=True))
+        more = len(items) > limit or any(page['newer' if forward else 'older'] for page in pages)
+        items = items[-limit:] if forward else items[:limit]
+        cursor = before if not forward else after
+        return {
+            'items': items,
+            'older': encode_cursor(to_epoch(items[-1]['timestamp'])) if items and (more or forward) else None,
+            'newer': encode_cursor(to_epoch(items[0]['timestamp'])) if items and (
+                more if forward else cursor is not None) else None
+        }
+
+    # ========== ACTIVATIONS ==========
+
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int):
+        """Add activation record (cost_cents is what the user paid)"""
+        self._shard(user_id).add_activation(user_id, activation_data, cost_cents)
+
+    def update_activation(self, activation_id: str, **kwargs):
+        """Update activation record"""
+        database = self._shard_for_activation(activation_id)
+        if database:
+            database.update_activation(activation_id, **kwargs)
+
+    def get_activation(self, activation_id: str) -> Optional[Dict]:
+        """Get activation by ID"""
+        for database in self._shards.values():
+            activation = database.get_activation(activation_id)
+            if activation:
+                return activation
+        return None
+
+    def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user activations"""
+        return self._shard(user_id).get_user_activations(user_id, limit)
+
+    # ========== ADMIN ==========
+
+    def get_all_users(self) -> List[Dict]:
+        """Get all users"""
+        return list(chain.from_iterable(database.get_all_users() for database in self._shards.values()))
+
+    def get_all_transactions(self, limit: int = 100) -> List[Dict]:
+        """Get all transactions"""
+        newest = (database.get_all_transactions(limit) for database in self._shards.values())
+        return list(heapq.merge(*newest, key=lambda t: t['timestamp'], reverse=True))[:limit]
+
+    def get_all_activations(self, limit: int = 100) -> List[Dict]:
+        """Get all activations"""
+        newest = (database.get_all_activations(limit) for database in self._shards.values())
+        return list(heapq.merge(*newest, key=lambda a: a['created_at'], reverse=True))[:limit]
+
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Transactions or activations with start <= time < end, oldest first, merged across shards"""
+        if kind not in TIME_KEYS:
+            raise ValueError(f"Unknown export kind: {kind}")
+        streams = [database.export_iter(kind, start, end) for database in self._shards.values()]
+        return heapq.merge(*streams, key=itemgetter(TIME_KEYS[kind]))
+
+    def get_statistics(self) -> Dict:
+        """Get overall statistics"""
+        totals = Counter()
+        for database in self._shards.values():
+            totals.update(database.get_statistics())
+        return dict(totals)
+
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Optional[Dict]:
+        """Revenue per day, top spenders and per-service volume over the last `days` days"""
+        revenue = Counter()
+        spenders = []
+        volume: Dict[str, List[int]] = {}
+        for database in self._shards.values():
+            analytics = database.get_analytics(days, limit)
+            if analytics is None:
+                return None
+            revenue.update(analytics['revenue_by_day'])
+            # A user lives in one shard, so the overall top is among the per-shard tops
+            spenders.extend(analytics['top_spenders'])
+            for service, (count, cents) in analytics['service_volume'].items():
+                totals = volume.setdefault(service, [0, 0])
+                totals[0] += count
+                totals[1] += cents
+        return {
+            'revenue_by_day': dict(sorted(revenue.items())),
+            'top_spenders': heapq.nlargest(limit, spenders, key=lambda x: x[1]),
+            'service_volume': {service: tuple(totals) for service, totals in volume.items()}
+        }
@@ -0,0 +1,55 @@
+"""
+Single-flight request coalescing
+Concurrent callers asking for the same key share one call and its result (or its exception)
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Flight:
+    """One call in progress and what it produced"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers arriving meanwhile wait for it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.shared = 0  # calls answered by another caller's request
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call fn(), unless a call for `key` is already running: then wait and return its result"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # The next caller after this point starts a fresh request
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,535 @@
+"""
+SQLite storage engine for user management and transactions
+Drop-in replacement for the JSON Database with the same method signatures
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Iterator, List
+import logging
+
+from money import format_money, migrate_legacy_fields
+from pagination import decode_cursor, encode_cursor
+from records import from_epoch, to_epoch
+
+logger = logging.getLogger(__name__)
+
+
+# Money columns are INTEGER cents (balance_cents, amount_cents, ...)
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    balance_cents INTEGER NOT NULL DEFAULT 0,
+    language TEXT NOT NULL DEFAULT 'en',
+    created_at TEXT NOT NULL,
+    total_spent_cents INTEGER NOT NULL DEFAULT 0,
+    total_activations INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions (timestamp);
+
+CREATE TABLE IF NOT EXISTS activations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    activation_id TEXT,
+    phone_number TEXT,
+    service TEXT,
+    country INTEGER,  -- provider country code, an int like in the JSON backend
+    cost_cents INTEGER,
+    status TEXT NOT NULL DEFAULT 'active',
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activations_id ON activations (activation_id);
+CREATE INDEX IF NOT EXISTS idx_activations_user_time ON activations (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_activations_time ON activations (created_at);
+
+-- Running aggregates for get_statistics, maintained by triggers on every write
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_balance_cents INTEGER NOT NULL DEFAULT 0,
+    total_spent_cents INTEGER NOT NULL DEFAULT 0,
+    total_users INTEGER NOT NULL DEFAULT 0,
+    total_activations INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day TEXT PRIMARY KEY,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    activations INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS stats_user_insert AFTER INSERT ON users BEGIN
+    UPDATE stats SET total_balance_cents = total_balance_cents + NEW.balance_cents,
+                     total_spent_cents = total_spent_cents + NEW.total_spent_cents,
+                     total_users = total_users + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_user_update AFTER UPDATE OF balance_cents, total_spent_cents ON users BEGIN
+    UPDATE stats SET total_balance_cents = total_balance_cents + NEW.balance_cents - OLD.balance_cents,
+                     total_spent_cents = total_spent_cents + NEW.total_spent_cents - OLD.total_spent_cents
+                     WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_user_delete AFTER DELETE ON users BEGIN
+    UPDATE stats SET total_balance_cents = total_balance_cents - OLD.balance_cents,
+                     total_spent_cents = total_spent_cents - OLD.total_spent_cents,
+                     total_users = total_users - 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_transaction_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO daily_stats (day, transactions) VALUES (substr(NEW.timestamp, 1, 10), 1)
+        ON CONFLICT (day) DO UPDATE SET transactions = transactions + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_activation_insert AFTER INSERT ON activations BEGIN
+    UPDATE stats SET total_activations = total_activations + 1 WHERE id = 1;
+    INSERT INTO daily_stats (day, activations) VALUES (substr(NEW.created_at, 1, 10), 1)
+        ON CONFLICT (day) DO UPDATE SET activations = activations + 1;
+END;
+"""
+
+USER_COLUMNS = ('username', 'first_name', 'balance_cents', 'language', 'created_at',
+                'total_spent_cents', 'total_activations')
+ACTIVATION_COLUMNS = ('phone_number', 'service', 'country', 'cost_cents', 'status')
+
+class SQLiteDatabase:
+    """SQLite-based database for user data (WAL mode, one row write per mutation)"""
+
+    def __init__(self, db_file: str = 'users.db', import_from: Optional[str] = 'users.json'):
+        self.db_file = db_file
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        # A new database gets its stats row from a (cheap) full scan
+        if self._connect().execute('SELECT 1 FROM stats WHERE id = 1').fetchone() is None:
+            self.rebuild_statistics()
+
+        # First start on an empty database: carry over the old JSON data
+        if import_from and os.path.exists(import_from) and self._is_empty():
+            self.import_json(import_from)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get the connection for the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.execute('PRAGMA recursive_triggers=ON')
+            self._local.conn = conn
+        return conn
+
+    def _insert_rows(self, conn: sqlite3.Connection, users, transactions: List[Dict],
+                     activations: List[Dict]):
+        """Bulk insert records, converting legacy float money fields to cents"""
+        users = [migrate_legacy_fields(dict(u)) for u in users]
+        transactions = [migrate_legacy_fields(dict(t)) for t in transactions]
+        activations = [migrate_legacy_fields(dict(a)) for a in activations]
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (user_id, username, first_name, balance_cents, language, '
+            'created_at, total_spent_cents, total_activations) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(u['user_id'], u.get('username'), u.get('first_name'), u.get('balance_cents', 0),
+              u.get('language', 'en'), u.get('created_at') or datetime.now().isoformat(),
+              u.get('total_spent_cents', 0), u.get('total_activations', 0)) for u in users]
+        )
+        conn.executemany(
+            'INSERT INTO transactions (user_id, amount_cents, type, description, timestamp) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(t['user_id'], t.get('amount_cents', 0), t.get('type', ''), t.get('description', ''),
+              t['timestamp']) for t in transactions]
+        )
+        conn.executemany(
+            'INSERT INTO activations (user_id, activation_id, phone_number, service, country, '
+            'cost_cents, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(a['user_id'], _str_or_none(a.get('activation_id')), a.get('phone_number'),
+              a.get('service'), a.get('country'), a.get('cost_cents'),
+              a.get('status', 'active'), a['created_at']) for a in activations]
+        )
+
+    def _is_empty(self) -> bool:
+        """Check if the database has no users yet"""
+        row = self._connect().execute('SELECT 1 FROM users LIMIT 1').fetchone()
+        return row is None
+
+    def import_json(self, json_file: str):
+        """Import users, transactions and activations from a users.json file"""
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading {json_file} for import: {e}")
+            return
+
+        users = data.get('users', {}).values()
+        transactions = data.get('transactions', [])
+        activations = data.get('activations', [])
+
+        # Works for both float-dollar (schema 1) and cents (schema 2) files
+        with self._connect() as conn:
+            self._insert_rows(conn, users, transactions, activations)
+
+        logger.info(f"Imported {len(data.get('users', {}))} users, {len(transactions)} transactions "
+                    f"and {len(activations)} activations from {json_file}")
+
+    def close(self):
+        """Close the connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        row = self._connect().execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Create a new user"""
+        user_data = {
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'balance_cents': 0,
+            'language': 'en',
+            'created_at': datetime.now().isoformat(),
+            'total_spent_cents': 0,
+            'total_activations': 0
+        }
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO users (user_id, username, first_name, balance_cents, language, '
+                'created_at, total_spent_cents, total_activations) '
+                'VALUES (:user_id, :username, :first_name, :balance_cents, :language, :created_at, '
+                ':total_spent_cents, :total_activations)',
+                user_data
+            )
+        logger.info(f"Created new user: {user_id}")
+        return user_data
+
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        unknown = set(kwargs) - set(USER_COLUMNS)
+        if unknown:
+            logger.warning(f"Ignoring unknown user fields: {', '.join(sorted(unknown))}")
+        fields = {k: v for k, v in kwargs.items() if k in USER_COLUMNS}
+        if not fields:
+            return
+
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE users SET {assignments} WHERE user_id = ?",
+                         (*fields.values(), user_id))
+
+    def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None) -> Dict:
+        """Get existing user or create new one"""
+        user = self.get_user(user_id)
+        if not user:
+            user = self.create_user(user_id, username, first_name)
+        return user
+
+    def set_language(self, user_id: int, language: str):
+        """Set user language"""
+        self.update_user(user_id, language=language)
+
+    def get_language(self, user_id: int) -> str:
+        """Get user language"""
+        row = self._connect().execute('SELECT language FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['language'] if row else 'en'
+
+    def get_balance(self, user_id: int) -> int:
+        """Get user balance in cents"""
+        row = self._connect().execute('SELECT balance_cents FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['balance_cents'] if row else 0
+
+    def apply_balance_change(self, user_id: int, amount_cents: int, type: str, description: str = "") -> Optional[int]:
+        """
+        Atomically change a user's balance and record the transaction.
+        type 'add' credits amount_cents; 'deduct' debits it only if the balance covers it
+        and counts it as spent. Returns the new balance in cents, or None if refused.
+        """
+        with self._connect() as conn:
+            if type == 'deduct':
+                # The balance check is part of the UPDATE so concurrent purchases cannot overdraw
+                cursor = conn.execute(
+                    'UPDATE users SET balance_cents = balance_cents - ?, '
+                    'total_spent_cents = total_spent_cents + ? '
+                    'WHERE user_id = ? AND balance_cents >= ?',
+                    (amount_cents, amount_cents, user_id, amount_cents)
+                )
+            else:
+                cursor = conn.execute('UPDATE users SET balance_cents = balance_cents + ? WHERE user_id = ?',
+                                      (amount_cents, user_id))
+            if cursor.rowcount == 0:
+                return None
+            self._insert_transaction(conn, user_id, amount_cents, type, description)
+            return conn.execute('SELECT balance_cents FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def add_balance(self, user_id: int, amount_cents: int, description: str = ""):
+        """Add balance (in cents) to user"""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'add', description)
+        if new_balance is not None:
+            logger.info(f"Added {format_money(amount_cents)} to user {user_id}. "
+                        f"New balance: {format_money(new_balance)}")
+
+    def deduct_balance(self, user_id: int, amount_cents: int, description: str = "") -> bool:
+        """Deduct balance (in cents) from user. Returns True if successful."""
+        new_balance = self.apply_balance_change(user_id, amount_cents, 'deduct', description)
+        if new_balance is None:
+            return False
+        logger.info(f"Deducted {format_money(amount_cents)} from user {user_id}. "
+                    f"New balance: {format_money(new_balance)}")
+        return True
+
+    def _insert_transaction(self, conn: sqlite3.Connection, user_id: int, amount_cents: int,
+                            type: str, description: str):
+        """Insert a transaction row using an open connection"""
+        conn.execute(
+            'INSERT INTO transactions (user_id, amount_cents, type, description, timestamp) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (user_id, amount_cents, type, description, datetime.now().isoformat())
+        )
+
+    def add_transaction(self, user_id: int, amount_cents: int, type: str, description: str = ""):
+        """Add transaction record"""
+        with self._connect() as conn:
+            self._insert_transaction(conn, user_id, amount_cents, type, description)
+
+    def get_user_transactions(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user transactions"""
+        rows = self._connect().execute(
+            'SELECT user_id, amount_cents, type, description, timestamp FROM transactions '
+            'WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?',
+            (user_id, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_transactions_page(self, user_id: Optional[int] = None, limit: int = 20,
+                              before: Optional[str] = None, after: Optional[str] = None) -> Dict:
+        """One page of a user's (or everyone's) transactions, newest first, from a cursor"""
+        # Keyset pagination on (timestamp, id); a cursor is the row's time and id
+        forward = after is not None and before is None
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        cursor = before if not forward else after
+        if cursor is not None:
+            moment, row_id = decode_cursor(cursor)
+            timestamp = from_epoch(moment)
+            conditions.append(f"(timestamp {'>' if forward else '<'} ? OR "
+                              f"(timestamp = ? AND id {'>' if forward else '<'} ?))")
+            params += [timestamp, timestamp, row_id]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'ASC' if forward else 'DESC'
+        rows = self._connect().execute(
+            f"SELECT id, user_id, amount_cents, type, description, timestamp FROM transactions{where} "
+            f"ORDER BY timestamp {order}, id {order} LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+        
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if forward:
+            rows.reverse()
+        cursors = [encode_cursor(to_epoch(row['timestamp']), row['id']) for row in rows]
+        items = [{key: row[key] for key in row.keys() if key != 'id'} for row in rows]
+        return {
+            'items': items,
+            'older': cursors[-1] if rows and (more or forward) else None,
+            'newer': cursors[0] if rows and (more if forward else cursor is not None) else None
+        }
+
+    def add_activation(self, user_id: int, activation_data: Dict, cost_cents: int):
+        """Add activation record (cost_cents is what the user paid)"""
+        activation = {
+            'user_id': user_id,
+            'activation_id': _str_or_none(activation_data.get('activationId')),
+            'phone_number': activation_data.get('phoneNumber'),
+            'service': activation_data.get('service'),
+            'country': activation_data.get('countryCode'),
+            'cost_cents': cost_cents,
+            'status': 'active',
+            'created_at': datetime.now().isoformat()
+        }
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO activations (user_id, activation_id, phone_number, service, country, '
+                'cost_cents, status, created_at) VALUES (:user_id, :activation_id, :phone_number, '
+                ':service, :country, :cost_cents, :status, :created_at)',
+                activation
+            )
+            conn.execute('UPDATE users SET total_activations = total_activations + 1 WHERE user_id = ?',
+                         (user_id,))
+
+    def update_activation(self, activation_id: str, **kwargs):
+        """Update activation record"""
+        fields = {k: v for k, v in kwargs.items() if k in ACTIVATION_COLUMNS}
+        if not fields:
+            return
+
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE activations SET {assignments} WHERE id = "
+                f"(SELECT id FROM activations WHERE activation_id = ? ORDER BY id LIMIT 1)",
+                (*fields.values(), str(activation_id))
+            )
+
+    def get_activation(self, activation_id: str) -> Optional[Dict]:
+        """Get activation by ID"""
+        row = self._connect().execute(
+            'SELECT user_id, activation_id, phone_number, service, country, cost_cents, status, created_at '
+            'FROM activations WHERE activation_id = ? ORDER BY id LIMIT 1',
+            (str(activation_id),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_user_activations(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user activations"""
+        rows = self._connect().execute(
+            'SELECT user_id, activation_id, phone_number, service, country, cost_cents, status, created_at '
+            'FROM activations WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
+            (user_id, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_all_users(self) -> List[Dict]:
+        """Get all users"""
+        rows = self._connect().execute('SELECT * FROM users ORDER BY rowid').fetchall()
+        return [dict(row) for row in rows]
+
+    def get_all_transactions(self, limit: int = 100) -> List[Dict]:
+        """Get all transactions"""
+        rows = self._connect().execute(
+            'SELECT user_id, amount_cents, type, description, timestamp FROM transactions '
+            'ORDER BY timestamp DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_all_activations(self, limit: int = 100) -> List[Dict]:
+        """Get all activations"""
+        rows = self._connect().execute(
+            'SELECT user_id, activation_id, phone_number, service, country, cost_cents, status, created_at '
+            'FROM activations ORDER BY created_at DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def export_iter(self, kind: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Transactions or activations with start <= time < end, oldest first, one dict at a time"""
+        if kind == 'transactions':
+            columns, time_column = 'user_id, amount_cents, type, description, timestamp', 'timestamp'
+        elif kind == 'activations':
+            columns = 'user_id, activation_id, phone_number, service, country, cost_cents, status, created_at'
+            time_column = 'created_at'
+        else:
+            raise ValueError(f"Unknown export kind: {kind}")
+        conditions, params = [], []
+        if start:
+            conditions.append(f"{time_column} >= ?")
+            params.append(start.isoformat())
+        if end:
+            conditions.append(f"{time_column} < ?")
+            params.append(end.isoformat())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        # Range scan on the time index; the cursor steps through rows as they are consumed
+        cursor = self._connect().execute(
+            f"SELECT {columns} FROM {kind}{where} ORDER BY {time_column}, id", params
+        )
+        for row in cursor:
+            yield dict(row)
+
+    def get_statistics(self) -> Dict:
+        """Get overall statistics"""
+        conn = self._connect()
+        totals = conn.execute('SELECT * FROM stats WHERE id = 1').fetchone()
+        today = conn.execute(
+            'SELECT transactions, activations FROM daily_stats WHERE day = ?',
+            (datetime.now().date().isoformat(),)
+        ).fetchone()
+
+        return {
+            'total_users': totals['total_users'],
+            'total_balance_cents': totals['total_balance_cents'],
+            'total_spent_cents': totals['total_spent_cents'],
+            'total_activations': totals['total_activations'],
+            'today_transactions': today['transactions'] if today else 0,
+            'today_activations': today['activations'] if today else 0
+        }
+
+    def get_analytics(self, days: int = 7, limit: int = 5) -> Dict:
+        """Revenue per day, top spenders and per-service volume over the last `days` days"""
+        since = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+        conn = self._connect()
+        revenue = conn.execute(
+            "SELECT substr(timestamp, 1, 10) AS day, SUM(amount_cents) FROM transactions "
+            "WHERE type = 'deduct' AND timestamp >= ? GROUP BY day ORDER BY day",
+            (since,)
+        ).fetchall()
+        spenders = conn.execute(
+            "SELECT user_id, SUM(amount_cents) AS spent FROM transactions "
+            "WHERE type = 'deduct' AND timestamp >= ? GROUP BY user_id ORDER BY spent DESC LIMIT ?",
+            (since, limit)
+        ).fetchall()
+        services = conn.execute(
+            "SELECT COALESCE(service, ''), COUNT(*), COALESCE(SUM(cost_cents), 0) FROM activations "
+            "WHERE created_at >= ? GROUP BY 1",
+            (since,)
+        ).fetchall()
+        return {
+            'revenue_by_day': {row[0]: row[1] for row in revenue},
+            'top_spenders': [(row[0], row[1]) for row in spenders],
+            'service_volume': {row[0]: (row[1], row[2]) for row in services}
+        }
+
+    def rebuild_statistics(self) -> Optional[Dict]:
+        """Recompute the running aggregates from the ledger. Returns the previous totals."""
+        with self._connect() as conn:
+            previous = conn.execute('SELECT * FROM stats WHERE id = 1').fetchone()
+            conn.execute('DELETE FROM daily_stats')
+            conn.execute(
+                'INSERT OR REPLACE INTO stats (id, total_balance_cents, total_spent_cents, total_users, '
+                'total_activations) '
+                'SELECT 1, COALESCE(SUM(balance_cents), 0), COALESCE(SUM(total_spent_cents), 0), COUNT(*), '
+                '(SELECT COUNT(*) FROM activations) FROM users'
+            )
+            conn.execute(
+                'INSERT INTO daily_stats (day, transactions, activations) '
+                'SELECT day, SUM(t), SUM(a) FROM ('
+                '  SELECT substr(timestamp, 1, 10) AS day, 1 AS t, 0 AS a FROM transactions'
+                '  UNION ALL'
+                '  SELECT substr(created_at, 1, 10), 0, 1 FROM activations'
+                ') GROUP BY day'
+            )
+            current = conn.execute('SELECT * FROM stats WHERE id = 1').fetchone()
+        if previous is not None and tuple(previous) != tuple(current):
+            logger.warning("Running statistics drifted from the ledger and were rebuilt")
+        return dict(previous) if previous else None
+
+
+def _str_or_none(value) -> Optional[str]:
+    """Convert an ID to string, keeping None as None"""
+    return None if value is None else str(value)
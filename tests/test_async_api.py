@@ -0,0 +1,120 @@
+"""
+AsyncSMSActivateAPI against a local aiohttp server standing in for SMS-Activate
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from api_models import ApiError
+from circuit_breaker import OPEN, CircuitBreaker, CircuitOpenError
+from rate_limiter import RateLimiter
+
+if web is not None:
+    from async_api import AsyncSMSActivateAPI
+
+
+async def _handler(request: 'web.Request') -> 'web.Response':
+    """Answer like the provider; activation id 'boom' fails with a 503"""
+    params = request.query
+    if params.get('api_key') != 'key':
+        return web.Response(text='BAD_KEY')
+    action = params.get('action')
+    if action == 'getBalance':
+        return web.Response(text='ACCESS_BALANCE:12.50')
+    if action == 'getNumberV2':
+        if params.get('service') == 'empty':
+            return web.Response(text='NO_NUMBERS')
+        return web.json_response({'activationId': 123, 'phoneNumber': '79990001122',
+                                  'activationCost': 0.25, 'countryCode': '0'})
+    if action == 'getStatusV2':
+        if params.get('id') == 'boom':
+            return web.Response(status=503, text='unavailable')
+        if params.get('id') == 'gone':
+            return web.Response(text='STATUS_CANCEL')
+        return web.json_response({'verificationType': 0, 'sms': {'code': '4321', 'text': 'code 4321'}})
+    if action == 'setStatus':
+        return web.Response(text='ACCESS_CANCEL')
+    return web.Response(text='BAD_ACTION')
+
+
+@unittest.skipIf(web is None, "aiohttp is not installed")
+class AsyncSMSActivateAPITest(unittest.IsolatedAsyncioTestCase):
+    """Requests go over real HTTP to 127.0.0.1"""
+
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_get('/stubs/handler_api.php', _handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f'http://127.0.0.1:{port}/stubs/handler_api.php'
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    def _client(self, **options) -> 'AsyncSMSActivateAPI':
+        return AsyncSMSActivateAPI('key', base_url=self.base_url, **options)
+
+    async def test_replies_are_parsed(self):
+        async with self._client() as api:
+            self.assertEqual(await api.get_balance(), 'ACCESS_BALANCE:12.50')
+            number = await api.get_number_v2('tg', '0')
+            self.assertTrue(number.ok)
+            self.assertEqual((number.activation_id, number.phone_number), ('123', '79990001122'))
+            self.assertEqual((await api.get_number_v2('empty', '0')).error, ApiError.NO_NUMBERS)
+            self.assertEqual((await api.get_status_v2('1')).code, '4321')
+            self.assertTrue((await api.cancel_activation('1')).cancelled)
+
+    async def test_batch_status_reports_failures_per_activation(self):
+        async with self._client(max_concurrency=2) as api:
+            results = await api.get_statuses_v2(['1', 'boom', 'gone'])
+        self.assertEqual(results['1'].code, '4321')
+        self.assertEqual(results['boom'].error, ApiError.UNKNOWN)
+        self.assertEqual(results['gone'].error, ApiError.STATUS_CANCEL)
+
+    async def test_shared_limiter_and_breaker(self):
+        limiter = RateLimiter(rate=1000, burst=10)
+        breaker = CircuitBreaker(2, 3600, lambda reason: False)
+        self.addCleanup(breaker.close)
+        async with self._client(limiter=limiter, breaker=breaker) as api:
+            await api.get_statuses_v2(['1', 'boom', 'boom'])
+            self.assertEqual(sum(lane['calls'] for lane in limiter.stats().values()), 3)
+            self.assertEqual(breaker.state, OPEN)
+            with self.assertRaises(CircuitOpenError):
+                await api.get_balance()
+
+    async def test_limiter_wait_does_not_block_the_loop(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        try:
+            async with self._client(limiter=limiter) as api:
+                await asyncio.gather(*(api.get_balance() for _ in range(3)))
+        finally:
+            task.cancel()
+        background = limiter.stats()['background']
+        self.assertEqual((background['calls'], background['waited']), (3, 2))
+        self.assertGreaterEqual(background['max_wait'], 0.09)
+        self.assertGreater(ticks, 5)  # The loop kept running while the calls waited for tokens
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Storage backends behave the same through the StorageBackend protocol
+"""
+
+import inspect
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database, StorageBackend
+from dbm_database import DbmDatabase
+from json_database import JSONDatabase
+from sqlite_database import SQLiteDatabase
+
+BACKENDS = {
+    'json': lambda path: JSONDatabase(path + '.json'),
+    'sqlite': lambda path: SQLiteDatabase(path + '.db', import_from=None),
+    'dbm': lambda path: DbmDatabase(path + '.dbm', import_from=None),
+}
+
+TIME_FIELDS = ('created_at', 'timestamp')
+
+
+def _strip_times(value):
+    """The value with wall-clock timestamps removed (they differ between runs)"""
+    if isinstance(value, dict):
+        return {key: _strip_times(item) for key, item in value.items() if key not in TIME_FIELDS}
+    if isinstance(value, list):
+        return [_strip_times(item) for item in value]
+    return value
+
+
+def _exercise(db: Database) -> dict:
+    """Run the same calls against a backend and collect what it answers"""
+    db.create_user(1, 'alice', 'Alice')
+    db.get_or_create_user(2, 'bob')
+    db.set_language(2, 'ru')
+    db.update_user(1, username='alice2')
+    db.add_balance(1, 500, 'top up')
+    refused = db.deduct_balance(2, 1, 'no money')
+    deducted = db.deduct_balance(1, 120, 'order')
+    db.add_transaction(2, 7, 'add', 'bonus')
+    db.add_activation(1, {'activationId': 'a1', 'phoneNumber': '79990001122',
+                          'service': 'tg', 'countryCode': 0}, 120)
+    db.add_activation(2, {'activationId': 'a2', 'service': 'wa', 'countryCode': 16}, 0)
+    db.update_activation('a1', status='completed')
+
+    first_page = db.get_transactions_page(limit=2)
+    second_page = db.get_transactions_page(limit=2, before=first_page['older'])
+    return {
+        'refused': refused,
+        'deducted': deducted,
+        'user': db.get_user(1),
+        'missing_user': db.get_user(99),
+        'language': db.get_language(2),
+        'balances': [db.get_balance(1), db.get_balance(2), db.get_balance(99)],
+        'user_transactions': db.get_user_transactions(1),
+        'activation': db.get_activation('a1'),
+        'missing_activation': db.get_activation('nope'),
+        'user_activations': db.get_user_activations(2),
+        'all_users': sorted(db.get_all_users(), key=lambda user: user['user_id']),
+        'all_transactions': db.get_all_transactions(3),
+        'all_activations': db.get_all_activations(),
+        'export': list(db.export_iter('transactions')),
+        'statistics': db.get_statistics(),
+        'pages': [first_page['items'], first_page['newer'] is None,
+                  second_page['items'], second_page['older'] is None],
+    }
+
+
+class BackendParityTest(unittest.TestCase):
+    """SQLite (and dbm) answer like the JSON backend"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _run(self, backend: str) -> dict:
+        db = Database(backend=BACKENDS[backend](os.path.join(self._tmp.name, backend)))
+        try:
+            return _strip_times(_exercise(db))
+        finally:
+            db.close()
+
+    def test_backends_give_the_same_answers(self):
+        expected = self._run('json')
+        self.assertEqual(expected['balances'], [380, 0, 0])
+        self.assertEqual(expected['activation']['country'], 0)
+        for backend in ('sqlite', 'dbm'):
+            with self.subTest(backend=backend):
+                self.assertEqual(self._run(backend), expected)
+
+    def test_backends_implement_the_protocol(self):
+        methods = [name for name, member in vars(StorageBackend).items()
+                   if callable(member) and not name.startswith('_')]
+        self.assertIn('apply_balance_change', methods)
+        for backend in (JSONDatabase, SQLiteDatabase, DbmDatabase):
+            for name in methods:
+                with self.subTest(backend=backend.__name__, method=name):
+                    expected = list(inspect.signature(getattr(StorageBackend, name)).parameters)
+                    actual = list(inspect.signature(getattr(backend, name)).parameters)
+                    self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+apply_balance_change: concurrent debits never overdraw, balance and ledger row commit together
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbm_database import DbmDatabase
+from journal import read_journal
+from json_database import JSONDatabase
+from sqlite_database import SQLiteDatabase
+
+BACKENDS = {
+    'json': lambda path: JSONDatabase(path + '.json'),
+    'json-journal': lambda path: JSONDatabase(path + '.json', journal=True),
+    'sqlite': lambda path: SQLiteDatabase(path + '.db', import_from=None),
+    'dbm': lambda path: DbmDatabase(path + '.dbm', import_from=None),
+}
+
+
+class BalanceChangeTest(unittest.TestCase):
+    """The same guarantees on every backend"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _open(self, backend: str):
+        db = BACKENDS[backend](os.path.join(self._tmp.name, backend))
+        self.addCleanup(db.close)
+        return db
+
+    def test_concurrent_debits_never_overdraw(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                db = self._open(backend)
+                db.create_user(1)
+                db.add_balance(1, 1000)
+                start = threading.Barrier(20)
+                results = []
+
+                def debit():
+                    start.wait()
+                    results.append(db.apply_balance_change(1, 100, 'deduct'))
+
+                threads = [threading.Thread(target=debit) for _ in range(20)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                accepted = [balance for balance in results if balance is not None]
+                self.assertEqual(len(accepted), 10)
+                self.assertEqual(sorted(accepted), list(range(0, 1000, 100)))
+                self.assertEqual(db.get_balance(1), 0)
+                self.assertEqual(db.get_user(1)['total_spent_cents'], 1000)
+                # One ledger row per accepted debit, none for the refused ones
+                deducts = [t for t in db.get_user_transactions(1) if t['type'] == 'deduct']
+                self.assertEqual(len(deducts), 10)
+
+    def test_refused_debit_changes_nothing(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                db = self._open(backend)
+                db.create_user(1)
+                db.add_balance(1, 50)
+                self.assertIsNone(db.apply_balance_change(1, 51, 'deduct'))
+                self.assertIsNone(db.apply_balance_change(2, 1, 'deduct'))  # no such user
+                self.assertEqual(db.get_balance(1), 50)
+                self.assertEqual(len(db.get_user_transactions(1)), 1)
+
+    def test_sqlite_rolls_back_the_balance_when_the_ledger_row_fails(self):
+        db = self._open('sqlite')
+        db.create_user(1)
+        db.add_balance(1, 500)
+        with mock.patch.object(SQLiteDatabase, '_insert_transaction', side_effect=RuntimeError("disk")):
+            with self.assertRaises(RuntimeError):
+                db.apply_balance_change(1, 200, 'deduct')
+        self.assertEqual(db.get_balance(1), 500)
+        self.assertEqual(db.get_user(1)['total_spent_cents'], 0)
+        self.assertEqual(len(db.get_user_transactions(1)), 1)
+
+    def test_journal_writes_balance_and_ledger_row_as_one_record(self):
+        db = self._open('json-journal')
+        db.create_user(1)
+        db.add_balance(1, 500)
+        self.assertEqual(db.apply_balance_change(1, 200, 'deduct', 'order'), 300)
+        records = [r for r in read_journal(db.journal_file) if r['op'] == 'balance_change']
+        self.assertEqual(len(records), 2)
+        record = records[-1]
+        self.assertEqual(record['fields'], {'balance_cents': 300, 'total_spent_cents': 200})
+        self.assertEqual((record['transaction']['amount_cents'], record['transaction']['type']), (200, 'deduct'))
+
+
+if __name__ == '__main__':
+    unittest.main()
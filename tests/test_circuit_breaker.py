@@ -0,0 +1,167 @@
+"""
+CircuitBreaker state transitions and the purchase gate, with probe timers fired by hand
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+try:
+    import bot
+except ImportError:  # pyTelegramBotAPI is not installed
+    bot = None
+
+
+class FakeTimer:
+    """Stands in for threading.Timer: runs only when the test fires it"""
+
+    created = []
+
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        self.cancelled = False
+        FakeTimer.created.append(self)
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def fire_last_timer():
+    """Run the most recently scheduled probe"""
+    timer = FakeTimer.created[-1]
+    assert timer.started and not timer.cancelled
+    timer.function()
+
+
+class TimerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        FakeTimer.created = []
+        patcher = mock.patch('circuit_breaker.threading.Timer', FakeTimer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CircuitBreakerTest(TimerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.healthy = False
+        self.transitions = []
+        self.breaker = CircuitBreaker(3, 60, lambda reason: self.healthy,
+                                      on_transition=lambda *change: self.transitions.append(change))
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure("timeout")
+        self.breaker.record_failure("timeout")
+        self.breaker.record_success()  # Resets the run
+        self.breaker.record_failure("timeout")
+        self.breaker.record_failure("timeout")
+        self.breaker.check()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.record_failure("503")
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaisesRegex(CircuitOpenError, "503"):
+            self.breaker.check()
+        self.assertEqual(self.transitions, [(CLOSED, OPEN, "503")])
+        self.assertEqual([timer.interval for timer in FakeTimer.created], [60])
+
+    def test_fatal_failure_opens_at_once(self):
+        self.breaker.record_failure("NO_BALANCE", fatal=True)
+        self.assertEqual(self.breaker.state, OPEN)
+        # Further failures while open neither report nor schedule again
+        self.breaker.record_failure("NO_BALANCE", fatal=True)
+        self.assertEqual(len(self.transitions), 1)
+        self.assertEqual(len(FakeTimer.created), 1)
+
+    def test_failed_probe_stays_open_and_tries_again(self):
+        self.breaker.record_failure("down", fatal=True)
+        fire_last_timer()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.transitions, [(CLOSED, OPEN, "down"), (OPEN, HALF_OPEN, "down"), (HALF_OPEN, OPEN, "down")])
+        self.assertEqual(len(FakeTimer.created), 2)
+
+        self.breaker.probe = mock.Mock(side_effect=requests.exceptions.ConnectTimeout())
+        fire_last_timer()  # A probe that raises counts as unhealthy
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(len(FakeTimer.created), 3)
+
+    def test_healthy_probe_closes(self):
+        self.breaker.record_failure("down", fatal=True)
+        self.healthy = True
+        fire_last_timer()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.check()
+        self.assertEqual(self.transitions[-1], (HALF_OPEN, CLOSED, 'provider answered the probe'))
+        self.assertEqual(len(FakeTimer.created), 1)
+        # The failure run starts over after closing
+        self.breaker.record_failure("timeout")
+        self.breaker.record_failure("timeout")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_close_cancels_the_pending_probe(self):
+        self.breaker.record_failure("down", fatal=True)
+        self.breaker.close()
+        self.assertTrue(FakeTimer.created[-1].cancelled)
+
+
+@unittest.skipIf(bot is None, "pyTelegramBotAPI is not installed")
+class PurchaseGateTest(TimerTestCase):
+    """NO_BALANCE stops purchases only, until the account has money again"""
+
+    def setUp(self):
+        super().setUp()
+        self.api = bot.SMSActivateAPI('key', rate_limit=1000, rate_burst=1000)
+        self.addCleanup(self.api.close)
+        self.replies = {}
+        patcher = mock.patch.object(self.api.session, 'get', side_effect=self._reply)
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _reply(self, url, params, timeout):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.replies[params['action']].encode()
+        response.encoding = 'utf-8'
+        return response
+
+    def test_no_balance_closes_purchases_until_topped_up(self):
+        self.replies = {'getNumberV2': 'NO_BALANCE', 'getStatusV2': 'STATUS_WAIT_CODE',
+                        'getBalance': 'ACCESS_BALANCE:0.00'}
+        self.assertEqual(self.api._make_request('getNumberV2', service='tg', country='0'), 'NO_BALANCE')
+        self.assertEqual(self.api.purchase_gate.state, OPEN)
+        self.assertEqual(self.api.breaker.state, CLOSED)
+
+        calls = self.get.call_count
+        with self.assertRaisesRegex(CircuitOpenError, "NO_BALANCE"):
+            self.api._make_request('getNumberV2', service='tg', country='0')
+        self.assertEqual(self.get.call_count, calls)  # Failed without asking the provider
+        self.assertEqual(self.api._make_request('getStatusV2', id='1'), 'STATUS_WAIT_CODE')
+
+        fire_last_timer()  # Balance still zero
+        self.assertEqual(self.api.purchase_gate.state, OPEN)
+
+        self.replies['getBalance'] = 'ACCESS_BALANCE:12.50'
+        self.replies['getNumberV2'] = 'ACCESS_NUMBER:1:79990001122'
+        fire_last_timer()
+        self.assertEqual(self.api.purchase_gate.state, CLOSED)
+        self.assertEqual(self.api._make_request('getNumberV2', service='tg', country='0'),
+                         'ACCESS_NUMBER:1:79990001122')
+
+
+if __name__ == '__main__':
+    unittest.main()
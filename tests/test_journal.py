@@ -0,0 +1,140 @@
+"""
+JSON journal mode: crash replay, compaction and failed writes
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal
+from journal import JournalWriteError, MutationJournal, read_journal
+from json_database import JSONDatabase
+
+
+def _crash(db: JSONDatabase):
+    """Stop a journal-mode database the way a killed process would: no final compaction"""
+    db._stop.set()
+    db.journal.close()
+    db._file_lock.release()
+
+
+class JournalReplayTest(unittest.TestCase):
+    """Mutations acknowledged in journal mode survive a crash"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.db_file = os.path.join(self._tmp.name, 'users.json')
+
+    def _open(self) -> JSONDatabase:
+        db = JSONDatabase(self.db_file, journal=True)
+        self.addCleanup(lambda: db._stop.is_set() or db.close())  # Crashed ones are already stopped
+        return db
+
+    def test_replay_after_crash(self):
+        db = self._open()
+        db.create_user(1, 'alice')
+        db.add_balance(1, 500)
+        self.assertTrue(db.deduct_balance(1, 120))
+        db.add_activation(1, {'activationId': 'a1', 'service': 'tg'}, 120)
+        db.update_activation('a1', status='completed')
+        _crash(db)
+
+        db = self._open()
+        self.assertEqual(db.get_balance(1), 380)
+        self.assertEqual(db.get_user(1)['total_spent_cents'], 120)
+        self.assertEqual([t['amount_cents'] for t in db.get_user_transactions(1)], [120, 500])
+        self.assertEqual(db.get_activation('a1')['status'], 'completed')
+        # Replay was folded into the snapshot: the journal starts empty
+        self.assertEqual(list(read_journal(self.db_file + '.journal')), [])
+
+    def test_torn_last_record_is_ignored(self):
+        db = self._open()
+        db.create_user(1)
+        db.add_balance(1, 500)
+        _crash(db)
+        with open(self.db_file + '.journal', 'a', encoding='utf-8') as f:
+            f.write('{"seq": 99, "op": "balance_ch')
+
+        db = self._open()
+        self.assertEqual(db.get_balance(1), 500)
+
+    def test_compaction_folds_the_journal_into_the_snapshot(self):
+        db = self._open()
+        db.create_user(1)
+        db.add_balance(1, 700)
+        db.compact()
+        self.assertEqual(list(read_journal(self.db_file + '.journal')), [])
+        self.assertFalse(os.path.exists(self.db_file + '.journal.old'))
+        _crash(db)
+
+        db = self._open()
+        self.assertEqual(db.get_balance(1), 700)
+
+    def test_old_segment_from_a_failed_compaction_is_replayed(self):
+        db = self._open()
+        db.create_user(1)
+        db.add_balance(1, 100)
+        # The snapshot write after this rotate never happens
+        db.journal.rotate()
+        db.add_balance(1, 200)
+        _crash(db)
+
+        db = self._open()
+        self.assertEqual(db.get_balance(1), 300)
+
+
+class MutationJournalTest(unittest.TestCase):
+    """The journal file itself"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.path = os.path.join(self._tmp.name, 'users.json.journal')
+        self.journal = MutationJournal(self.path)
+        self.addCleanup(self.journal.close)
+
+    def _seqs(self, path: str):
+        return [record['seq'] for record in read_journal(path)]
+
+    def test_rotate_appends_to_an_existing_old_segment(self):
+        self.journal.wait(self.journal.append({'seq': 1}))
+        old_path = self.journal.rotate()
+        self.journal.wait(self.journal.append({'seq': 2}))
+        self.assertEqual(self.journal.rotate(), old_path)
+        self.assertEqual(self._seqs(old_path), [1, 2])
+        self.assertEqual(self._seqs(self.path), [])
+
+    def test_failed_write_is_not_acknowledged(self):
+        self.journal.wait(self.journal.append({'seq': 1}))
+        broken = [True]
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            if broken[0]:
+                raise OSError(28, 'No space left on device')
+            real_fsync(fd)
+
+        with mock.patch.object(journal, 'JOURNAL_RETRY_INTERVAL', 0.01), \
+                mock.patch.object(journal.os, 'fsync', fsync):
+            ticket = self.journal.append({'seq': 2})
+            with self.assertRaises(JournalWriteError):
+                self.journal.wait(ticket)
+            broken[0] = False
+            while True:
+                try:
+                    self.journal.wait(ticket)
+                    break
+                except JournalWriteError:
+                    time.sleep(0.01)  # The writer has not retried yet
+        # The failed batch was cut off the file, so the retry wrote it once
+        self.assertEqual(self._seqs(self.path), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Integer-cents money model and the float -> cents migration
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_database import JSONDatabase
+from money import apply_multipliers, format_money, legacy_to_cents, migrate_legacy_fields, to_cents
+
+
+class MoneyTest(unittest.TestCase):
+    """money.py helpers"""
+
+    def test_to_cents_rounds_half_up(self):
+        self.assertEqual(to_cents('17.25'), 1725)
+        self.assertEqual(to_cents(0.1), 10)
+        self.assertEqual(to_cents(Decimal('0.005')), 1)
+        self.assertEqual(to_cents('0.004'), 0)
+        self.assertEqual(to_cents(3), 300)
+        self.assertEqual(to_cents(' 2.5 '), 250)
+
+    def test_to_cents_rejects_non_amounts(self):
+        for value in ('abc', '', 'nan', 'inf', None):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    to_cents(value)
+
+    def test_legacy_floats_drop_binary_noise(self):
+        self.assertEqual(legacy_to_cents(1.7249999999999996), 173)
+        self.assertEqual(legacy_to_cents(0.1 + 0.2), 30)
+        self.assertEqual(legacy_to_cents(2.675), 268)  # float 2.67499999... was meant as 2.675
+        self.assertEqual(legacy_to_cents(None), 0)
+        self.assertEqual(legacy_to_cents(-1.005), -101)
+
+    def test_multipliers_round_once(self):
+        # 0.15 * 1.15 = 0.1725: one rounding at the end, not one per factor
+        self.assertEqual(apply_multipliers('0.15', 1.15), 17)
+        self.assertEqual(apply_multipliers(12.3456, 1.1, 0.9), 1222)
+
+    def test_format_money(self):
+        self.assertEqual(format_money(1725), '17.25')
+        self.assertEqual(format_money(5), '0.05')
+        self.assertEqual(format_money(-130), '-1.30')
+        self.assertEqual(format_money(0), '0.00')
+
+    def test_migrate_legacy_fields(self):
+        record = {'user_id': 1, 'balance': 1.7249999999999996, 'total_spent': 0.3, 'username': 'x'}
+        self.assertIs(migrate_legacy_fields(record), record)
+        self.assertEqual(record, {'user_id': 1, 'balance_cents': 173, 'total_spent_cents': 30, 'username': 'x'})
+
+
+class LegacyDatabaseTest(unittest.TestCase):
+    """A users.json written before the switch to cents loads as cents"""
+
+    def test_float_file_is_migrated_on_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, 'users.json')
+            with open(db_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'users': {'1': {'user_id': 1, 'balance': 1.7249999999999996, 'total_spent': 2.675,
+                                    'created_at': '2025-01-01T10:00:00'}},
+                    'transactions': [{'user_id': 1, 'amount': 4.4, 'type': 'add', 'description': '',
+                                      'timestamp': '2025-01-01T10:00:00'}],
+                    'activations': [{'user_id': 1, 'activation_id': 'a1', 'cost': 0.1 + 0.2,
+                                     'created_at': '2025-01-01T10:00:00', 'status': 'completed'}]
+                }, f)
+            db = JSONDatabase(db_file)
+            try:
+                self.assertEqual(db.get_balance(1), 173)
+                self.assertEqual(db.get_user(1)['total_spent_cents'], 268)
+                self.assertEqual(db.get_user_transactions(1)[0]['amount_cents'], 440)
+                self.assertEqual(db.get_activation('a1')['cost_cents'], 30)
+                db.add_balance(1, 27)
+            finally:
+                db.close()
+            with open(db_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            # The next snapshot is written in cents and not converted again
+            self.assertEqual(saved['users']['1']['balance_cents'], 200)
+            self.assertNotIn('balance', saved['users']['1'])
+            db = JSONDatabase(db_file)
+            try:
+                self.assertEqual(db.get_balance(1), 200)
+                self.assertEqual(db.get_activation('a1')['cost_cents'], 30)
+            finally:
+                db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
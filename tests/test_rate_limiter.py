@@ -0,0 +1,134 @@
+"""
+RateLimiter: token bucket and priority lanes, driven by a fake clock
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import Lane, RateLimiter, RateLimitTimeout
+
+# A power of two, so one token's worth of fake time adds up to exactly 1.0
+RATE = 1024
+TICK = 1 / RATE
+
+
+class FakeClock:
+    """Time that only moves when the test says so"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def wait_until(predicate, timeout: float = 5):
+    """Poll until predicate() holds (the deadline only guards against a hung test)"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.001)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_refill_at_rate(self):
+        limiter = RateLimiter(RATE, 3, clock=self.clock)
+        for _ in range(3):
+            self.assertEqual(limiter.acquire(Lane.STATUS), 0)
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire(Lane.STATUS, timeout=0)
+        self.clock.advance(2 * TICK)
+        self.assertEqual(limiter.acquire(Lane.STATUS, timeout=0), 0)
+        self.assertEqual(limiter.acquire(Lane.STATUS, timeout=0), 0)
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire(Lane.STATUS, timeout=0)
+
+    def test_idle_time_never_exceeds_burst(self):
+        limiter = RateLimiter(RATE, 2, clock=self.clock)
+        limiter.acquire()
+        limiter.acquire()
+        self.clock.advance(3600)
+        limiter.acquire(timeout=0)
+        limiter.acquire(timeout=0)
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire(timeout=0)
+
+    def test_timed_out_caller_leaves_the_queue(self):
+        limiter = RateLimiter(RATE, 1, clock=self.clock)
+        limiter.acquire()
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire(Lane.PURCHASE, timeout=0)
+        self.assertEqual(limiter.stats()['purchase']['queued'], 0)
+        self.clock.advance(TICK)
+        self.assertEqual(limiter.acquire(Lane.BACKGROUND, timeout=0), 0)
+
+    def test_try_acquire_never_blocks(self):
+        limiter = RateLimiter(RATE, 1, clock=self.clock)
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND), 0)
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND), TICK)
+        self.clock.advance(TICK / 2)
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND), TICK / 2)
+        self.clock.advance(TICK / 2)
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND, waited=TICK), 0)
+        stats = limiter.stats()['background']
+        self.assertEqual((stats['calls'], stats['waited'], stats['max_wait']), (2, 1, TICK))
+
+    def test_try_acquire_lets_queued_callers_go_first(self):
+        limiter = RateLimiter(RATE, 1, clock=self.clock)
+        limiter.acquire()
+        served = []
+        thread = threading.Thread(target=lambda: served.append(limiter.acquire(Lane.STATUS)))
+        thread.start()
+        wait_until(lambda: limiter.stats()['status']['queued'] == 1)
+        # The next token belongs to the queued status check; a more urgent lane does not wait behind it
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND), 2 * TICK)
+        self.assertEqual(limiter.try_acquire(Lane.PURCHASE), TICK)
+        self.clock.advance(TICK)
+        wait_until(lambda: served)
+        thread.join()
+        self.clock.advance(TICK)
+        self.assertEqual(limiter.try_acquire(Lane.BACKGROUND), 0)
+
+    def test_waiting_callers_are_served_by_lane_then_arrival(self):
+        limiter = RateLimiter(RATE, 1, clock=self.clock)
+        limiter.acquire()  # The bucket is empty from here on
+        served = []
+        lanes = [Lane.BACKGROUND, Lane.CATALOG, Lane.BACKGROUND, Lane.STATUS, Lane.PURCHASE]
+        threads = []
+        for number, lane in enumerate(lanes):
+            queued = sum(lane_stats['queued'] for lane_stats in limiter.stats().values())
+            thread = threading.Thread(target=lambda n=number, l=lane: (limiter.acquire(l), served.append(n)))
+            thread.start()
+            threads.append(thread)
+            # Start the next caller only once this one is in the queue, so arrival order is fixed
+            wait_until(lambda: sum(s['queued'] for s in limiter.stats().values()) == queued + 1)
+
+        for count in range(1, len(lanes) + 1):
+            self.clock.advance(TICK)  # Exactly one token
+            wait_until(lambda: len(served) == count)
+            self.assertEqual(len(served), count)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(served, [4, 3, 1, 0, 2])
+        stats = limiter.stats()
+        self.assertEqual((stats['purchase']['waited'], stats['purchase']['max_wait']), (1, TICK))
+        self.assertEqual((stats['background']['calls'], stats['background']['waited']), (3, 2))
+        self.assertEqual(stats['background']['max_wait'], 5 * TICK)
+
+
+if __name__ == '__main__':
+    unittest.main()
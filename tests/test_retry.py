@@ -0,0 +1,91 @@
+"""
+Per-action retry policy of SMSActivateAPI: what is retried, and what never is
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import bot
+except ImportError:  # pyTelegramBotAPI is not installed
+    bot = None
+
+
+def _response(status: int, text: str = '') -> requests.Response:
+    """A finished HTTP response"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = text.encode()
+    response.encoding = 'utf-8'
+    return response
+
+
+@unittest.skipIf(bot is None, "pyTelegramBotAPI is not installed")
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = bot.SMSActivateAPI('key', rate_limit=1000, rate_burst=1000, retry_attempts=2)
+        self.addCleanup(self.api.close)
+        self.get = mock.patch.object(self.api.session, 'get').start()
+        # Backoff delays are not waited out, only recorded
+        self.sleep = mock.patch('bot.time.sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_status_check_retries_transient_failures(self):
+        self.get.side_effect = [requests.exceptions.ReadTimeout(), _response(503), _response(200, 'STATUS_WAIT_CODE')]
+        self.assertEqual(self.api._make_request('getStatusV2', id='1'), 'STATUS_WAIT_CODE')
+        self.assertEqual(self.get.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertEqual(self.api.retries.stats(), {'getStatusV2': {'retries': 2, 'recovered': 1, 'gave_up': 0}})
+
+    def test_gives_up_after_the_last_attempt(self):
+        self.get.side_effect = [_response(502)] * 3
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.api.get_balance()
+        self.assertEqual(self.get.call_count, 3)
+        self.assertEqual(self.api.retries.stats(), {'getBalance': {'retries': 2, 'recovered': 0, 'gave_up': 1}})
+
+    def test_client_errors_are_not_retried(self):
+        self.get.side_effect = [_response(404)]
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.api.get_balance()
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_purchase_is_not_retried_once_sent(self):
+        # The provider may have sold the number already: a retry could buy a second one
+        for error in (requests.exceptions.ReadTimeout(), _response(503)):
+            with self.subTest(error=error):
+                self.get.reset_mock()
+                self.get.side_effect = [error, _response(200, 'never asked')]
+                with self.assertRaises(requests.exceptions.RequestException):
+                    self.api._make_request('getNumberV2', service='tg', country='0')
+                self.assertEqual(self.get.call_count, 1)
+        self.sleep.assert_not_called()
+        self.assertEqual(self.api.retries.stats(), {})
+
+    def test_purchase_is_retried_when_it_never_left(self):
+        self.get.side_effect = [requests.exceptions.ConnectTimeout(), _response(200, 'NO_NUMBERS')]
+        self.assertEqual(self.api._make_request('getNumberV2', service='tg', country='0'), 'NO_NUMBERS')
+        self.assertEqual(self.get.call_count, 2)
+        self.assertEqual(self.api.retries.stats()['getNumberV2']['recovered'], 1)
+
+    def test_cancel_is_retried_but_other_status_changes_are_not(self):
+        self.get.side_effect = [requests.exceptions.ReadTimeout(), _response(200, 'ACCESS_CANCEL')]
+        self.assertEqual(self.api.set_status('1', self.api.CANCEL_STATUS), 'ACCESS_CANCEL')
+        self.assertEqual(self.get.call_count, 2)
+
+        self.get.reset_mock()
+        self.get.side_effect = [requests.exceptions.ReadTimeout(), _response(200, 'ACCESS_READY')]
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.api.set_status('1', 6)
+        self.assertEqual(self.get.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+SingleFlight: concurrent callers for one key share a single call
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import SingleFlight
+
+
+def wait_until(predicate, timeout: float = 5):
+    """Poll until predicate() holds (the deadline only guards against a hung test)"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.001)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def _slow(self, result):
+        """A call that blocks until the test releases it"""
+        def call():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return call
+
+    def _run_callers(self, key, fn, count: int):
+        """Start `count` callers for `key`, release the call once all are waiting; return what each got"""
+        outcomes = []
+
+        def caller():
+            try:
+                outcomes.append(self.flights.do(key, fn))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(count)]
+        threads[0].start()
+        self.started.wait(5)  # The first caller leads
+        for thread in threads[1:]:
+            thread.start()
+        wait_until(lambda: self.flights.shared == count - 1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        outcomes = self._run_callers('prices', self._slow({'tg': 1}), 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.shared, 4)
+        self.assertEqual(outcomes, [{'tg': 1}] * 5)
+
+    def test_error_reaches_every_caller(self):
+        error = RuntimeError("provider down")
+        outcomes = self._run_callers('prices', self._slow(error), 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [error] * 3)
+
+    def test_different_keys_do_not_share(self):
+        self.assertEqual(self.flights.do('a', lambda: 1), 1)
+        self.assertEqual(self.flights.do('b', lambda: 2), 2)
+        self.assertEqual(self.flights.shared, 0)
+
+    def test_next_caller_after_completion_starts_a_new_call(self):
+        self.release.set()
+        self.assertEqual(self.flights.do('prices', self._slow('first')), 'first')
+        self.assertEqual(self.flights.do('prices', self._slow('second')), 'second')
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.flights.shared, 0)
+        with self.assertRaises(RuntimeError):
+            self.flights.do('prices', self._slow(RuntimeError("once")))
+        # A failed call is not cached either
+        self.assertEqual(self.flights.do('prices', lambda: 'third'), 'third')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Per-update user context
+The sender's user record, language, balance and superuser flag, resolved once per Telegram update
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from telebot.handler_backends import BaseMiddleware
+
+
+@dataclass(slots=True)
+class UserContext:
+    """What the handlers need to know about the user behind one update"""
+    user_id: int
+    user: Optional[Dict]  # None until /start creates the user
+    lang: str
+    balance: int  # cents, as of the start of the update
+    is_superuser: bool
+
+    @classmethod
+    def resolve(cls, db, user_id: int, superuser_id: int) -> 'UserContext':
+        """Build the context from a single user lookup"""
+        user = db.get_user(user_id)
+        return cls(
+            user_id=user_id,
+            user=user,
+            lang=user.get('language', 'en') if user else 'en',
+            balance=user.get('balance_cents', 0) if user else 0,
+            is_superuser=user_id == superuser_id
+        )
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Passes a UserContext to every message and callback handler as `ctx`"""
+
+    def __init__(self, db, superuser_id: int):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+        self.db = db
+        self.superuser_id = superuser_id
+
+    def pre_process(self, update, data: Dict):
+        data['ctx'] = UserContext.resolve(self.db, update.from_user.id, self.superuser_id)
+
+    def post_process(self, update, data: Dict, exception):
+        pass